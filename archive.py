@@ -0,0 +1,137 @@
+"""
+Append-only archive of the raw API pages fetched by each crawl run.
+
+Every run gets one gzip-compressed NDJSON file holding one line per page:
+`{"page": <n>, "fetched_at": "<timestamp>", "body": <raw API response>}`.
+When the run finishes, a `{"run": <crawl_runs row>}` line records its
+metadata. The archive lets the products and price_history tables be rebuilt
+offline, in the same database or a new one.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PATTERN = re.compile(r"^run-(\d+)\.ndjson\.gz$")
+
+
+def archive_path(directory: str, run_id: int) -> str:
+    """Returns the archive file of a crawl run."""
+    return os.path.join(directory, f"run-{run_id:06d}.ndjson.gz")
+
+
+def list_archived_runs(directory: str) -> List[int]:
+    """Returns the ids of all archived crawl runs in ascending order."""
+    if not os.path.isdir(directory):
+        return []
+    runs = []
+    for name in os.listdir(directory):
+        match = ARCHIVE_PATTERN.match(name)
+        if match:
+            runs.append(int(match.group(1)))
+    return sorted(runs)
+
+
+class CrawlArchive:
+    """
+    Appends the raw pages of one crawl run to its archive file.
+
+    A resumed run appends a new gzip member to the same file. Pages are
+    written before their transaction commits, so a page may appear twice
+    after a resume; readers keep the last copy.
+    """
+
+    def __init__(self, directory: str, run_id: int, compresslevel: int = 6):
+        self.path = archive_path(directory, run_id)
+        self.compresslevel = compresslevel
+        self.pages_written = 0
+        self._file = None
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = gzip.open(self.path, "ab", self.compresslevel)
+
+    def write_page(self, page: int, body: bytes, fetched_at: str):
+        """
+        Appends one raw page body. The body is embedded as-is; a JSON document
+        can only contain raw newlines as whitespace, so they are blanked to
+        keep one page per line.
+        """
+        prefix = json.dumps({"page": page, "fetched_at": fetched_at})[:-1].encode("utf-8")
+        body = body.replace(b"\r", b" ").replace(b"\n", b" ")
+        self._file.write(prefix + b', "body": ' + body + b"}\n")
+        self.pages_written += 1
+
+    def write_run(self, run: Dict[str, Any]):
+        """
+        Appends the run's crawl_runs row. A resumed run writes it again when
+        it finishes; readers keep the last copy.
+        """
+        self._file.write(json.dumps({"run": run}).encode("utf-8") + b"\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_archive(path: str) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+    """
+    Yields (page, fetched_at, response data) for every page in an archive file.
+
+    A truncated tail, left by a crawl that was killed mid-write, ends the
+    iteration with a warning instead of an error.
+    """
+    with gzip.open(path, "rb") as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping truncated record in {path}")
+                    continue
+                if "page" in record:
+                    yield record["page"], record["fetched_at"], record["body"]
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            logger.warning(f"Archive {path} ends with an incomplete block: {e}")
+
+
+def load_run_pages(path: str) -> Dict[int, Tuple[str, Dict[str, Any]]]:
+    """
+    Returns {page: (fetched_at, response data)} for an archive file, keeping
+    the last copy of pages that were archived more than once.
+    """
+    pages: Dict[int, Tuple[str, Dict[str, Any]]] = {}
+    for page, fetched_at, data in read_archive(path):
+        pages[page] = (fetched_at, data)
+    return pages
+
+
+def load_run_info(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the last crawl_runs row recorded in an archive file, or None for
+    archives of runs that never finished or predate run records.
+    """
+    run = None
+    with gzip.open(path, "rb") as f:
+        try:
+            for line in f:
+                if line.startswith(b'{"run": '):
+                    try:
+                        run = json.loads(line)["run"]
+                    except ValueError:
+                        logger.warning(f"Skipping truncated run record in {path}")
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            logger.warning(f"Archive {path} ends with an incomplete block: {e}")
+    return run
+
+
+def find_archive(directory: str, run_id: int) -> Optional[str]:
+    """Returns the archive file of a run if it exists."""
+    path = archive_path(directory, run_id)
+    return path if os.path.exists(path) else None
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+End-to-end ingest benchmarks against the local mock API.
+
+Each catalogue size is crawled in a fresh child process with its own
+temporary database, so peak RSS is measured per run.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+
+from mock_api import MockApi, MockApiServer, generate_products
+
+DEFAULT_SIZES = [10000, 50000, 200000]
+BATCH_SIZE = 30
+HISTORY_PRODUCTS = 20000
+HISTORY_QUERIES = 2000
+HISTORY_DAYS = 30
+SEARCH_REPEAT = 20
+SEARCH_LIMIT = 50
+# Common words, a prefix, two words, an unaccented spelling of "Röda", a rare
+# vintage and a miss. The mock catalogue names are built from
+# mock_api.NAME_WORDS, so single words match about a tenth of it.
+SEARCH_QUERIES = ["Röda", "ekf", "gamla slott", "roda", "2011", "xyzzy"]
+# Misspelled names for fuzzy search, which the other searches do not find.
+FUZZY_QUERIES = ["Norrlnd", "gamal slot", "ekfatt", "Brygghuss", "xyzzy"]
+
+# get_price_history's query against the price_history layout before migration 3.
+LEGACY_HISTORY_QUERY = """
+    SELECT price, timestamp FROM price_history
+    WHERE productId = ? AND timestamp >= ?
+    ORDER BY timestamp ASC
+"""
+CLUSTERED_HISTORY_QUERY = """
+    SELECT price_ore / 100.0, datetime(ts, 'unixepoch') FROM price_history
+    WHERE productId = ? AND ts >= CAST(strftime('%s', ?) AS INTEGER)
+    ORDER BY ts ASC
+"""
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KiB elsewhere.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_crawl_benchmark(product_count: int, latency: float = 0.0, error_rate: float = 0.0,
+                        throttle_rate: float = 0.0, seed: int = 0) -> Dict[str, Any]:
+    """
+    Crawls a synthetic catalogue served by the mock API into a temporary
+    database, crawls it again to time revalidation against the response
+    cache, then times batch_insert_products on the same data.
+    """
+    import main
+
+    # Per-request INFO logging would dominate the timings.
+    logging.getLogger().setLevel(logging.WARNING)
+    products = generate_products(product_count, seed)
+    api = MockApi(products, latency, error_rate, throttle_rate, seed=seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        crawl_db = os.path.join(tmp, "crawl.db")
+        os.environ["SYSTEMET_HTTP_CACHE"] = os.path.join(tmp, "http_cache.db")
+        with MockApiServer(api) as server, open(os.devnull, "w") as devnull:
+            started = time.perf_counter()
+            with redirect_stdout(devnull):
+                summary = main.fetch_products_from_api(db_name=crawl_db, api_base_url=server.url)
+            wall_time = time.perf_counter() - started
+            requests_made = api.stats()["requests"]
+            started = time.perf_counter()
+            with redirect_stdout(devnull):
+                recrawl = main.fetch_products_from_api(db_name=crawl_db, api_base_url=server.url)
+            recrawl_time = time.perf_counter() - started
+        if summary is None or recrawl is None:
+            raise RuntimeError("Crawl against the mock API failed")
+
+        batch_db = os.path.join(tmp, "batch.db")
+        main.initialize_database(batch_db)
+        batches = [products[i:i + BATCH_SIZE] for i in range(0, len(products), BATCH_SIZE)]
+        started = time.perf_counter()
+        for batch in batches:
+            main.batch_insert_products(batch, batch_db)
+        batch_time = time.perf_counter() - started
+        started = time.perf_counter()
+        for batch in batches:
+            main.batch_insert_products(batch, batch_db, delta_only=True)
+        batch_delta_time = time.perf_counter() - started
+
+    return {
+        'products': product_count,
+        'wall_time': wall_time,
+        'requests': requests_made,
+        'requests_per_sec': requests_made / wall_time,
+        'products_per_sec': summary['products_processed'] / wall_time,
+        'db_write_time': summary['db_write_time'],
+        'failed_pages': summary['failed_pages'],
+        'recrawl_time': recrawl_time,
+        'cache_hit_ratio': recrawl['cache']['hit_ratio'],
+        'batch_insert_time': batch_time,
+        'batch_delta_time': batch_delta_time,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _time_history_queries(conn, sql: str, product_ids: List[str], cutoff: str) -> Tuple[float, int]:
+    """Runs one history query per product id; returns (mean seconds, rows returned)."""
+    rows = 0
+    started = time.perf_counter()
+    for product_id in product_ids:
+        rows += len(conn.execute(sql, (product_id, cutoff)).fetchall())
+    return (time.perf_counter() - started) / len(product_ids), rows
+
+
+def run_history_benchmark(row_count: int, product_count: int = HISTORY_PRODUCTS,
+                          queries: int = HISTORY_QUERIES, seed: int = 0) -> Dict[str, Any]:
+    """
+    Times per-product price history reads on a synthetic price_history of
+    `row_count` rows, first in the old rowid/TEXT-timestamp layout and then
+    after migrating it to the clustered (productId, ts) layout.
+
+    Rows are written one crawl at a time (every product per day), like real
+    crawls, so the old layout scatters each product's history across the file.
+    """
+    import main
+    import migrations
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(seed)
+    product_ids = [f"p{index:07d}" for index in range(product_count)]
+    days = max(1, row_count // product_count)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    cutoff = (start + timedelta(days=days - HISTORY_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+    sample = [rng.choice(product_ids) for _ in range(queries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.db")
+        conn = main.get_database_connection(path)
+        migrations.migrate(conn, target=2)
+        with conn:
+            conn.executemany("INSERT INTO products (productId) VALUES (?)", [(p,) for p in product_ids])
+            for day in range(days):
+                timestamp = (start + timedelta(days=day)).strftime("%Y-%m-%d %H:%M:%S")
+                conn.executemany(
+                    "INSERT INTO price_history (productId, price, timestamp) VALUES (?, ?, ?)",
+                    [(p, round(rng.uniform(50, 500), 2), timestamp) for p in product_ids]
+                )
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        legacy_size = os.path.getsize(path)
+        legacy_time, legacy_rows = _time_history_queries(conn, LEGACY_HISTORY_QUERY, sample, cutoff)
+
+        started = time.perf_counter()
+        migrations.migrate(conn)
+        migration_time = time.perf_counter() - started
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        clustered_size = os.path.getsize(path)
+        clustered_time, clustered_rows = _time_history_queries(conn, CLUSTERED_HISTORY_QUERY, sample, cutoff)
+        conn.close()
+
+    if legacy_rows != clustered_rows:
+        raise RuntimeError(f"History queries disagree: {legacy_rows} vs {clustered_rows} rows")
+    return {
+        'rows': days * product_count,
+        'products': product_count,
+        'queries': queries,
+        'rows_per_query': clustered_rows / queries,
+        'legacy_query_ms': legacy_time * 1000,
+        'clustered_query_ms': clustered_time * 1000,
+        'speedup': legacy_time / clustered_time if clustered_time else None,
+        'migration_time': migration_time,
+        'legacy_size_mb': legacy_size / (1024 * 1024),
+        'clustered_size_mb': clustered_size / (1024 * 1024),
+    }
+
+
+def format_history_report(r: Dict[str, Any]) -> str:
+    """Formats a history benchmark result."""
+    return "\n".join([
+        f"price_history rows: {r['rows']:,} ({r['products']:,} products, "
+        f"{r['rows_per_query']:.0f} rows per {HISTORY_DAYS}-day query)",
+        f"{'layout':<10} {'query ms':>9} {'size MiB':>9}",
+        f"{'legacy':<10} {r['legacy_query_ms']:>9.3f} {r['legacy_size_mb']:>9.1f}",
+        f"{'clustered':<10} {r['clustered_query_ms']:>9.3f} {r['clustered_size_mb']:>9.1f}",
+        f"speedup {r['speedup']:.1f}x, migration {r['migration_time']:.1f}s",
+    ])
+
+
+def run_search_benchmark(product_count: int, queries: List[str] = SEARCH_QUERIES,
+                         fuzzy_queries: List[str] = FUZZY_QUERIES, repeat: int = SEARCH_REPEAT,
+                         seed: int = 0) -> Dict[str, Any]:
+    """
+    Times product search with the LIKE scan and with the products_fts index,
+    and fuzzy search of misspelled names, on a synthetic catalogue of
+    `product_count` products.
+    """
+    import db
+    import main
+    import utils
+
+    logging.getLogger().setLevel(logging.WARNING)
+    products = generate_products(product_count, seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search.db")
+        main.initialize_database(path)
+        for i in range(0, len(products), 1000):
+            main.batch_insert_products(products[i:i + 1000], path)
+        conn = main.get_database_connection(path)
+        results = []
+        for query in queries:
+            pattern = f"%{query}%"
+            like_args = (pattern, pattern, pattern, SEARCH_LIMIT)
+            fts_args = (utils.fts_query(query), SEARCH_LIMIT)
+            timings = {}
+            for label, sql, params in (("like", utils.SEARCH_PRODUCTS_SQL, like_args),
+                                       ("fts", utils.SEARCH_PRODUCTS_FTS_SQL, fts_args)):
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    rows = conn.execute(sql, params).fetchall()
+                timings[label] = ((time.perf_counter() - started) / repeat, len(rows))
+            results.append({
+                'query': query,
+                'like_ms': timings['like'][0] * 1000,
+                'like_rows': timings['like'][1],
+                'fts_ms': timings['fts'][0] * 1000,
+                'fts_rows': timings['fts'][1],
+            })
+        conn.close()
+
+        fuzzy = []
+        for query in fuzzy_queries:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                rows = utils.fuzzy_search_products(query, SEARCH_LIMIT, db_name=path)
+            fuzzy.append({
+                'query': query,
+                'fuzzy_ms': (time.perf_counter() - started) / repeat * 1000,
+                'fuzzy_rows': len(rows),
+                'best_match': f"{rows[0]['productNameBold']} ({rows[0]['similarity']:.2f})" if rows else None,
+            })
+        db.close_connections()
+
+    return {'products': product_count, 'limit': SEARCH_LIMIT, 'queries': results, 'fuzzy': fuzzy}
+
+
+def format_search_report(r: Dict[str, Any]) -> str:
+    """Formats a search benchmark result."""
+    lines = [
+        f"search over {r['products']:,} products (LIMIT {r['limit']})",
+        f"{'query':<14} {'LIKE ms':>9} {'rows':>5} {'FTS ms':>9} {'rows':>5}",
+    ]
+    for q in r['queries']:
+        lines.append(f"{q['query']:<14} {q['like_ms']:>9.3f} {q['like_rows']:>5} "
+                     f"{q['fts_ms']:>9.3f} {q['fts_rows']:>5}")
+    lines.append(f"{'fuzzy query':<14} {'ms':>9} {'rows':>5}  best match")
+    for q in r['fuzzy']:
+        lines.append(f"{q['query']:<14} {q['fuzzy_ms']:>9.3f} {q['fuzzy_rows']:>5}  {q['best_match'] or '-'}")
+    return "\n".join(lines)
+
+
+def run_in_subprocess(product_count: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Runs one benchmark size in a child process and returns its result."""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--single", str(product_count),
+        "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+        "--throttle-rate", str(args.throttle_rate), "--seed", str(args.seed),
+    ]
+    env = dict(os.environ)
+    if args.concurrency:
+        env["SYSTEMET_CONCURRENCY"] = str(args.concurrency)
+    # Keep the child's log file out of the working tree.
+    with tempfile.TemporaryDirectory() as tmp:
+        output = subprocess.run(command, cwd=tmp, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def format_report(results: List[Dict[str, Any]]) -> str:
+    """Formats benchmark results as a fixed-width table."""
+    header = (f"{'products':>9} {'wall s':>8} {'req/s':>8} {'prod/s':>9} {'db write s':>10} "
+              f"{'recrawl s':>9} {'hit %':>6} {'batch s':>8} {'delta s':>8} {'peak MiB':>9}")
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['products']:>9} {r['wall_time']:>8.2f} {r['requests_per_sec']:>8.1f} "
+            f"{r['products_per_sec']:>9.1f} {r['db_write_time']:>10.2f} "
+            f"{r['recrawl_time']:>9.2f} {r['cache_hit_ratio']:>6.0%} "
+            f"{r['batch_insert_time']:>8.2f} {r['batch_delta_time']:>8.2f} {r['peak_rss_mb']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Adds the benchmark options; shared by this script and `cli.py bench`."""
+    parser.add_argument("--products", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Catalogue sizes to benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock API latency per request in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 503 responses")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of 429 responses")
+    parser.add_argument("--concurrency", type=int, help="Override SYSTEMET_CONCURRENCY for the crawl")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic catalogue")
+    parser.add_argument("--history-rows", type=int,
+                        help="Benchmark price history queries on a table of this many rows instead of a crawl")
+    parser.add_argument("--search", type=int, metavar="PRODUCTS",
+                        help="Benchmark LIKE against full-text search on this many products instead of a crawl")
+    parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark a full crawl against the local mock API")
+    add_arguments(parser)
+    return parser
+
+
+def run(args: argparse.Namespace):
+    """Runs the benchmark for every requested size and prints the report."""
+    if args.history_rows:
+        result = run_history_benchmark(args.history_rows, seed=args.seed)
+        print(json.dumps(result, indent=2) if args.json else format_history_report(result))
+        return
+
+    if args.search:
+        result = run_search_benchmark(args.search, seed=args.seed)
+        print(json.dumps(result, indent=2) if args.json else format_search_report(result))
+        return
+
+    if args.single:
+        result = run_crawl_benchmark(args.single, args.latency, args.error_rate, args.throttle_rate, args.seed)
+        print(json.dumps(result))
+        return
+
+    results = []
+    for size in args.products:
+        if not args.json:
+            print(f"Benchmarking full crawl of {size} products...", flush=True)
+        results.append(run_in_subprocess(size, args))
+    print(json.dumps(results, indent=2) if args.json else "\n" + format_report(results))
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -14,6 +14,9 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 import main
 import deploy
 import utils
+import benchmark
+import compaction
+import query_plans
 from config import get_config
 
 def main_cli():
@@ -24,10 +27,26 @@ def main_cli():
         epilog="""
 Examples:
   python cli.py update          # Update product database
+  python cli.py update --resume # Finish an interrupted update
+  python cli.py update --no-cache # Reprocess every page, ignoring the response cache
+  python cli.py update --mode delta # Fetch only new and recently launched products
+  python cli.py update --mode auto  # Delta crawl, or full crawl when the last one is too old
+  python cli.py update --sharded    # Full crawl split into per-category shards
   python cli.py generate        # Generate web interface
   python cli.py stats           # Show database statistics
+  python cli.py stats --recompute  # Verify the materialized statistics against a full pass
   python cli.py search "vodka"  # Search for products
+  python cli.py search "gaml rod"  # Prefix words, å/ä/ö optional
+  python cli.py search --fuzzy "glenfidich"  # Tolerate misspellings
   python cli.py product 12345   # Get product details
+  python cli.py bench           # Benchmark a crawl against the mock API
+  python cli.py bench --search 50000  # Compare LIKE and full-text search
+  python cli.py reprocess 42    # Replay archived crawl run 42 without network access
+  python cli.py reprocess --rebuild  # Rebuild products and history from every archived run
+  python cli.py compact         # Drop repeated prices from the history and reclaim space
+  python cli.py compact --downsample-after 365 --bucket month  # Monthly points for older history
+  python cli.py compact --full-vacuum  # Convert an older database to incremental VACUUM (one-off)
+  python cli.py check-plans     # Check that every read query uses an index
         """
     )
     
@@ -36,6 +55,19 @@ Examples:
     # Update command
     update_parser = subparsers.add_parser('update', help='Update product database from API')
     update_parser.add_argument('--force', action='store_true', help='Force update even if recent data exists')
+    update_parser.add_argument('--resume', action='store_true',
+                               help='Continue only the missing pages of the latest unfinished crawl')
+    update_parser.add_argument('--no-cache', action='store_true',
+                               help='Fetch and process every page, ignoring the response cache')
+    update_parser.add_argument('--mode', choices=main.CRAWL_MODES, default=main.MODE_FULL,
+                               help='full: every page; delta: newest launches first, stopping at known '
+                                    'data; auto: full if the last full crawl is older than '
+                                    'SYSTEMET_FULL_CRAWL_INTERVAL_HOURS, else delta (default: full)')
+    update_parser.add_argument('--sharded', action='store_true',
+                               help='Split a full crawl into shards by SYSTEMET_SHARD_FIELD and crawl them in parallel')
+    update_parser.add_argument('--stop-after', type=int,
+                               help='Consecutive unchanged pages before a delta crawl stops '
+                                    '(default: SYSTEMET_DELTA_STOP_PAGES)')
     
     # Generate command
     generate_parser = subparsers.add_parser('generate', help='Generate web interface')
@@ -44,11 +76,15 @@ Examples:
     # Stats command
     stats_parser = subparsers.add_parser('stats', help='Show database statistics')
     stats_parser.add_argument('--json', action='store_true', help='Output in JSON format')
+    stats_parser.add_argument('--recompute', action='store_true',
+                              help='Recompute from all products, verify and refresh the materialized statistics')
     
     # Search command
     search_parser = subparsers.add_parser('search', help='Search for products')
     search_parser.add_argument('query', help='Search query')
     search_parser.add_argument('--limit', type=int, default=10, help='Maximum number of results')
+    search_parser.add_argument('--fuzzy', action='store_true',
+                               help='Tolerate misspelled product and producer names (trigram similarity)')
     
     # Product command
     product_parser = subparsers.add_parser('product', help='Get product details')
@@ -58,6 +94,37 @@ Examples:
     # Full update command
     full_parser = subparsers.add_parser('full-update', help='Update database and generate web interface')
     
+    # Benchmark command
+    bench_parser = subparsers.add_parser('bench', help='Benchmark a full crawl against the local mock API')
+    benchmark.add_arguments(bench_parser)
+
+    # Reprocess command
+    reprocess_parser = subparsers.add_parser('reprocess', help='Replay archived crawl runs into the database')
+    reprocess_parser.add_argument('runs', type=int, nargs='*',
+                                  help='Crawl run ids to replay in order (default: every archived run)')
+    reprocess_parser.add_argument('--rebuild', action='store_true',
+                                  help='Empty products and price_history before replaying')
+    reprocess_parser.add_argument('--archive-dir', help='Archive directory (default: SYSTEMET_ARCHIVE_DIR)')
+
+    # Compact command
+    compact_parser = subparsers.add_parser('compact', help='Compact price history and reclaim disk space')
+    compact_parser.add_argument('--downsample-after', type=float, metavar='DAYS',
+                                help='Keep one price point per bucket for history older than DAYS '
+                                     '(default: SYSTEMET_HISTORY_DOWNSAMPLE_DAYS, 0 disables)')
+    compact_parser.add_argument('--bucket', choices=sorted(compaction.BUCKET_FORMATS),
+                                help='Downsampling bucket (default: SYSTEMET_HISTORY_DOWNSAMPLE_BUCKET)')
+    compact_parser.add_argument('--no-vacuum', action='store_true', help='Do not reclaim the freed space')
+    compact_parser.add_argument('--full-vacuum', action='store_true',
+                                help='Switch an older database to incremental auto_vacuum with a one-off full '
+                                     'VACUUM (rewrites the file, needs up to twice its size in free disk)')
+    compact_parser.add_argument('--json', action='store_true', help='Output in JSON format')
+
+    # Query plan check command
+    plans_parser = subparsers.add_parser('check-plans',
+                                         help='Fail if a read query scans a table or sorts in a temp B-tree')
+    plans_parser.add_argument('--db', help='Check against an in-memory copy of this database instead of a fresh schema')
+    plans_parser.add_argument('--verbose', action='store_true', help='Print the plan of every query')
+    
     args = parser.parse_args()
     
     if not args.command:
@@ -77,6 +144,14 @@ Examples:
             handle_product(args)
         elif args.command == 'full-update':
             handle_full_update(args)
+        elif args.command == 'bench':
+            handle_bench(args)
+        elif args.command == 'reprocess':
+            handle_reprocess(args)
+        elif args.command == 'compact':
+            handle_compact(args)
+        elif args.command == 'check-plans':
+            handle_check_plans(args)
         else:
             print(f"Unknown command: {args.command}")
             sys.exit(1)
@@ -93,7 +168,8 @@ def handle_update(args):
     print("Updating product database from Systembolaget API...")
     print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
-    main.fetch_products_from_api()
+    main.fetch_products_from_api(resume=args.resume, use_cache=not args.no_cache,
+                                 mode=args.mode, stop_after=args.stop_after, sharded=args.sharded)
     
     print(f"Update completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
@@ -115,10 +191,16 @@ def handle_stats(args):
     """Handle the stats command."""
     print("Getting database statistics...")
     
-    stats = utils.get_price_statistics()
+    mismatches = None
+    if args.recompute:
+        stats, mismatches = utils.recompute_price_statistics()
+    else:
+        stats = utils.get_price_statistics()
     
     if args.json:
         import json
+        if mismatches is not None:
+            stats['mismatches'] = mismatches
         print(json.dumps(stats, indent=2))
     else:
         print("\n=== Database Statistics ===")
@@ -128,6 +210,7 @@ def handle_stats(args):
         print(f"Price Increases: {stats.get('price_increases', 0)}")
         print(f"Price Decreases: {stats.get('price_decreases', 0)}")
         print(f"Price Stable: {stats.get('price_stable', 0)}")
+        print(f"Delisted Products: {stats.get('delisted_products', 0):,}")
         
         top_categories = stats.get('top_categories', [])
         if top_categories:
@@ -140,12 +223,24 @@ def handle_stats(args):
             print("\n=== Best Value Products ===")
             for product in best_value[:5]:
                 print(f"{product['name']}: {product['price']:.2f} kr (APK: {product['apk']:.2f})")
+        
+        if mismatches is not None:
+            print("\n=== Materialized Statistics ===")
+            if mismatches:
+                print(f"{len(mismatches)} values differed from the full recompute and were corrected:")
+                for mismatch in mismatches:
+                    print(f"  {mismatch}")
+            else:
+                print("Matched the full recompute")
 
 def handle_search(args):
     """Handle the search command."""
     print(f"Searching for: '{args.query}'")
     
-    results = utils.search_products(args.query, args.limit)
+    if args.fuzzy:
+        results = utils.fuzzy_search_products(args.query, args.limit)
+    else:
+        results = utils.search_products(args.query, args.limit)
     
     if not results:
         print("No products found.")
@@ -162,6 +257,8 @@ def handle_search(args):
         print(f"Price: {product['price']:.2f} kr")
         print(f"APK: {product['apk']:.2f}")
         print(f"Volume: {product['volume']:.0f} ml, Alcohol: {product['alcoholPercentage']:.1f}%")
+        if 'similarity' in product:
+            print(f"Similarity: {product['similarity']:.2f}")
         print("-" * 80)
 
 def handle_product(args):
@@ -209,5 +306,63 @@ def handle_full_update(args):
     
     print("Full update completed successfully!")
 
+def handle_bench(args):
+    """Handle the bench command."""
+    benchmark.run(args)
+
+def handle_reprocess(args):
+    """Handle the reprocess command."""
+    result = main.reprocess_archive(args.runs, rebuild=args.rebuild, archive_dir=args.archive_dir)
+    if result is None:
+        print("Nothing to reprocess.")
+        sys.exit(1)
+
+    print(f"\n\nReplayed {result['runs']} run(s): {result['pages']} pages, "
+          f"{result['products_processed']} products in {result['elapsed']:.1f}s")
+    print(f"Inserted: {result['inserted']}, price changes: {result['updated']}, "
+          f"metadata changes: {result['metadata_updated']}")
+
+def handle_compact(args):
+    """Handle the compact command."""
+    result = compaction.compact_price_history(
+        downsample_after_days=args.downsample_after, bucket=args.bucket, vacuum=not args.no_vacuum,
+        full_vacuum=args.full_vacuum
+    )
+
+    if args.json:
+        import json
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"Price history rows: {result['rows_before']:,} -> {result['rows_after']:,}")
+        print(f"Repeated prices removed: {result['duplicates_removed']:,}")
+        print(f"Downsampled rows removed: {result['downsampled_removed']:,}")
+        print(f"Database size: {result['bytes_before'] / (1024 * 1024):.1f} MiB -> "
+              f"{result['bytes_after'] / (1024 * 1024):.1f} MiB "
+              f"({result['bytes_reclaimed'] / (1024 * 1024):.1f} MiB reclaimed)")
+        if result['full_vacuum']:
+            print("Switched to incremental auto_vacuum with a full VACUUM; search indexes rebuilt")
+        elif result['full_vacuum_needed'] and not args.no_vacuum:
+            print("Freed pages stay in the file until the database is converted once with "
+                  "'compact --full-vacuum' (rewrites the file, needs up to twice its size in free disk)")
+
+def handle_check_plans(args):
+    """Handle the check-plans command."""
+    results = query_plans.check_plans(args.db)
+    failures = [result for result in results if result['problems']]
+
+    for result in results:
+        status = "FAIL" if result['problems'] else "ok"
+        print(f"{status:<5} {result['name']}")
+        if args.verbose or result['problems']:
+            for step in result['plan']:
+                marker = "  !" if step in result['problems'] else "   "
+                print(f"{marker} {step}")
+
+    allowed = sum(1 for result in results if result['allowed'])
+    print(f"\n{len(results)} queries checked: {len(failures)} failing, "
+          f"{allowed} with allowed scans or sorts (see query_plans.ALLOWED_STEPS)")
+    if failures:
+        sys.exit(1)
+
 if __name__ == "__main__":
-    main_cli() 
\ No newline at end of file
+    main_cli()
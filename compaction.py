@@ -0,0 +1,197 @@
+"""
+Price history compaction and tiered retention.
+
+Repeated crawls (and batch_insert_products in particular) record the same
+price again and again. Compaction keeps only the change points of each
+product's history, optionally thins out history older than a retention age
+to one point per week or month, and returns the freed pages to the file
+system with incremental VACUUM. Databases created without incremental
+auto_vacuum only get it through an explicit one-off full VACUUM.
+
+A product's first history row is always kept, and the products table is not
+touched, so first_price and price_change_percentage mean the same afterwards.
+"""
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+import db
+import migrations
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# strftime() formats that name the retention bucket of an epoch timestamp.
+BUCKET_FORMATS = {
+    'week': '%Y-%W',
+    'month': '%Y-%m',
+}
+
+# Products whose history is compacted per transaction.
+BATCH_PRODUCTS = 500
+
+# Drops every row whose price equals the previous row of the same product.
+COLLAPSE_SQL = """
+    DELETE FROM price_history WHERE (productId, ts) IN (
+        SELECT productId, ts FROM (
+            SELECT
+                productId, ts, price_ore,
+                LAG(price_ore) OVER (PARTITION BY productId ORDER BY ts) AS previous_price,
+                ROW_NUMBER() OVER (PARTITION BY productId ORDER BY ts) AS position
+            FROM price_history
+            WHERE productId BETWEEN ? AND ?
+        )
+        WHERE position > 1 AND price_ore IS previous_price
+    )
+"""
+
+# Keeps the last row of every bucket before the cutoff, plus the first row.
+DOWNSAMPLE_SQL = """
+    DELETE FROM price_history WHERE (productId, ts) IN (
+        SELECT productId, ts FROM (
+            SELECT
+                productId, ts,
+                ROW_NUMBER() OVER (
+                    PARTITION BY productId, strftime(?, ts, 'unixepoch') ORDER BY ts DESC
+                ) AS bucket_rank,
+                ROW_NUMBER() OVER (PARTITION BY productId ORDER BY ts) AS position
+            FROM price_history
+            WHERE productId BETWEEN ? AND ? AND ts < ?
+        )
+        WHERE bucket_rank > 1 AND position > 1
+    )
+"""
+
+
+def database_bytes(conn: sqlite3.Connection, db_name: str) -> int:
+    """Returns the size of the database file after checkpointing the WAL into it."""
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(db_name)
+
+
+def _product_batches(conn: sqlite3.Connection, batch_size: int) -> List[tuple]:
+    """Returns (first, last) productId ranges covering the history, batch_size products each."""
+    product_ids = [row[0] for row in conn.execute("SELECT DISTINCT productId FROM price_history ORDER BY productId")]
+    return [
+        (product_ids[i], product_ids[min(i + batch_size, len(product_ids)) - 1])
+        for i in range(0, len(product_ids), batch_size)
+    ]
+
+
+def needs_full_vacuum(conn: sqlite3.Connection) -> bool:
+    """Returns True if the database is not in auto_vacuum=INCREMENTAL mode yet."""
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+
+
+def reclaim_space(conn: sqlite3.Connection, full_vacuum: bool = False) -> bool:
+    """
+    Returns free pages to the file system with incremental VACUUM.
+
+    A database that was created without auto_vacuum=INCREMENTAL can only be
+    switched to it with a full VACUUM, which rewrites the whole file, needs
+    up to twice its size in free disk space and locks the database while it
+    runs. That only happens with full_vacuum; otherwise the freed pages stay
+    in the file for reuse. The VACUUM may renumber product rowids, so every
+    rowid-keyed index (the FTS5 search and trigram indexes) is rebuilt after
+    it. Returns True if the full VACUUM ran.
+    """
+    if needs_full_vacuum(conn):
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        size_mib = conn.execute("PRAGMA page_count").fetchone()[0] * page_size / (1024 * 1024)
+        if not full_vacuum:
+            logger.warning(
+                f"Freed pages stay in the database: it is not in incremental auto_vacuum mode. "
+                f"Converting it takes a one-off full VACUUM (compact --full-vacuum) that rewrites "
+                f"the {size_mib:.1f} MiB file and needs up to {2 * size_mib:.1f} MiB of free disk"
+            )
+            return False
+        logger.warning(
+            f"Enabling incremental auto_vacuum with a full VACUUM: rewrites the {size_mib:.1f} MiB "
+            f"file, needs up to {2 * size_mib:.1f} MiB of free disk and locks the database until done"
+        )
+        started = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        migrations.rebuild_search_index(conn)
+        logger.info(f"Full VACUUM and search index rebuild took {time.perf_counter() - started:.1f}s")
+        return True
+    # Each step of the pragma frees one page; executescript runs it to completion.
+    conn.executescript("PRAGMA incremental_vacuum;")
+    return False
+
+
+def compact_price_history(db_name: str = "products.db", downsample_after_days: Optional[float] = None,
+                          bucket: Optional[str] = None, vacuum: bool = True,
+                          full_vacuum: bool = False) -> Dict[str, Any]:
+    """
+    Compacts price_history in per-product batches.
+
+    Args:
+        db_name: Database to compact
+        downsample_after_days: Keep one point per bucket for history older than
+            this many days (default: get_config()['history_downsample_days'];
+            0 keeps all change points)
+        bucket: 'week' or 'month' (default: get_config()['history_downsample_bucket'])
+        vacuum: Reclaim the freed space with incremental VACUUM
+        full_vacuum: Allow the one-off full VACUUM that switches an older
+            database to incremental auto_vacuum (see reclaim_space)
+
+    Returns:
+        Dict with rows_before, rows_after, duplicates_removed,
+        downsampled_removed, bytes_before, bytes_after, bytes_reclaimed,
+        full_vacuum, full_vacuum_needed and elapsed
+    """
+    config = get_config()
+    if downsample_after_days is None:
+        downsample_after_days = config['history_downsample_days']
+    bucket = bucket or config['history_downsample_bucket']
+    if bucket not in BUCKET_FORMATS:
+        raise ValueError(f"Unknown downsample bucket '{bucket}', expected one of {sorted(BUCKET_FORMATS)}")
+
+    started = time.perf_counter()
+    conn = db.connect(db_name)
+    try:
+        migrations.migrate(conn)
+        bytes_before = database_bytes(conn, db_name)
+        rows_before = conn.execute("SELECT COUNT(*) FROM price_history").fetchone()[0]
+        cutoff = int(time.time() - downsample_after_days * 86400) if downsample_after_days else None
+
+        duplicates_removed = 0
+        downsampled_removed = 0
+        for first, last in _product_batches(conn, BATCH_PRODUCTS):
+            with conn:
+                if cutoff is not None:
+                    downsampled_removed += conn.execute(
+                        DOWNSAMPLE_SQL, (BUCKET_FORMATS[bucket], first, last, cutoff)
+                    ).rowcount
+                duplicates_removed += conn.execute(COLLAPSE_SQL, (first, last)).rowcount
+        with conn:
+            db.bump_data_generation(conn)
+
+        full_vacuum = reclaim_space(conn, full_vacuum) if vacuum else False
+        full_vacuum_needed = needs_full_vacuum(conn)
+        rows_after = conn.execute("SELECT COUNT(*) FROM price_history").fetchone()[0]
+        bytes_after = database_bytes(conn, db_name)
+    finally:
+        conn.close()
+
+    result = {
+        'rows_before': rows_before,
+        'rows_after': rows_after,
+        'duplicates_removed': duplicates_removed,
+        'downsampled_removed': downsampled_removed,
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+        'bytes_reclaimed': bytes_before - bytes_after,
+        'full_vacuum': full_vacuum,
+        'full_vacuum_needed': full_vacuum_needed,
+        'elapsed': time.perf_counter() - started,
+    }
+    logger.info(
+        f"Compacted price_history: {rows_before} -> {rows_after} rows "
+        f"({duplicates_removed} repeated prices, {downsampled_removed} downsampled), "
+        f"{result['bytes_reclaimed'] / (1024 * 1024):.1f} MiB reclaimed in {result['elapsed']:.1f}s"
+    )
+    return result
@@ -11,17 +11,42 @@ BASE_URL = "https://www.systembolaget.se"
 
 # Database Configuration
 DATABASE_NAME = "products.db"
+BUSY_TIMEOUT_MS = 5000  # How long a connection waits for a lock held by another one
+MMAP_SIZE_MB = 256  # Memory-mapped I/O window for reads; 0 disables it
+CACHE_SIZE_PAGES = 10000  # SQLite page cache per connection
+MIGRATION_BATCH_SIZE = 1000  # Rows per committed batch of a long-running migration
+HISTORY_DOWNSAMPLE_DAYS = 0  # `compact` keeps one price point per bucket for older history; 0 disables
+HISTORY_DOWNSAMPLE_BUCKET = "week"  # 'week' or 'month'
+FUZZY_MIN_SIMILARITY = 0.3  # `search --fuzzy` drops results with a lower trigram similarity
+LOOKUP_CACHE_SIZE = 1024  # Product and price history lookups cached in-process by utils; 0 disables
 
 # Request Configuration
 MAX_RETRIES = 3
 RETRY_DELAY = 2  # seconds
 REQUEST_TIMEOUT = 30  # seconds
-PAGE_SIZE = 30
+PAGE_SIZE = 30  # Fallback page size; probed sizes are this doubled up to MAX_PAGE_SIZE
+MAX_PAGE_SIZE = 480  # Largest page size a full crawl probes for
+CONCURRENCY = 4  # Page requests kept in flight; 1 means serial fetching
+MAX_CONCURRENCY = 16  # Ceiling for adaptive (AIMD) concurrency
+MAX_RETRY_DELAY = 60  # seconds, cap for backoff and Retry-After waits
+LATENCY_TARGET = 2.0  # seconds; slower responses reduce concurrency
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures before pausing requests
+CIRCUIT_COOLDOWN = 30  # seconds to pause once the circuit opens
+PIPELINE_QUEUE_SIZE = 8  # Pages buffered between pipeline stages
+WRITER_BATCH_PAGES = 10  # Maximum pages committed per writer transaction
+HTTP_CACHE = "http_cache.db"  # On-disk response cache; empty disables it
+HTTP_CACHE_MAX_MB = 64  # Size cap for compressed cached responses
+DELTA_STOP_PAGES = 3  # Consecutive unchanged pages before a delta crawl stops
+FULL_CRAWL_INTERVAL_HOURS = 168  # 'auto' mode runs a full crawl when the last one is older
+SHARD_FIELD = "categoryLevel1"  # API filter used to split a sharded crawl
+SHARD_VALUES = ["Vin", "Öl", "Sprit", "Cider & blanddrycker", "Alkoholfritt", "Presentartiklar"]
+ARCHIVE_DIR = "archive"  # Raw page archive, one file per crawl run; empty disables it
 
 # Logging Configuration
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 LOG_FILE = "systemet.log"
+PROGRESS_INTERVAL_MS = 250  # Minimum time between progress line redraws
 
 # Web Interface Configuration
 WEB_TITLE = "Systemet Price Tracker"
@@ -41,11 +66,37 @@ def get_config() -> Dict[str, Any]:
         'api_base_url': os.getenv('SYSTEMET_API_URL', API_BASE_URL),
         'api_key': os.getenv('SYSTEMET_API_KEY', API_KEY),
         'database_name': os.getenv('SYSTEMET_DB_NAME', DATABASE_NAME),
+        'busy_timeout_ms': int(os.getenv('SYSTEMET_BUSY_TIMEOUT_MS', BUSY_TIMEOUT_MS)),
+        'mmap_size_mb': int(os.getenv('SYSTEMET_MMAP_SIZE_MB', MMAP_SIZE_MB)),
+        'cache_size_pages': int(os.getenv('SYSTEMET_CACHE_SIZE_PAGES', CACHE_SIZE_PAGES)),
+        'migration_batch_size': max(1, int(os.getenv('SYSTEMET_MIGRATION_BATCH_SIZE', MIGRATION_BATCH_SIZE))),
+        'history_downsample_days': float(os.getenv('SYSTEMET_HISTORY_DOWNSAMPLE_DAYS', HISTORY_DOWNSAMPLE_DAYS)),
+        'history_downsample_bucket': os.getenv('SYSTEMET_HISTORY_DOWNSAMPLE_BUCKET', HISTORY_DOWNSAMPLE_BUCKET),
+        'fuzzy_min_similarity': float(os.getenv('SYSTEMET_FUZZY_MIN_SIMILARITY', FUZZY_MIN_SIMILARITY)),
+        'lookup_cache_size': max(0, int(os.getenv('SYSTEMET_LOOKUP_CACHE_SIZE', LOOKUP_CACHE_SIZE))),
         'max_retries': int(os.getenv('SYSTEMET_MAX_RETRIES', MAX_RETRIES)),
         'retry_delay': int(os.getenv('SYSTEMET_RETRY_DELAY', RETRY_DELAY)),
         'request_timeout': int(os.getenv('SYSTEMET_TIMEOUT', REQUEST_TIMEOUT)),
         'page_size': int(os.getenv('SYSTEMET_PAGE_SIZE', PAGE_SIZE)),
+        'max_page_size': int(os.getenv('SYSTEMET_MAX_PAGE_SIZE', MAX_PAGE_SIZE)),
+        'concurrency': max(1, int(os.getenv('SYSTEMET_CONCURRENCY', CONCURRENCY))),
+        'max_concurrency': max(1, int(os.getenv('SYSTEMET_MAX_CONCURRENCY', MAX_CONCURRENCY))),
+        'max_retry_delay': float(os.getenv('SYSTEMET_MAX_RETRY_DELAY', MAX_RETRY_DELAY)),
+        'latency_target': float(os.getenv('SYSTEMET_LATENCY_TARGET', LATENCY_TARGET)),
+        'circuit_failure_threshold': int(os.getenv('SYSTEMET_CIRCUIT_FAILURE_THRESHOLD', CIRCUIT_FAILURE_THRESHOLD)),
+        'circuit_cooldown': float(os.getenv('SYSTEMET_CIRCUIT_COOLDOWN', CIRCUIT_COOLDOWN)),
+        'pipeline_queue_size': int(os.getenv('SYSTEMET_PIPELINE_QUEUE_SIZE', PIPELINE_QUEUE_SIZE)),
+        'writer_batch_pages': int(os.getenv('SYSTEMET_WRITER_BATCH_PAGES', WRITER_BATCH_PAGES)),
+        'http_cache': os.getenv('SYSTEMET_HTTP_CACHE', HTTP_CACHE),
+        'http_cache_max_mb': int(os.getenv('SYSTEMET_HTTP_CACHE_MAX_MB', HTTP_CACHE_MAX_MB)),
+        'delta_stop_pages': max(1, int(os.getenv('SYSTEMET_DELTA_STOP_PAGES', DELTA_STOP_PAGES))),
+        'full_crawl_interval_hours': float(os.getenv('SYSTEMET_FULL_CRAWL_INTERVAL_HOURS', FULL_CRAWL_INTERVAL_HOURS)),
+        'shard_field': os.getenv('SYSTEMET_SHARD_FIELD', SHARD_FIELD),
+        'shard_values': [value.strip() for value in os.getenv('SYSTEMET_SHARD_VALUES', ",".join(SHARD_VALUES)).split(",")
+                         if value.strip()],
+        'archive_dir': os.getenv('SYSTEMET_ARCHIVE_DIR', ARCHIVE_DIR),
         'log_level': os.getenv('SYSTEMET_LOG_LEVEL', LOG_LEVEL),
+        'progress_interval_ms': int(os.getenv('SYSTEMET_PROGRESS_INTERVAL_MS', PROGRESS_INTERVAL_MS)),
         'web_title': os.getenv('SYSTEMET_WEB_TITLE', WEB_TITLE),
         'page_length': int(os.getenv('SYSTEMET_PAGE_LENGTH', PAGE_LENGTH)),
     }
@@ -0,0 +1,127 @@
+"""
+SQLite connections shared by the crawler, the CLI helpers and the site generator.
+
+`connect` opens a configured connection owned by the caller. `get_connection`
+keeps one connection per thread and database and hands it out again on every
+call, so the read helpers in utils and deploy pay for connection setup once.
+Read-only connections are opened through a `mode=ro` URI.
+
+The data generation in the `meta` table is bumped whenever a page batch of a
+crawl or another write to products or price_history commits, so in-process caches of
+query results can tell when they are out of date.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def connect(db_name: str = "products.db", read_only: bool = False,
+            check_same_thread: bool = True) -> sqlite3.Connection:
+    """
+    Opens a connection with the shared pragmas applied.
+
+    Every connection gets foreign keys, a busy timeout, memory-mapped reads,
+    in-memory temp storage and a larger page cache. Read-write connections
+    also switch the database to WAL with synchronous=NORMAL; read-only ones
+    cannot create the database and fail if it does not exist.
+
+    Args:
+        db_name: Database file
+        read_only: Open through a `mode=ro` URI
+        check_same_thread: Passed to sqlite3.connect
+    """
+    config = get_config()
+    try:
+        if read_only:
+            uri = f"file:{quote(os.path.abspath(db_name))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+        else:
+            conn = sqlite3.connect(db_name, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute(f"PRAGMA busy_timeout = {int(config['busy_timeout_ms'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(config['mmap_size_mb']) * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute(f"PRAGMA cache_size = {int(config['cache_size_pages'])}")
+        if not read_only:
+            conn.execute("PRAGMA journal_mode = WAL")  # Readers never block the writer
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+    except sqlite3.Error as e:
+        logger.error(f"Database connection error ({db_name}): {e}")
+        raise
+
+
+def _pool() -> Dict[Tuple[str, bool], Tuple[sqlite3.Connection, Tuple[int, int]]]:
+    if not hasattr(_local, "connections"):
+        _local.connections = {}
+    return _local.connections
+
+
+def _file_id(path: str) -> Tuple[int, int]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (0, 0)
+    return (st.st_dev, st.st_ino)
+
+
+def get_connection(db_name: str = "products.db", read_only: bool = False) -> sqlite3.Connection:
+    """
+    Returns this thread's pooled connection to a database, opening it on first use.
+
+    The connection stays open for later calls and must not be closed by the
+    caller; use close_connections() instead. A database file that was replaced
+    since the connection was opened gets a fresh connection.
+    """
+    path = os.path.abspath(db_name)
+    key = (path, read_only)
+    pool = _pool()
+    file_id = _file_id(path)
+    pooled = pool.get(key)
+    if pooled is not None:
+        conn, pooled_id = pooled
+        if pooled_id == file_id:
+            return conn
+        conn.close()
+        del pool[key]
+    conn = connect(db_name, read_only=read_only)
+    pool[key] = (conn, _file_id(path))
+    return conn
+
+
+def close_connections():
+    """Closes every pooled connection of the calling thread."""
+    pool = _pool()
+    for conn, _ in pool.values():
+        conn.close()
+    pool.clear()
+
+
+def data_generation(conn: sqlite3.Connection) -> Optional[int]:
+    """
+    Returns the current data generation, or None for a database that
+    predates the meta table (migration 8).
+    """
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_generation'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def bump_data_generation(conn: sqlite3.Connection):
+    """
+    Advances the data generation. Call it inside the transaction that
+    commits the write, so readers never see the new data under the old
+    generation.
+    """
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_generation'")
@@ -1,101 +1,115 @@
-import sqlite3
 from datetime import datetime
 import json
 from typing import Dict, Any, List
 import os
 
+import db
+import migrations
+import utils
+
+# Read queries used to build the site. check-plans (query_plans.py) verifies
+# that every *_SQL constant here is answered from an index.
+PRODUCT_COLUMNS = """
+    productNumber, productNameBold, productNameThin, supplierName, apk, price,
+    price_change_percentage, volume, alcoholPercentage, categoryLevel1,
+    categoryLevel2, categoryLevel3, country, productLaunchDate
+"""
+
+CATEGORIES_SQL = """
+    SELECT DISTINCT categoryLevel1
+    FROM products
+    WHERE delisted = 0 AND categoryLevel1 IS NOT NULL
+    ORDER BY categoryLevel1
+"""
+
+PRODUCTS_BY_CATEGORY_SQL = f"""
+    SELECT {PRODUCT_COLUMNS}
+    FROM products
+    WHERE delisted = 0 AND categoryLevel1 = ?
+    ORDER BY apk DESC
+    LIMIT ? OFFSET ?
+"""
+
+SEARCH_SQL = f"""
+    SELECT {PRODUCT_COLUMNS}
+    FROM products
+    WHERE
+        (productNameBold LIKE ? OR
+         productNameThin LIKE ? OR
+         supplierName LIKE ?)
+        AND delisted = 0
+    ORDER BY apk DESC
+    LIMIT ?
+"""
+
+SEARCH_FTS_SQL = f"""
+    WITH matches AS (
+        SELECT rowid, {utils.SEARCH_BM25} AS score
+        FROM products_fts
+        WHERE products_fts MATCH ?
+    )
+    SELECT {PRODUCT_COLUMNS}
+    FROM matches
+    JOIN products ON products.rowid = matches.rowid
+    WHERE delisted = 0
+    ORDER BY score * (1 + 0.5 * COALESCE(apk, 0))
+    LIMIT ?
+"""
+
+ALL_PRODUCTS_SQL = f"""
+    SELECT {PRODUCT_COLUMNS}
+    FROM products
+    WHERE delisted = 0
+    ORDER BY apk DESC
+"""
+
+# Site totals from the materialized statistics (see migrations._product_stats).
+SITE_TOTALS_SQL = """
+    SELECT listed, price_sum / NULLIF(price_count, 0), apk_sum / NULLIF(apk_count, 0), increases, decreases
+    FROM product_stats
+    WHERE id = 1
+"""
+
 def get_database_connection(db_name="products.db"):
     """
-    Creates a database connection with proper configuration.
+    Creates a database connection owned by the caller (see db.connect).
     """
-    try:
-        conn = sqlite3.connect(db_name)
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
-    except sqlite3.Error as e:
-        print(f"Database connection error: {e}")
-        raise
+    return db.connect(db_name)
 
 def get_categories():
     """Get all unique categories for pre-filtered pages."""
-    conn = get_database_connection('products.db')
+    conn = db.get_connection('products.db', read_only=True)
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT DISTINCT categoryLevel1 
-        FROM products 
-        WHERE categoryLevel1 IS NOT NULL 
-        ORDER BY categoryLevel1
-    """)
+    cursor.execute(CATEGORIES_SQL)
     categories = [row[0] for row in cursor.fetchall()]
     
-    conn.close()
     return categories
 
 def get_products_by_category(category: str, limit: int = 50, offset: int = 0):
     """Get products for a specific category with pagination."""
-    conn = get_database_connection('products.db')
+    conn = db.get_connection('products.db', read_only=True)
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT 
-            productNumber, 
-            productNameBold, 
-            productNameThin, 
-            supplierName, 
-            apk, 
-            price, 
-            price_change_percentage,
-            volume, 
-            alcoholPercentage, 
-            categoryLevel1, 
-            categoryLevel2, 
-            categoryLevel3, 
-            country, 
-            productLaunchDate 
-        FROM products
-        WHERE categoryLevel1 = ?
-        ORDER BY apk DESC
-        LIMIT ? OFFSET ?
-    """, (category, limit, offset))
+    cursor.execute(PRODUCTS_BY_CATEGORY_SQL, (category, limit, offset))
     
     products = cursor.fetchall()
-    conn.close()
     return products
 
 def get_search_results(query: str, limit: int = 50):
-    """Get search results for a query."""
-    conn = get_database_connection('products.db')
+    """Get search results for a query, from the full-text index when it has any."""
+    conn = db.get_connection('products.db', read_only=True)
     cursor = conn.cursor()
     
-    search_pattern = f"%{query}%"
-    cursor.execute("""
-        SELECT 
-            productNumber, 
-            productNameBold, 
-            productNameThin, 
-            supplierName, 
-            apk, 
-            price, 
-            price_change_percentage,
-            volume, 
-            alcoholPercentage, 
-            categoryLevel1, 
-            categoryLevel2, 
-            categoryLevel3, 
-            country, 
-            productLaunchDate 
-        FROM products
-        WHERE 
-            productNameBold LIKE ? OR 
-            productNameThin LIKE ? OR 
-            supplierName LIKE ?
-        ORDER BY apk DESC
-        LIMIT ?
-    """, (search_pattern, search_pattern, search_pattern, limit))
-    
-    products = cursor.fetchall()
-    conn.close()
+    products = []
+    match = utils.fts_query(query)
+    if match is not None and migrations.has_search_index(conn):
+        cursor.execute(SEARCH_FTS_SQL, (match, limit))
+        products = cursor.fetchall()
+    if not products:
+        search_pattern = f"%{query}%"
+        cursor.execute(SEARCH_SQL, (search_pattern, search_pattern, search_pattern, limit))
+        products = cursor.fetchall()
     return products
 
 def generate_category_page(category: str):
@@ -409,25 +423,16 @@ def generate_search_api():
 
 def generate_main_page():
     """Generate the main page with category navigation and statistics."""
-    conn = get_database_connection('products.db')
+    conn = db.get_connection('products.db', read_only=True)
     cursor = conn.cursor()
     
     # Get statistics
-    cursor.execute("SELECT COUNT(*), AVG(price), AVG(apk) FROM products")
-    stats = cursor.fetchone()
-    total_products, avg_price, avg_apk = stats
-    
-    cursor.execute("SELECT COUNT(*) FROM products WHERE price_change_percentage > 0")
-    price_increases = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM products WHERE price_change_percentage < 0")
-    price_decreases = cursor.fetchone()[0]
+    cursor.execute(SITE_TOTALS_SQL)
+    total_products, avg_price, avg_apk, price_increases, price_decreases = cursor.fetchone()
     
     # Get categories
     categories = get_categories()
     
-    conn.close()
-    
     html_content = f"""<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -557,21 +562,12 @@ def generate_main_page():
 
 def generate_all_products_page():
     """Generate the main page with statistics and all products."""
-    conn = get_database_connection('products.db')
+    conn = db.get_connection('products.db', read_only=True)
     cursor = conn.cursor()
     
     # Get statistics
-    cursor.execute("SELECT COUNT(*), AVG(price), AVG(apk) FROM products")
-    stats = cursor.fetchone()
-    total_products, avg_price, avg_apk = stats
-    
-    cursor.execute("SELECT COUNT(*) FROM products WHERE price_change_percentage > 0")
-    price_increases = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM products WHERE price_change_percentage < 0")
-    price_decreases = cursor.fetchone()[0]
-    
-    conn.close()
+    cursor.execute(SITE_TOTALS_SQL)
+    total_products, avg_price, avg_apk, price_increases, price_decreases = cursor.fetchone()
     
     html_content = f"""<!DOCTYPE html>
 <html lang="en">
@@ -1019,28 +1015,10 @@ def generate_all_products_page():
 
 def generate_products_json():
     """Generate a JSON file with all products for AJAX loading."""
-    conn = get_database_connection('products.db')
+    conn = db.get_connection('products.db', read_only=True)
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT 
-            productNumber, 
-            productNameBold, 
-            productNameThin, 
-            supplierName, 
-            apk, 
-            price, 
-            price_change_percentage,
-            volume, 
-            alcoholPercentage, 
-            categoryLevel1, 
-            categoryLevel2, 
-            categoryLevel3, 
-            country, 
-            productLaunchDate 
-        FROM products
-        ORDER BY apk DESC
-    """)
+    cursor.execute(ALL_PRODUCTS_SQL)
     
     products = []
     for row in cursor.fetchall():
@@ -1061,8 +1039,6 @@ def generate_products_json():
             'productLaunchDate': row[13] or ''
         })
     
-    conn.close()
-    
     # Create data directory if it doesn't exist
     os.makedirs('data', exist_ok=True)
     
@@ -0,0 +1,195 @@
+"""
+On-disk cache of API response bodies used for conditional page requests.
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry(NamedTuple):
+    """Validators and bookkeeping stored for a cached response."""
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body_hash: str
+    product_count: int
+    raw_size: int
+    product_ids: Optional[List[str]]
+
+
+def body_digest(body: bytes) -> str:
+    """Returns the hash used to detect identical response bodies."""
+    return hashlib.sha256(body).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed store of zlib-compressed response bodies keyed by URL.
+
+    Besides the body it keeps the ETag/Last-Modified validators for
+    conditional requests, a body hash to recognise identical responses, and
+    the product count and product ids of the page. The total compressed size is capped and
+    the least recently used entries are evicted first. The cache is shared by
+    the fetch workers and the writer thread.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT,
+                product_count INTEGER,
+                raw_size INTEGER,
+                size INTEGER,
+                body BLOB,
+                last_access REAL,
+                product_ids TEXT
+            )
+            """
+        )
+        try:
+            self.conn.execute("ALTER TABLE responses ADD COLUMN product_ids TEXT")
+        except sqlite3.OperationalError:
+            # Column already exists, ignore the error
+            pass
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        self.lookups = 0
+        self.not_modified = 0
+        self.identical = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_unchanged = 0
+        self.evictions = 0
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """Returns the cached validators for a URL, or None."""
+        with self._lock:
+            self.lookups += 1
+            row = self.conn.execute(
+                """
+                SELECT etag, last_modified, body_hash, product_count, raw_size, product_ids
+                FROM responses WHERE url = ?
+                """,
+                (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        product_ids = None if row[5] is None else [pid for pid in row[5].split(",") if pid]
+        return CacheEntry(*row[:5], product_ids)
+
+    def conditional_headers(self, entry: Optional[CacheEntry]) -> Dict[str, str]:
+        """Returns If-None-Match/If-Modified-Since headers for a cached entry."""
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def load_body(self, url: str) -> Optional[bytes]:
+        """Returns the decompressed cached body for a URL, or None."""
+        with self._lock:
+            row = self.conn.execute("SELECT body FROM responses WHERE url = ?", (url,)).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+    def record_hit(self, url: str, entry: CacheEntry, not_modified: bool):
+        """Counts an unchanged page and marks its entry as recently used."""
+        with self._lock:
+            if not_modified:
+                self.not_modified += 1
+                self.bytes_saved += entry.raw_size
+            else:
+                self.identical += 1
+            self.bytes_unchanged += entry.raw_size
+            with self.conn:
+                self.conn.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url))
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def store(self, url: str, body: bytes, etag: Optional[str], last_modified: Optional[str],
+              body_hash: str, product_count: int, product_ids: Optional[List[str]] = None):
+        """
+        Stores a response body once the page it came from has been committed,
+        then evicts least recently used entries above the size cap.
+        """
+        compressed = zlib.compress(body, 6)
+        with self._lock:
+            with self.conn:
+                old = self.conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+                self.conn.execute(
+                    """
+                    INSERT OR REPLACE INTO responses
+                        (url, etag, last_modified, body_hash, product_count, raw_size, size, body,
+                         last_access, product_ids)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (url, etag, last_modified, body_hash, product_count, len(body), len(compressed),
+                     compressed, time.time(), ",".join(product_ids) if product_ids is not None else None)
+                )
+                self.total_bytes += len(compressed) - (old[0] if old else 0)
+                self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT url, size FROM responses ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for url, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.total_bytes -= size
+                self.evictions += 1
+
+    def clear(self):
+        """Removes every cached response."""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM responses")
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit ratio, bytes saved and size counters."""
+        with self._lock:
+            hits = self.not_modified + self.identical
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                'lookups': self.lookups,
+                'hits': hits,
+                'not_modified': self.not_modified,
+                'identical': self.identical,
+                'misses': self.misses,
+                'hit_ratio': hits / (hits + self.misses) if hits + self.misses else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'bytes_unchanged': self.bytes_unchanged,
+                'entries': entries,
+                'size_bytes': self.total_bytes,
+                'evictions': self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -1,11 +1,29 @@
-import os
+import json
 import sqlite3
 import requests
 from requests import Session
 from datetime import datetime, timezone
 import logging
 import time
-from typing import Optional, Dict, Any
+from functools import partial
+from typing import Optional, Callable, Dict, Any, List, NamedTuple, Tuple
+from urllib.parse import urlencode
+
+from requests.adapters import HTTPAdapter
+
+from archive import CrawlArchive, find_archive, list_archived_runs, load_run_info, load_run_pages
+import db
+from config import get_config, MIN_PRICE_CHANGE_THRESHOLD, PAGE_SIZE
+from http_cache import ResponseCache, body_digest
+import migrations
+from pipeline import IngestPipeline
+from ratecontrol import RateController, parse_retry_after
+from shards import ShardPlan
+from snapshot import (
+    METADATA_CHANGED, METADATA_COLUMNS, NEW, PRICE_CHANGED, UNCHANGED,
+    ProductSnapshot, make_entry,
+)
+from utils import validate_product_data
 
 # Configure logging
 logging.basicConfig(
@@ -32,98 +50,21 @@ REQUEST_TIMEOUT = 30  # seconds
 
 def get_database_connection(db_name="products.db"):
     """
-    Creates a database connection with proper configuration.
+    Creates a read-write database connection owned by the caller (see db.connect).
     """
-    try:
-        conn = sqlite3.connect(db_name)
-        conn.execute("PRAGMA foreign_keys = ON")
-        conn.execute("PRAGMA journal_mode = WAL")  # Better concurrent access
-        conn.execute("PRAGMA synchronous = NORMAL")  # Better performance
-        conn.execute("PRAGMA cache_size = 10000")  # Increase cache size
-        return conn
-    except sqlite3.Error as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+    return db.connect(db_name)
 
 def initialize_database(db_name="products.db"):
     """
-    Creates (if not exists) the SQLite database and the products table.
-    Also adds new columns if they don't exist.
+    Creates the SQLite database if needed and applies pending schema
+    migrations (see migrations.py). A database that is already at the latest
+    schema version is left untouched.
     """
+    conn = get_database_connection(db_name)
     try:
-        conn = get_database_connection(db_name)
-        cursor = conn.cursor()
-
-        # Create products table if it doesn't exist
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS products (
-                productId TEXT PRIMARY KEY,
-
-                -- Basic product info
-                productNumber TEXT,
-                productNumberShort TEXT,
-                productNameBold TEXT,
-                productNameThin TEXT,
-                producerName TEXT,
-                supplierName TEXT,
-                categoryLevel1 TEXT,
-                categoryLevel2 TEXT,
-                categoryLevel3 TEXT,
-                country TEXT,
-                productLaunchDate TEXT,
-
-                -- Availability
-                isTemporaryOutOfStock BOOLEAN,
-                isCompletelyOutOfStock BOOLEAN,
-
-                -- Current price
-                price REAL,
-                lastUpdated TEXT,
-                price_change_percentage REAL,
-
-                -- Alcohol & Volume
-                volume REAL,
-                alcoholPercentage REAL,
-
-                -- APK (ml ethanol per krona)
-                apk REAL
-            )
-            """
-        )
-
-        # Add indexes for better performance
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_apk ON products(apk)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_price ON products(price)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_category ON products(categoryLevel1, categoryLevel2)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_country ON products(country)")
-
-        # Add price_change_percentage column if it doesn't exist
-        try:
-            cursor.execute("ALTER TABLE products ADD COLUMN price_change_percentage REAL DEFAULT 0.0")
-        except sqlite3.OperationalError:
-            # Column already exists, ignore the error
-            pass
-        
-        # Create price history table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS price_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                productId TEXT,
-                price REAL,
-                timestamp TEXT,
-                FOREIGN KEY (productId) REFERENCES products(productId)
-            )
-            """
-        )
-        
-        # Add index for price history
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_price_history_product ON price_history(productId)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_price_history_timestamp ON price_history(timestamp)")
-        
-        conn.commit()
-        logger.info("Database initialized successfully")
+        applied = migrations.migrate(conn)
+        if applied:
+            logger.info(f"Database schema migrated to version {migrations.LATEST_VERSION}")
     except sqlite3.Error as e:
         logger.error(f"Database initialization error: {e}")
         raise
@@ -131,33 +72,94 @@ def initialize_database(db_name="products.db"):
         conn.close()
 
 
-def get_product_count(db_name="products.db"):
+class ProgressTracker:
     """
-    Returns the current number of products in the database.
+    Tracks crawl progress and throughput in memory.
+
+    Counts are seeded once (products already in the database and the page
+    total from the API metadata) and then advanced per committed page, so the
+    progress line never needs to query the database. Redraws are throttled to
+    at most one every `redraw_interval_ms` milliseconds.
     """
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM products")
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
 
+    def __init__(self, total_pages: int, products_in_db: int, redraw_interval_ms: int = 250,
+                 bar_length: int = 40, clock=time.monotonic):
+        self.total_pages = total_pages
+        self.products_in_db = products_in_db
+        self.redraw_interval = redraw_interval_ms / 1000.0
+        self.bar_length = bar_length
+        self.clock = clock
+        self.started_at = clock()
+        self.pages_done = 0
+        self.failed_pages = 0
+        self.products_processed = 0
+        self.write_time = 0.0
+        self._last_draw = None
 
-def print_progress_bar(processed, total, bar_length=40):
-    """
-    Prints a simple progress bar on the same line.
-    """
-    fraction = processed / total if total > 0 else 1
-    filled_length = int(bar_length * fraction)
-    bar = '#' * filled_length + '-' * (bar_length - filled_length)
-    print(f"\rProgress: [{bar}] {processed}/{total}", end='', flush=True)
+    def page_done(self, product_count: int, inserted: int = 0, write_time: float = 0.0):
+        """Records a committed page and redraws if the interval has passed."""
+        self.pages_done += 1
+        self.products_processed += product_count
+        self.products_in_db += inserted
+        self.write_time += write_time
+        self.draw()
+
+    def page_failed(self):
+        """Records a page that could not be fetched or written."""
+        self.failed_pages += 1
+        self.draw()
+
+    def elapsed(self) -> float:
+        return max(self.clock() - self.started_at, 1e-9)
+
+    def summary(self) -> Dict[str, Any]:
+        """Returns the current counters and rates."""
+        elapsed = self.elapsed()
+        pages_per_sec = self.pages_done / elapsed
+        remaining = max(self.total_pages - self.pages_done - self.failed_pages, 0)
+        return {
+            'elapsed': elapsed,
+            'pages_done': self.pages_done,
+            'failed_pages': self.failed_pages,
+            'total_pages': self.total_pages,
+            'products_processed': self.products_processed,
+            'products_in_db': self.products_in_db,
+            'products_per_sec': self.products_processed / elapsed,
+            'db_write_time': self.write_time,
+            'pages_per_sec': pages_per_sec,
+            'eta': remaining / pages_per_sec if pages_per_sec > 0 else None,
+        }
+
+    def draw(self, force: bool = False):
+        """Prints the progress line on the same line, at most once per interval."""
+        now = self.clock()
+        if not force and self._last_draw is not None and now - self._last_draw < self.redraw_interval:
+            return
+        self._last_draw = now
+
+        stats = self.summary()
+        handled = stats['pages_done'] + stats['failed_pages']
+        fraction = handled / self.total_pages if self.total_pages > 0 else 1
+        filled_length = int(self.bar_length * min(fraction, 1))
+        bar = '#' * filled_length + '-' * (self.bar_length - filled_length)
+        eta = stats['eta']
+        eta_str = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'
+        print(
+            f"\rProgress: [{bar}] {handled}/{self.total_pages} pages"
+            f" | {stats['products_processed']} products ({stats['products_in_db']} in DB)"
+            f" | {stats['products_per_sec']:.1f} products/s, {stats['pages_per_sec']:.2f} pages/s"
+            f" | ETA {eta_str} | failed {stats['failed_pages']}",
+            end='', flush=True
+        )
 
 
 def get_existing_product(conn, product_id):
     """
     Returns the existing row for a product, or None if not found.
+    The row supports both positional and column-name access.
     """
     cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
     cursor.execute("SELECT * FROM products WHERE productId = ?", (product_id,))
     return cursor.fetchone()
 
@@ -180,6 +182,40 @@ def format_timestamp():
     return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
 
+# price_history rows are (productId, price in kronor, format_timestamp() string);
+# the table stores them as integer öre and epoch seconds, one row per second.
+INSERT_HISTORY_SQL = """
+    INSERT INTO price_history (productId, ts, price_ore)
+    VALUES (?1, CAST(strftime('%s', ?3) AS INTEGER), CAST(ROUND(?2 * 100) AS INTEGER))
+    ON CONFLICT(productId, ts) DO NOTHING
+"""
+
+REPLACE_HISTORY_SQL = """
+    UPDATE price_history SET price_ore = CAST(ROUND(?2 * 100) AS INTEGER)
+    WHERE productId = ?1 AND ts = CAST(strftime('%s', ?3) AS INTEGER)
+      AND price_ore IS NOT CAST(ROUND(?2 * 100) AS INTEGER)
+"""
+
+
+def insert_price_history(cursor, rows: list) -> int:
+    """
+    Writes price_history rows and returns how many existing points they replaced.
+
+    A product keeps one point per second. A row for a second that already has
+    a point with another price replaces it, so the latest point matches
+    products.price, and every replacement is logged. The replacing pass only
+    runs if some row conflicted.
+    """
+    cursor.executemany(INSERT_HISTORY_SQL, rows)
+    if cursor.rowcount == len(rows):
+        return 0
+    cursor.executemany(REPLACE_HISTORY_SQL, rows)
+    replaced = cursor.rowcount
+    if replaced:
+        logger.warning(f"Replaced {replaced} price_history points recorded in the same second")
+    return replaced
+
+
 def insert_new_product(cursor, prod):
     """
     Inserts a new product into the database.
@@ -199,13 +235,7 @@ def insert_new_product(cursor, prod):
     price_change_percentage = 0.0
 
     # Record initial price in history
-    cursor.execute(
-        """
-        INSERT INTO price_history (productId, price, timestamp)
-        VALUES (?, ?, ?)
-        """,
-        (p_id, current_price, lastUpdated)
-    )
+    insert_price_history(cursor, [(p_id, current_price, lastUpdated)])
 
     cursor.execute(
         """
@@ -229,9 +259,11 @@ def insert_new_product(cursor, prod):
             price_change_percentage,
             volume,
             alcoholPercentage,
-            apk
+            apk,
+            first_price,
+            first_price_timestamp
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             p_id,
@@ -253,7 +285,9 @@ def insert_new_product(cursor, prod):
             price_change_percentage,
             volume_ml,
             abv_pct,
-            apk_value
+            apk_value,
+            current_price,
+            lastUpdated
         )
     )
     # Log the new insertion.
@@ -281,28 +315,19 @@ def update_existing_product(cursor, db_row, prod):
         apk_value = round(ml_ethanol / new_price_api, 2)
     launch_date_str = format_launch_date(prod)
     
-    # Get the first (earliest) price from price history
-    cursor.execute("""
-        SELECT price 
-        FROM price_history 
-        WHERE productId = ?
-        ORDER BY timestamp ASC
-        LIMIT 1
-    """, (p_id,))
-    first_price_result = cursor.fetchone()
-    first_price = first_price_result[0] if first_price_result else new_price_api
+    # The first recorded price is materialized on the product row; a product
+    # without one gets this price as its baseline.
+    first_price = db_row["first_price"]
+    if first_price is None:
+        first_price = new_price_api
     
     # Calculate price change percentage from first recorded price
-    price_change_percentage = round(((new_price_api - first_price) / first_price) * 100, 1)
+    price_change_percentage = 0.0
+    if first_price > 0:
+        price_change_percentage = round(((new_price_api - first_price) / first_price) * 100, 1)
     
     # Record the price change in history
-    cursor.execute(
-        """
-        INSERT INTO price_history (productId, price, timestamp)
-        VALUES (?, ?, ?)
-        """,
-        (p_id, new_price_api, lastUpdated)
-    )
+    insert_price_history(cursor, [(p_id, new_price_api, lastUpdated)])
     
     cursor.execute(
         """
@@ -316,7 +341,9 @@ def update_existing_product(cursor, db_row, prod):
             apk = ?,
             volume = ?,
             alcoholPercentage = ?,
-            productLaunchDate = ?
+            productLaunchDate = ?,
+            first_price = COALESCE(first_price, ?),
+            first_price_timestamp = COALESCE(first_price_timestamp, ?)
         WHERE productId = ?
         """,
         (
@@ -329,6 +356,8 @@ def update_existing_product(cursor, db_row, prod):
             volume_ml,
             abv_pct,
             launch_date_str,
+            new_price_api,
+            lastUpdated,
             p_id
         )
     )
@@ -349,39 +378,302 @@ def insert_or_update_product(conn, prod):
         insert_new_product(cursor, prod)
     else:
         update_existing_product(cursor, existing_row, prod)
+    forget_committed_pages(conn)
+    db.bump_data_generation(conn)
     conn.commit()
 
 
-def batch_insert_products(products: list, db_name="products.db"):
+def normalize_product(prod: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Computes the derived fields of an API product (defaults, APK, launch date)
+    and returns a dict keyed by products column, or None without a productId.
+    """
+    p_id = prod.get("productId")
+    if not p_id:
+        return None
+    price = prod.get("price") or 0.0
+    volume_ml = prod.get("volume") or 0.0
+    abv_pct = prod.get("alcoholPercentage") or 0.0
+    apk_value = None
+    if price > 0:
+        ml_ethanol = volume_ml * (abv_pct / 100.0)
+        apk_value = round(ml_ethanol / price, 2)
+
+    row = {column: prod.get(column) for column in METADATA_COLUMNS}
+    row.update(
+        productId=p_id,
+        productLaunchDate=format_launch_date(prod),
+        isTemporaryOutOfStock=prod.get("isTemporaryOutOfStock"),
+        isCompletelyOutOfStock=prod.get("isCompletelyOutOfStock"),
+        price=price,
+        volume=volume_ml,
+        alcoholPercentage=abv_pct,
+        apk=apk_value,
+    )
+    return row
+
+
+def bulk_upsert_products(conn, products: list, stats: Optional[Dict[str, int]] = None,
+                         snapshot: Optional[ProductSnapshot] = None, normalized: bool = False,
+                         checkpoints: Optional[List[Tuple[int, int, int]]] = None,
+                         timestamp: Optional[str] = None,
+                         seen: Optional[Tuple[int, List[str]]] = None,
+                         pages: Optional[List[Tuple[str, str]]] = None) -> List[str]:
+    """
+    Inserts or updates a page of products inside one transaction.
+
+    Every product is classified against a ProductSnapshot as new,
+    price-changed, metadata-changed or unchanged. Without a run-wide snapshot
+    the page is diffed against the existing rows with a single
+    `WHERE productId IN (...)` query. New products, price changes and their
+    price_history rows are then written with executemany; metadata changes
+    update the descriptive columns only, and unchanged products are not
+    written at all. The price change percentage is measured from the
+    materialized first price. The data generation is bumped in the same
+    transaction.
+
+    Args:
+        conn: Open database connection
+        products: Product dictionaries from the API
+        stats: Optional counter dict; 'inserted', 'updated' and
+            'metadata_updated' are incremented
+        snapshot: Run-wide snapshot of the products table, kept up to date here
+        normalized: The products already went through normalize_product
+        checkpoints: (run_id, page, product_count) crawl_pages rows to commit
+            in the same transaction
+        timestamp: Time to record the changes at (defaults to now)
+        seen: (run_id, product ids) to stamp as seen in that run, including
+            unchanged products; stamped products are no longer delisted.
+            Products already seen by a later run are left alone.
+        pages: (url, body hash) markers of the cached pages whose products
+            are committed by this transaction
+
+    Returns:
+        The change records for this batch (also appended to changes_log)
+    """
+    # Later duplicates of a productId within the batch win, like sequential upserts would.
+    by_id = {}
+    for prod in products:
+        row = prod if normalized else normalize_product(prod)
+        if row is not None:
+            by_id[row["productId"]] = row
+
+    if snapshot is None:
+        snapshot = ProductSnapshot.load(conn, list(by_id))
+
+    cursor = conn.cursor()
+    last_updated = timestamp or format_timestamp()
+    insert_rows = []
+    price_rows = []
+    metadata_rows = []
+    history_rows = []
+    changes = []
+    written = {}
+
+    for p_id, row in by_id.items():
+        new_price = row["price"]
+        metadata = [row[column] for column in METADATA_COLUMNS]
+        current = snapshot.get(p_id)
+        first_price = current[6] if current is not None and current[6] is not None else new_price
+        entry = make_entry(
+            new_price, row["isTemporaryOutOfStock"], row["isCompletelyOutOfStock"],
+            row["volume"], row["alcoholPercentage"], metadata, first_price
+        )
+        kind = snapshot.classify(p_id, entry)
+
+        if kind == NEW:
+            insert_rows.append((
+                p_id, *metadata,
+                row["isTemporaryOutOfStock"], row["isCompletelyOutOfStock"],
+                new_price, last_updated, 0.0, row["volume"], row["alcoholPercentage"], row["apk"],
+                new_price, last_updated
+            ))
+            history_rows.append((p_id, new_price, last_updated))
+            changes.append(f"Inserted product {p_id} (price: {new_price})")
+        elif kind == PRICE_CHANGED:
+            old_price = current[0]
+            price_change_percentage = 0.0
+            if first_price and first_price > 0:
+                price_change_percentage = round(((new_price - first_price) / first_price) * 100, 1)
+            price_rows.append((
+                new_price, last_updated, price_change_percentage,
+                row["isTemporaryOutOfStock"], row["isCompletelyOutOfStock"],
+                row["apk"], row["volume"], row["alcoholPercentage"], row["productLaunchDate"],
+                new_price, last_updated, p_id
+            ))
+            history_rows.append((p_id, new_price, last_updated))
+            changes.append(
+                f"Updated product {p_id} (price: {old_price} -> {new_price}, change: {price_change_percentage}%)"
+            )
+        if kind == METADATA_CHANGED or (kind == PRICE_CHANGED and snapshot.metadata_changed(p_id, entry)):
+            metadata_rows.append((
+                *metadata,
+                row["isTemporaryOutOfStock"], row["isCompletelyOutOfStock"],
+                row["volume"], row["alcoholPercentage"], row["apk"], p_id
+            ))
+        if kind != UNCHANGED:
+            written[p_id] = entry
+
+    with conn:
+        if insert_rows:
+            cursor.executemany(
+                """
+                INSERT INTO products (
+                    productId, productNumber, productNumberShort, productNameBold,
+                    productNameThin, producerName, supplierName, categoryLevel1,
+                    categoryLevel2, categoryLevel3, country, productLaunchDate,
+                    isTemporaryOutOfStock, isCompletelyOutOfStock, price, lastUpdated,
+                    price_change_percentage, volume, alcoholPercentage, apk,
+                    first_price, first_price_timestamp
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                insert_rows
+            )
+        if price_rows:
+            cursor.executemany(
+                """
+                UPDATE products
+                SET
+                    price = ?,
+                    lastUpdated = ?,
+                    price_change_percentage = ?,
+                    isTemporaryOutOfStock = ?,
+                    isCompletelyOutOfStock = ?,
+                    apk = ?,
+                    volume = ?,
+                    alcoholPercentage = ?,
+                    productLaunchDate = ?,
+                    first_price = COALESCE(first_price, ?),
+                    first_price_timestamp = COALESCE(first_price_timestamp, ?)
+                WHERE productId = ?
+                """,
+                price_rows
+            )
+        if metadata_rows:
+            cursor.executemany(
+                """
+                UPDATE products
+                SET
+                    productNumber = ?,
+                    productNumberShort = ?,
+                    productNameBold = ?,
+                    productNameThin = ?,
+                    producerName = ?,
+                    supplierName = ?,
+                    categoryLevel1 = ?,
+                    categoryLevel2 = ?,
+                    categoryLevel3 = ?,
+                    country = ?,
+                    productLaunchDate = ?,
+                    isTemporaryOutOfStock = ?,
+                    isCompletelyOutOfStock = ?,
+                    volume = ?,
+                    alcoholPercentage = ?,
+                    apk = ?
+                WHERE productId = ?
+                """,
+                metadata_rows
+            )
+        if history_rows:
+            insert_price_history(cursor, history_rows)
+        if seen is not None:
+            seen_run, seen_ids = seen
+            cursor.executemany(
+                """
+                UPDATE products SET last_seen_run = ?, delisted = 0, delisted_at = NULL
+                WHERE productId = ? AND (last_seen_run IS NULL OR last_seen_run <= ?)
+                """,
+                ((seen_run, p_id, seen_run) for p_id in seen_ids)
+            )
+        if checkpoints:
+            cursor.executemany(
+                """
+                INSERT OR REPLACE INTO crawl_pages (run_id, page, product_count, committed_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                [(run_id, page, count, last_updated) for run_id, page, count in checkpoints]
+            )
+        if pages:
+            cursor.executemany("INSERT OR REPLACE INTO committed_pages (url, body_hash) VALUES (?, ?)", pages)
+        # Readers see every committed batch, even if the run never finishes.
+        db.bump_data_generation(conn)
+
+    # Only advance the snapshot once the transaction has committed.
+    for p_id, entry in written.items():
+        snapshot.update(p_id, entry)
+
+    if stats is not None:
+        stats['inserted'] = stats.get('inserted', 0) + len(insert_rows)
+        stats['updated'] = stats.get('updated', 0) + len(price_rows)
+        stats['metadata_updated'] = stats.get('metadata_updated', 0) + len(metadata_rows)
+    changes_log.extend(changes)
+    return changes
+
+
+def batch_insert_products(products: list, db_name="products.db", delta_only: bool = False) -> Dict[str, int]:
     """
     Batch insert/update products for better performance.
+
+    By default every product is rewritten and gets a price_history row. With
+    delta_only, price moves smaller than MIN_PRICE_CHANGE_THRESHOLD are
+    ignored, history is only written for new products and real price changes,
+    and the upsert's ON CONFLICT DO UPDATE gets a WHERE clause so rows whose
+    columns are unchanged are never rewritten.
+
+    Returns:
+        Counters for the batch: products, products_written, products_skipped,
+        history_written and history_skipped
     """
+    result = {
+        'products': 0,
+        'products_written': 0,
+        'products_skipped': 0,
+        'history_written': 0,
+        'history_skipped': 0,
+    }
     if not products:
-        return
+        return result
         
     try:
         conn = get_database_connection(db_name)
         cursor = conn.cursor()
         
         # Prepare batch operations
-        insert_sql = """
-            INSERT OR REPLACE INTO products (
+        columns_sql = """
                 productId, productNumber, productNumberShort, productNameBold, 
                 productNameThin, producerName, supplierName, categoryLevel1, 
                 categoryLevel2, categoryLevel3, country, productLaunchDate,
                 isTemporaryOutOfStock, isCompletelyOutOfStock, price, lastUpdated,
-                price_change_percentage, volume, alcoholPercentage, apk
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                price_change_percentage, volume, alcoholPercentage, apk,
+                first_price, first_price_timestamp
         """
-        
-        history_sql = """
-            INSERT INTO price_history (productId, price, timestamp)
-            VALUES (?, ?, ?)
+        values_sql = "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        compared = [
+            "price", "isTemporaryOutOfStock", "isCompletelyOutOfStock", "volume",
+            "alcoholPercentage", *METADATA_COLUMNS,
+        ]
+        updated = compared + ["lastUpdated", "price_change_percentage", "apk"]
+        set_sql = ",\n".join(f"{column} = excluded.{column}" for column in updated)
+        # The baseline is never overwritten once a product has one.
+        insert_sql = f"""
+            INSERT INTO products ({columns_sql}) {values_sql}
+            ON CONFLICT(productId) DO UPDATE SET
+                {set_sql},
+                first_price = COALESCE(products.first_price, excluded.first_price),
+                first_price_timestamp = COALESCE(products.first_price_timestamp, excluded.first_price_timestamp)
         """
+        if delta_only:
+            where_sql = "\n OR ".join(f"excluded.{column} IS NOT products.{column}" for column in compared)
+            insert_sql += f" WHERE {where_sql}"
         
         batch_data = []
         history_data = []
         current_time = format_timestamp()
+
+        # Load the existing rows for the whole batch up front; they provide
+        # the materialized baselines and, in delta mode, the diff.
+        product_ids = [prod.get("productId") for prod in products if prod.get("productId")]
+        snapshot = ProductSnapshot.load(conn, product_ids)
         
         for prod in products:
             p_id = prod.get("productId")
@@ -389,6 +681,10 @@ def batch_insert_products(products: list, db_name="products.db"):
                 continue
                 
             current_price = prod.get("price") or 0.0
+            existing = snapshot.get(p_id)
+            if delta_only and existing is not None and abs(current_price - existing[0]) < MIN_PRICE_CHANGE_THRESHOLD:
+                # Below the threshold the stored price is kept as is.
+                current_price = existing[0]
             volume_ml = prod.get("volume") or 0.0
             abv_pct = prod.get("alcoholPercentage") or 0.0
             apk_value = None
@@ -397,46 +693,60 @@ def batch_insert_products(products: list, db_name="products.db"):
                 apk_value = round(ml_ethanol / current_price, 2)
                 
             launch_date_str = format_launch_date(prod)
+            metadata = [prod.get(column) for column in METADATA_COLUMNS[:-1]] + [launch_date_str]
             
-            # Calculate price change percentage from first recorded price
+            # Calculate price change percentage from first recorded price;
+            # products seen for the first time start their baseline here.
             price_change_percentage = 0.0
-            
-            # Get the first (earliest) price from price history
-            cursor.execute("""
-                SELECT price 
-                FROM price_history 
-                WHERE productId = ?
-                ORDER BY timestamp ASC
-                LIMIT 1
-            """, (p_id,))
-            first_price_result = cursor.fetchone()
-            
-            if first_price_result:
-                first_price = first_price_result[0]
-                if first_price and first_price > 0:
-                    price_change_percentage = round(((current_price - first_price) / first_price) * 100, 1)
+            first_price, first_price_timestamp = current_price, current_time
+            if existing is not None and existing[6] is not None:
+                first_price, first_price_timestamp = existing[6], None
+            if first_price and first_price > 0:
+                price_change_percentage = round(((current_price - first_price) / first_price) * 100, 1)
+
+            result['products'] += 1
+            kind = NEW
+            if delta_only:
+                entry = make_entry(
+                    current_price, prod.get("isTemporaryOutOfStock"), prod.get("isCompletelyOutOfStock"),
+                    volume_ml, abv_pct, metadata, first_price
+                )
+                kind = snapshot.classify(p_id, entry)
+                snapshot.update(p_id, entry)
+                if kind == UNCHANGED:
+                    result['products_skipped'] += 1
+                    result['history_skipped'] += 1
             
             batch_data.append((
-                p_id, prod.get("productNumber"), prod.get("productNumberShort"),
-                prod.get("productNameBold"), prod.get("productNameThin"),
-                prod.get("producerName"), prod.get("supplierName"),
-                prod.get("categoryLevel1"), prod.get("categoryLevel2"),
-                prod.get("categoryLevel3"), prod.get("country"), launch_date_str,
+                p_id, *metadata,
                 prod.get("isTemporaryOutOfStock"), prod.get("isCompletelyOutOfStock"),
-                current_price, current_time, price_change_percentage, volume_ml, abv_pct, apk_value
+                current_price, current_time, price_change_percentage, volume_ml, abv_pct, apk_value,
+                first_price, first_price_timestamp
             ))
             
-            history_data.append((p_id, current_price, current_time))
+            if kind in (NEW, PRICE_CHANGED):
+                history_data.append((p_id, current_price, current_time))
+            elif kind == METADATA_CHANGED:
+                result['history_skipped'] += 1
         
         # Execute batch operations
         if batch_data:
             cursor.executemany(insert_sql, batch_data)
             
         if history_data:
-            cursor.executemany(history_sql, history_data)
+            insert_price_history(cursor, history_data)
             
+        forget_committed_pages(conn)
+        db.bump_data_generation(conn)
         conn.commit()
-        logger.info(f"Batch processed {len(batch_data)} products")
+        result['products_written'] = result['products'] - result['products_skipped']
+        result['history_written'] = len(history_data)
+        logger.info(
+            f"Batch processed {len(batch_data)} products "
+            f"({result['products_skipped']} unchanged rows and "
+            f"{result['history_skipped']} history rows not written)"
+        )
+        return result
         
     except sqlite3.Error as e:
         logger.error(f"Batch insert error: {e}")
@@ -446,107 +756,938 @@ def batch_insert_products(products: list, db_name="products.db"):
         conn.close()
 
 
-def make_api_request(session: Session, url: str, headers: Dict[str, str]) -> Optional[Dict[str, Any]]:
+# Status codes that mean "try again later" rather than "this request is wrong".
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def send_api_request(session: Session, url: str, headers: Dict[str, str],
+                     controller: Optional[RateController] = None,
+                     retries: int = MAX_RETRIES) -> Optional[requests.Response]:
     """
-    Makes an API request with retry logic and proper error handling.
-    
+    Sends a GET request with retry logic and proper error handling.
+
+    Retries use exponential backoff with jitter and honour Retry-After on
+    429 and 5xx responses. Other 4xx responses are not retried. When a shared
+    RateController is given it also gates concurrency and trips its circuit
+    breaker on repeated failures.
+
     Args:
         session: Requests session object
         url: API endpoint URL
         headers: Request headers
-        
+        controller: Shared rate controller (a private one is used if omitted)
+        retries: Number of attempts
+
     Returns:
-        JSON response data or None if failed
+        The successful (2xx or 304 Not Modified) response, or None if failed
     """
-    for attempt in range(MAX_RETRIES):
+    if controller is None:
+        controller = RateController(base_delay=RETRY_DELAY)
+
+    for attempt in range(retries):
+        status = None
+        retry_after = None
+        probe = controller.acquire()
         try:
-            logger.info(f"Making API request to {url} (attempt {attempt + 1}/{MAX_RETRIES})")
+            logger.info(f"Making API request to {url} (attempt {attempt + 1}/{retries})")
+            started = time.monotonic()
             response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+            status = response.status_code
+            if status in RETRYABLE_STATUS_CODES:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"API request failed (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
-            if attempt < MAX_RETRIES - 1:
-                logger.info(f"Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
-            else:
-                logger.error(f"All API request attempts failed for {url}")
+            controller.record_success(time.monotonic() - started)
+            return response
+        except requests.exceptions.HTTPError as e:
+            if status not in RETRYABLE_STATUS_CODES:
+                controller.record_client_error(status)
+                logger.error(f"API request failed with non-retryable status {status} for {url}: {e}")
                 return None
+            controller.record_failure(status, retry_after)
+            logger.warning(f"API request failed (attempt {attempt + 1}/{retries}): {e}")
+        except requests.exceptions.RequestException as e:
+            controller.record_failure(status)
+            logger.warning(f"API request failed (attempt {attempt + 1}/{retries}): {e}")
         except Exception as e:
             logger.error(f"Unexpected error during API request: {e}")
             return None
+        finally:
+            controller.release(probe)
+
+        if attempt < retries - 1:
+            delay = controller.backoff(attempt, retry_after)
+            logger.info(f"Retrying in {delay:.1f} seconds...")
+            controller.sleep(delay)
+
+    logger.error(f"All API request attempts failed for {url}")
     return None
 
 
-def fetch_products_from_api():
+def make_api_request(session: Session, url: str, headers: Dict[str, str],
+                     controller: Optional[RateController] = None) -> Optional[Dict[str, Any]]:
+    """
+    Makes an API request with retry logic (see send_api_request).
+
+    Returns:
+        JSON response data or None if failed
+    """
+    response = send_api_request(session, url, headers, controller)
+    if response is None:
+        return None
+    try:
+        return response.json()
+    except ValueError as e:
+        logger.error(f"Invalid JSON in API response from {url}: {e}")
+        return None
+
+
+class FetchedPage(NamedTuple):
+    """
+    A page response handed from the fetch stage to the normalize stage.
+
+    `unchanged` pages (304 Not Modified, or a body identical to the cached
+    one) carry no body; `product_count`, `body_hash` and `product_ids` are
+    then taken from the cache. The
+    validators and hash of changed pages are stored in the cache once the
+    page has been committed. `cached` pages are unchanged pages whose body was
+    read back from the cache to be written again; their entry is kept as is.
+    """
+    url: str
+    body: Optional[bytes]
+    unchanged: bool = False
+    product_count: int = 0
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    body_hash: Optional[str] = None
+    product_ids: Optional[List[str]] = None
+    cached: bool = False
+
+
+def fetch_page(session: Session, url: str, headers: Dict[str, str],
+               controller: Optional[RateController] = None,
+               cache: Optional[ResponseCache] = None,
+               retries: int = MAX_RETRIES) -> Optional[FetchedPage]:
+    """
+    Fetches a result page, revalidating it against the response cache.
+
+    Sends If-None-Match/If-Modified-Since when the cached response has
+    validators, and treats a 304 or a body identical to the cached one as
+    an unchanged page.
+
+    Args:
+        session: Requests session object
+        url: Page URL
+        headers: Request headers
+        controller: Shared rate controller
+        cache: Response cache, or None to always fetch the full page
+        retries: Number of attempts
+
+    Returns:
+        The fetched page, or None if the request failed
+    """
+    entry = cache.lookup(url) if cache is not None else None
+    if entry is not None:
+        headers = {**headers, **cache.conditional_headers(entry)}
+    response = send_api_request(session, url, headers, controller, retries)
+    if response is None:
+        return None
+    if response.status_code == 304:
+        if entry is None:
+            logger.error(f"Got 304 Not Modified for uncached page {url}")
+            return None
+        cache.record_hit(url, entry, not_modified=True)
+        return FetchedPage(url, None, unchanged=True, product_count=entry.product_count,
+                           body_hash=entry.body_hash, product_ids=entry.product_ids)
+
+    body = response.content
+    if cache is None:
+        return FetchedPage(url, body)
+    digest = body_digest(body)
+    if entry is not None and entry.body_hash == digest:
+        cache.record_hit(url, entry, not_modified=False)
+        return FetchedPage(url, None, unchanged=True, product_count=entry.product_count,
+                           body_hash=entry.body_hash, product_ids=entry.product_ids)
+    cache.record_miss()
+    return FetchedPage(
+        url, body,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        body_hash=digest,
+    )
+
+
+def build_page_url(page: int, base_url: Optional[str] = None, sort_by: str = "Score",
+                   sort_direction: str = "Ascending", filters: Optional[Dict[str, str]] = None,
+                   size: int = PAGE_SIZE) -> str:
+    """
+    Returns the product search URL for a single result page of `size`
+    products, optionally narrowed by API filters such as {'categoryLevel1': 'Vin'}.
+    """
+    url = f"{base_url or api_url}?page={page}&size={size}&sortBy={sort_by}&sortDirection={sort_direction}"
+    if filters:
+        url += "&" + urlencode(filters)
+    return url
+
+
+# Crawl run states stored in crawl_runs.status
+RUN_RUNNING = "running"
+RUN_COMPLETE = "complete"
+RUN_INCOMPLETE = "incomplete"
+
+# Crawl modes stored in crawl_runs.mode. A full crawl walks every page; a
+# delta crawl walks the newest launches first and stops once it only sees
+# known, unchanged products. Auto runs a full crawl when the last complete
+# one is older than the configured interval, and a delta crawl otherwise.
+MODE_FULL = "full"
+MODE_DELTA = "delta"
+MODE_AUTO = "auto"
+CRAWL_MODES = (MODE_FULL, MODE_DELTA, MODE_AUTO)
+
+# (sortBy, sortDirection) used by each crawl mode
+MODE_SORT = {
+    MODE_FULL: ("Score", "Ascending"),
+    MODE_DELTA: ("ProductLaunchDate", "Descending"),
+}
+
+
+def start_crawl_run(conn, total_pages: int, mode: str = MODE_FULL, page_size: int = PAGE_SIZE) -> int:
+    """
+    Records a new crawl run and returns its id.
+    """
+    with conn:
+        cursor = conn.execute(
+            "INSERT INTO crawl_runs (started_at, total_pages, status, mode, page_size) VALUES (?, ?, ?, ?, ?)",
+            (format_timestamp(), total_pages, RUN_RUNNING, mode, page_size)
+        )
+    return cursor.lastrowid
+
+
+def get_resumable_run(conn) -> Optional[Tuple[int, int, int]]:
+    """
+    Returns (run_id, total_pages, page_size) of the latest full crawl run if
+    it did not finish with every page committed, or None if there is nothing
+    to resume. Delta runs are never resumed; the next delta crawl covers them.
+    """
+    row = conn.execute(
+        """
+        SELECT run_id, total_pages, status, page_size FROM crawl_runs
+        WHERE mode = ? ORDER BY run_id DESC LIMIT 1
+        """,
+        (MODE_FULL,)
+    ).fetchone()
+    if row is None or row[2] == RUN_COMPLETE:
+        return None
+    # Runs recorded before page sizes were stored used 30 products per page.
+    return row[0], row[1], row[3] or 30
+
+
+def get_last_full_crawl(conn) -> Optional[datetime]:
+    """
+    Returns when the latest complete full crawl finished, or None.
+    """
+    row = conn.execute(
+        "SELECT MAX(finished_at) FROM crawl_runs WHERE mode = ? AND status = ?",
+        (MODE_FULL, RUN_COMPLETE)
+    ).fetchone()
+    if row is None or row[0] is None:
+        return None
+    return datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def resolve_crawl_mode(conn, mode: str, full_interval_hours: float) -> str:
+    """
+    Returns the concrete crawl mode (full or delta) for a requested mode.
+    """
+    if mode != MODE_AUTO:
+        return mode
+    last_full = get_last_full_crawl(conn)
+    if last_full is None:
+        logger.info("No complete full crawl yet, running a full crawl")
+        return MODE_FULL
+    age_hours = (datetime.now(timezone.utc) - last_full).total_seconds() / 3600
+    if age_hours >= full_interval_hours:
+        logger.info(f"Last full crawl was {age_hours:.1f}h ago, running a full crawl")
+        return MODE_FULL
+    logger.info(f"Last full crawl was {age_hours:.1f}h ago, running a delta crawl")
+    return MODE_DELTA
+
+
+def get_committed_pages(conn, run_id: int) -> set:
+    """
+    Returns the set of pages already committed for a crawl run.
+    """
+    return {row[0] for row in conn.execute("SELECT page FROM crawl_pages WHERE run_id = ?", (run_id,))}
+
+
+def load_committed_pages(conn) -> Dict[str, str]:
+    """Returns the url -> body hash markers of the cached pages committed to this database."""
+    return dict(conn.execute("SELECT url, body_hash FROM committed_pages"))
+
+
+def forget_committed_pages(conn):
+    """
+    Drops every committed page marker, inside the caller's transaction.
+    Called by writers that change products outside a crawl, after which no
+    cached page can be trusted to describe the stored rows.
+    """
+    conn.execute("DELETE FROM committed_pages")
+
+
+def finish_crawl_run(conn, run_id: int, status: str, request_count: int = 0):
+    """
+    Marks a crawl run as complete or incomplete and adds the API requests
+    made (including retries) to its request count. Bumps the data
+    generation, since the run's pages are now committed.
+    """
+    with conn:
+        db.bump_data_generation(conn)
+        conn.execute(
+            """
+            UPDATE crawl_runs
+            SET finished_at = ?, status = ?, request_count = COALESCE(request_count, 0) + ?
+            WHERE run_id = ?
+            """,
+            (format_timestamp(), status, request_count, run_id)
+        )
+
+
+def record_products_seen(conn, run_id: int) -> int:
+    """
+    Stores and returns how many products were stamped as seen in a crawl run.
+    """
+    with conn:
+        count = conn.execute("SELECT COUNT(*) FROM products WHERE last_seen_run = ?", (run_id,)).fetchone()[0]
+        conn.execute("UPDATE crawl_runs SET products_seen = ? WHERE run_id = ?", (count, run_id))
+    return count
+
+
+def mark_delisted(conn, run_id: int, timestamp: Optional[str] = None) -> int:
+    """
+    Marks every listed product not seen in a complete full crawl run as
+    delisted, using the last_seen_run index, and records the count on the run.
+    Products seen again by a later run are relisted when they are stamped.
+
+    Returns:
+        Number of products newly marked as delisted
+    """
+    with conn:
+        db.bump_data_generation(conn)
+        cursor = conn.execute(
+            """
+            UPDATE products SET delisted = 1, delisted_at = ?
+            WHERE (last_seen_run < ? OR last_seen_run IS NULL) AND delisted = 0
+            """,
+            (timestamp or format_timestamp(), run_id)
+        )
+        conn.execute("UPDATE crawl_runs SET delisted = ? WHERE run_id = ?", (cursor.rowcount, run_id))
+    return cursor.rowcount
+
+
+# crawl_runs columns copied into a run's archive when it finishes.
+RUN_RECORD_COLUMNS = ("run_id", "started_at", "finished_at", "total_pages", "status", "mode",
+                      "page_size", "request_count", "products_seen", "delisted")
+
+
+def archive_run_record(conn, archive: CrawlArchive, run_id: int):
+    """
+    Appends the finished run's crawl_runs row to its archive, so reprocessing
+    into another database can recreate the run and replay its delisting.
+    """
+    row = conn.execute(
+        f"SELECT {', '.join(RUN_RECORD_COLUMNS)} FROM crawl_runs WHERE run_id = ?", (run_id,)
+    ).fetchone()
+    archive.open()
+    try:
+        archive.write_run(dict(zip(RUN_RECORD_COLUMNS, row)))
+    finally:
+        archive.close()
+
+
+def restore_run_record(conn, run: Dict[str, Any]):
+    """Recreates a crawl_runs row from an archived run record."""
+    columns = [column for column in RUN_RECORD_COLUMNS if column in run]
+    with conn:
+        conn.execute(
+            f"INSERT INTO crawl_runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [run[column] for column in columns]
+        )
+
+
+class PageIngest:
+    """
+    Normalize and write stages of the ingest pipeline for one crawl run.
+
+    The writer keeps its own SQLite connection, opened and closed on the
+    writer thread, and commits each batch of consecutive pages together with
+    their crawl_pages checkpoints in a single transaction. Every product on a
+    page, changed or not, is stamped with the run in products.last_seen_run.
+    Unchanged pages are otherwise only checkpointed, but only if the products
+    database holds a committed_pages marker for the same body and every
+    product on the page is in the snapshot; any other unchanged page is
+    written again from its cached body. Changed pages are stored in the
+    response cache after their transaction, which also records their markers,
+    has committed. With an archive, every raw page is appended to it before
+    the transaction.
+
+    With stop_after_unchanged set (delta crawls), on_early_stop is called once
+    that many consecutive pages were written without a new, price-changed or
+    metadata-changed product.
+    """
+
+    def __init__(self, db_name: str, snapshot: ProductSnapshot, tracker: ProgressTracker,
+                 run_id: Optional[int] = None, cache: Optional[ResponseCache] = None,
+                 archive: Optional[CrawlArchive] = None, stop_after_unchanged: Optional[int] = None,
+                 committed_pages: Optional[Dict[str, str]] = None):
+        self.db_name = db_name
+        self.snapshot = snapshot
+        self.tracker = tracker
+        self.run_id = run_id
+        # Run stamped into products.last_seen_run; None leaves it untouched.
+        self.seen_run = run_id
+        self.cache = cache
+        # url -> body hash of the cached pages committed to this database.
+        self.committed_pages = committed_pages if committed_pages is not None else {}
+        self.archive = archive
+        # Time the next batch is recorded at; None means now.
+        self.timestamp: Optional[str] = None
+        self.conn = None
+        self.invalid_products = 0
+        self.unchanged_pages = 0
+        self.stop_after_unchanged = stop_after_unchanged
+        self.on_early_stop: Optional[Callable[[], None]] = None
+        self.consecutive_unchanged = 0
+        self.stopped_at_page: Optional[int] = None
+        # Called with (page, product count) for every committed page.
+        self.on_page_written: Optional[Callable[[int, int], None]] = None
+        # Products already seen this run; repeats (e.g. across shards) are counted.
+        self.seen_ids: set = set()
+        self.duplicates = 0
+
+    def open(self):
+        self.conn = get_database_connection(self.db_name)
+        if self.archive is not None:
+            self.archive.open()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.archive is not None:
+            self.archive.close()
+
+    def normalize(self, page: int, fetched: Optional[FetchedPage]
+                  ) -> Optional[Tuple[int, Optional[List[Dict[str, Any]]], FetchedPage]]:
+        """
+        Parses, validates and normalizes the products of a fetched page.
+        Returns (products on page, normalized rows, fetched page), with rows
+        None for unchanged pages, or None if the fetch failed.
+        """
+        if fetched is None:
+            return None
+        if fetched.unchanged:
+            if self.is_committed(fetched):
+                return fetched.product_count, None, fetched
+            # The cache was filled for another state of the database (a
+            # restored backup, a replay, an interrupted run): write the page again.
+            body = self.cache.load_body(fetched.url) if self.cache is not None else None
+            if body is None:
+                logger.error(f"Cached body missing for unchanged page {page}")
+                return None
+            fetched = fetched._replace(body=body, unchanged=False, cached=True)
+        try:
+            data = json.loads(fetched.body)
+        except ValueError as e:
+            logger.error(f"Invalid JSON on page {page}: {e}")
+            return None
+        return self.normalize_data(page, data) + (fetched,)
+
+    def is_committed(self, fetched: FetchedPage) -> bool:
+        """
+        Returns True if the products of an unchanged page are known to be in
+        the database: its committed_pages marker matches the cached body and
+        every product id of the page is in the snapshot.
+        """
+        if fetched.body_hash is None or fetched.product_ids is None:
+            return False
+        if self.committed_pages.get(fetched.url) != fetched.body_hash:
+            return False
+        return all(product_id in self.snapshot for product_id in fetched.product_ids)
+
+    def normalize_data(self, page: int, data: Dict[str, Any]) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Validates and normalizes the products of a parsed page.
+        Returns (products on page, normalized rows).
+        """
+        products_on_page = data.get("products", [])
+        rows = []
+        for prod in products_on_page:
+            is_valid, errors = validate_product_data(prod)
+            if not is_valid:
+                # Incomplete products are still stored, as before; they are only counted.
+                self.invalid_products += 1
+                logger.debug(f"Product {prod.get('productId')} on page {page} failed validation: {errors}")
+            row = normalize_product(prod)
+            if row is not None:
+                rows.append(row)
+        return len(products_on_page), rows
+
+    def write(self, batch: List[Tuple[int, Optional[Tuple[int, Optional[List[Dict[str, Any]]], FetchedPage]]]]):
+        """Writes a batch of consecutive pages in one transaction."""
+        fetched = []
+        for page, value in batch:
+            if value is None:
+                self.tracker.page_failed()
+                self.consecutive_unchanged = 0
+                logger.warning(f"Failed to fetch page {page}")
+            else:
+                fetched.append((page, value))
+        if not fetched:
+            return
+
+        rows = [row for _, (_, page_rows, _) in fetched if page_rows for row in page_rows]
+        seen = None
+        if self.seen_run is not None:
+            seen_ids = [row["productId"] for row in rows]
+            for _, (_, page_rows, response) in fetched:
+                if page_rows is None and response.product_ids:
+                    seen_ids.extend(response.product_ids)
+            seen = (self.seen_run, seen_ids)
+        checkpoints = None
+        if self.run_id is not None:
+            checkpoints = [(self.run_id, page, count) for page, (count, _, _) in fetched]
+        # One timestamp per batch, shared with the archive so replays match.
+        timestamp = self.timestamp or format_timestamp()
+        if self.archive is not None:
+            try:
+                self.archive_pages(fetched, timestamp)
+            except OSError as e:
+                logger.error(f"Archiving disabled for the rest of the run: {e}")
+                self.archive.close()
+                self.archive = None
+        markers = [
+            (response.url, response.body_hash) for _, (_, page_rows, response) in fetched
+            if page_rows is not None and response is not None and response.body_hash is not None
+        ]
+        batch_stats = {}
+        started = time.perf_counter()
+        try:
+            bulk_upsert_products(self.conn, rows, batch_stats, self.snapshot, normalized=True,
+                                 checkpoints=checkpoints, timestamp=timestamp, seen=seen, pages=markers)
+        except Exception as e:
+            logger.error(f"Error processing pages {fetched[0][0]}-{fetched[-1][0]}: {e}")
+            for _ in fetched:
+                self.tracker.page_failed()
+            return
+        write_time = time.perf_counter() - started
+
+        for index, (page, (count, page_rows, response)) in enumerate(fetched):
+            if page_rows is None:
+                self.unchanged_pages += 1
+            else:
+                for row in page_rows:
+                    if row["productId"] in self.seen_ids:
+                        self.duplicates += 1
+                    else:
+                        self.seen_ids.add(row["productId"])
+            if self.on_page_written:
+                self.on_page_written(page, count)
+            if page_rows is not None and response is not None and response.body_hash is not None:
+                self.committed_pages[response.url] = response.body_hash
+            if page_rows is not None and self.cache is not None and not response.cached:
+                self.cache.store(response.url, response.body, response.etag, response.last_modified,
+                                 response.body_hash, count, [row["productId"] for row in page_rows])
+            last = index == len(fetched) - 1
+            self.tracker.page_done(
+                count,
+                batch_stats.get('inserted', 0) if last else 0,
+                write_time if last else 0.0
+            )
+        if self.stop_after_unchanged:
+            self.check_early_stop(fetched[-1][0], batch_stats)
+
+    def check_early_stop(self, page: int, batch_stats: Dict[str, int]):
+        """Counts unchanged pages and triggers the early stop of a delta crawl."""
+        if any(batch_stats.get(key) for key in ('inserted', 'updated', 'metadata_updated')):
+            self.consecutive_unchanged = 0
+            return
+        self.consecutive_unchanged += 1
+        if self.consecutive_unchanged >= self.stop_after_unchanged and self.stopped_at_page is None:
+            self.stopped_at_page = page
+            logger.info(f"{self.consecutive_unchanged} consecutive unchanged pages, stopping at page {page}")
+            if self.on_early_stop:
+                self.on_early_stop()
+
+    def archive_pages(self, fetched: List[Tuple[int, Tuple[int, Any, FetchedPage]]], fetched_at: str):
+        """Appends the raw bodies of a batch of pages to the archive."""
+        for page, (_, _, response) in fetched:
+            body = response.body
+            if body is None and self.cache is not None:
+                # Unchanged pages are archived from the cached copy.
+                body = self.cache.load_body(response.url)
+            if body is None:
+                logger.warning(f"No body to archive for page {page}")
+                continue
+            self.archive.write_page(page, body, fetched_at)
+
+
+def page_data(fetched: FetchedPage, cache: Optional[ResponseCache] = None) -> Dict[str, Any]:
+    """
+    Returns the parsed response of a fetched page, reading unchanged pages
+    from the response cache.
+    """
+    body = cache.load_body(fetched.url) if fetched.unchanged else fetched.body
+    return json.loads(body)
+
+
+def merge_pages(url: str, parts: List[FetchedPage], cache: Optional[ResponseCache] = None) -> FetchedPage:
+    """
+    Combines consecutive smaller pages into one page for `url`, used when a
+    large page had to be fetched as halves.
+    """
+    datas = [page_data(part, cache) for part in parts]
+    merged = {
+        'metadata': datas[0].get('metadata', {}),
+        'products': [prod for data in datas for prod in data.get('products', [])],
+    }
+    body = json.dumps(merged).encode("utf-8")
+    return FetchedPage(url, body, body_hash=body_digest(body) if cache is not None else None)
+
+
+def page_size_candidates(base_size: int, max_size: int) -> List[int]:
+    """
+    Returns the page sizes to probe, largest first: base_size doubled up to
+    max_size, so every size splits evenly into pages of base_size.
+    """
+    sizes = [base_size]
+    while sizes[-1] * 2 <= max_size:
+        sizes.append(sizes[-1] * 2)
+    return sizes[::-1]
+
+
+def probe_page_size(fetch_first: Callable[[int, int], Optional[FetchedPage]], candidates: List[int],
+                    latency_target: float, cache: Optional[ResponseCache] = None
+                    ) -> Tuple[int, Optional[FetchedPage]]:
+    """
+    Finds the largest page size the API accepts and serves quickly.
+
+    The first page is requested at each candidate size, largest first, with
+    a single attempt. A size is accepted when the API answers within the
+    latency target with a full page (fewer products than requested means the
+    API caps the size). The smallest candidate is the fallback and is
+    requested with the usual retries.
+
+    Args:
+        fetch_first: Called with (size, attempts); fetches the first page
+        candidates: Page sizes to try, largest first
+        latency_target: Slowest acceptable response in seconds
+        cache: Response cache the fetched pages may be read from
+
+    Returns:
+        (page size, its first page), with the page None if even the
+        fallback size failed
+    """
+    for size in candidates[:-1]:
+        started = time.monotonic()
+        fetched = fetch_first(size, 1)
+        elapsed = time.monotonic() - started
+        if fetched is None:
+            logger.info(f"Page size {size} rejected: request failed")
+            continue
+        data = page_data(fetched, cache)
+        received = len(data.get('products', []))
+        expected = min(size, data.get('metadata', {}).get('docCount', size))
+        if received < expected:
+            logger.info(f"Page size {size} rejected: the API returned {received} products")
+            continue
+        if elapsed > latency_target:
+            logger.info(f"Page size {size} rejected: {elapsed:.2f}s response above the latency target")
+            continue
+        logger.info(f"Using page size {size} ({elapsed:.2f}s for the first page)")
+        return size, fetched
+    size = candidates[-1]
+    logger.info(f"Using fallback page size {size}")
+    return size, fetch_first(size, MAX_RETRIES)
+
+
+def plan_shards(field: str, values: List[str],
+                fetch_first_page: Callable[[Dict[str, str]], Optional[FetchedPage]],
+                cache: Optional[ResponseCache] = None) -> Tuple[Optional[ShardPlan], Dict[int, FetchedPage]]:
+    """
+    Fetches the first page of every shard to size it and builds the crawl plan.
+
+    Returns:
+        (plan, {run-wide page: fetched first page}), or (None, {}) if a shard
+        could not be fetched
+    """
+    counts = []
+    first_pages = []
+    for value in values:
+        fetched = fetch_first_page({field: value})
+        if not fetched:
+            return None, {}
+        metadata = page_data(fetched, cache)['metadata']
+        counts.append((value, metadata['totalPages'], metadata.get('docCount', 0)))
+        first_pages.append(fetched)
+    plan = ShardPlan.build(field, counts)
+    prefetched = {
+        shard.first_page: fetched
+        for shard, fetched in zip(plan.shards, first_pages) if shard.total_pages
+    }
+    return plan, prefetched
+
+
+def check_shard_coverage(plan: ShardPlan, catalogue_size: Optional[int]) -> bool:
+    """
+    Compares the shards' doc counts with the unfiltered doc count and logs
+    how many products no shard covers. Returns True if the totals match.
+    """
+    for shard in plan.shards:
+        logger.info(f"Shard {plan.field}={shard.name}: {shard.doc_count} products, {shard.total_pages} pages")
+    if catalogue_size is None:
+        logger.warning("The API did not report a total doc count; shard coverage not verified")
+        return False
+    if plan.doc_count < catalogue_size:
+        logger.warning(
+            f"Shards cover {plan.doc_count} of {catalogue_size} products; "
+            f"{catalogue_size - plan.doc_count} are in no configured shard (check 'shard_values')"
+        )
+        return False
+    if plan.doc_count > catalogue_size:
+        logger.warning(f"Shards report {plan.doc_count} products but the catalogue has {catalogue_size}")
+        return False
+    logger.info(f"Shards cover all {catalogue_size} products")
+    return True
+
+
+def fetch_products_from_api(resume: bool = False, db_name: str = "products.db",
+                            api_base_url: Optional[str] = None, use_cache: bool = True,
+                            mode: str = MODE_FULL, stop_after: Optional[int] = None,
+                            sharded: bool = False):
     """
     Fetches all products from the Systembolaget API and updates the SQLite database.
-    Displays a progress bar and, at the end, prints a summary of all changes.
+    Displays a progress line and, at the end, prints a summary of all changes.
+
+    Pages flow through an IngestPipeline: fetch workers (as many as the
+    'concurrency' setting in config.get_config() allows, 1 runs every stage
+    serially), a normalize/validate stage, and a single writer thread that
+    commits batches of pages in page order. The products table is loaded once
+    into a ProductSnapshot, so each page is diffed in memory and only changed
+    rows are written.
+
+    Every committed page is checkpointed in crawl_pages. With resume=True the
+    latest unfinished crawl run is continued and only its missing pages are
+    fetched; if there is none, a new crawl is started.
+
+    Page bodies are kept in an on-disk ResponseCache (the 'http_cache'
+    setting) and revalidated on the next crawl; pages the API reports as
+    unchanged are checkpointed without being parsed or written. Every raw
+    page is also appended to the run's archive under 'archive_dir', which
+    reprocess_archive() can replay offline.
+
+    A delta crawl (mode='delta') requests the newest launches first and
+    stops after `stop_after` consecutive pages without a new or changed
+    product; its pages are fetched one at a time, so no request is made past
+    the stop. It finds new products quickly but only sees price changes of
+    products launched since the last full crawl, so full crawls still run
+    on a longer schedule; mode='auto' picks between the two based on the
+    'full_crawl_interval_hours' setting.
+
+    Args:
+        resume: Continue the latest unfinished full crawl run
+        db_name: Database to update
+        api_base_url: Product search endpoint (defaults to get_config()['api_base_url'])
+        use_cache: Revalidate pages against the response cache
+        mode: 'full', 'delta' or 'auto'
+        stop_after: Consecutive unchanged pages before a delta crawl stops
+            (defaults to get_config()['delta_stop_pages'])
+        sharded: Split a full crawl into shards by the 'shard_field' filter,
+            one per value in 'shard_values', crawled in parallel (see shards.py)
+
+    Returns:
+        The run summary from the progress tracker, or None if the crawl failed
     """
-    db_name = "products.db"
+    config = get_config()
+    if mode not in CRAWL_MODES:
+        raise ValueError(f"Unknown crawl mode: {mode}")
+    base_url = api_base_url or config['api_base_url']
+    url_for = None
+    base_size = config['page_size']
+    page_size = base_size
+    concurrency = config['concurrency']
+    # The worker pool is sized for the ceiling; the controller decides how
+    # many of those workers may have a request in flight at any time.
+    max_concurrency = max(concurrency, config['max_concurrency']) if concurrency > 1 else 1
+    controller = RateController(
+        initial_concurrency=concurrency,
+        max_concurrency=max_concurrency,
+        base_delay=config['retry_delay'],
+        max_delay=config['max_retry_delay'],
+        latency_target=config['latency_target'],
+        failure_threshold=config['circuit_failure_threshold'],
+        cooldown=config['circuit_cooldown'],
+    )
     initialize_database(db_name)
-    processed_products = 0
-    failed_requests = 0
 
-    # Get the initial count from the database.
-    total_in_db = get_product_count(db_name)
+    conn = get_database_connection(db_name)
+    # Seed the snapshot and the in-memory counters once; the ingest loop
+    # never reads products back or counts rows again.
+    snapshot = ProductSnapshot.load(conn)
+    total_in_db = len(snapshot)
+    tracker = None
+    run_id = None
+    plan = None
+    catalogue_size = None
+    shards_cover_catalogue = None
+    cache = None
+    if use_cache and config['http_cache']:
+        cache = ResponseCache(config['http_cache'], config['http_cache_max_mb'] * 1024 * 1024)
     
     try:
         with Session() as session:
-            headers = {"Ocp-Apim-Subscription-Key": api_key}
-            
-            # Get first page to determine total pages
-            first_page_data = make_api_request(session, f"{api_url}?page=1&size=30&sortBy=Score&sortDirection=Ascending", headers)
-            if not first_page_data:
-                logger.error("Failed to fetch first page from API")
-                return
-                
-            total_pages = first_page_data['metadata']['totalPages']
-            logger.info(f"Total pages to process: {total_pages}")
+            headers = {"Ocp-Apim-Subscription-Key": config['api_key']}
+            if max_concurrency > 1:
+                # Let every worker keep its own pooled connection to the API host.
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+            prefetched = {}
 
-            # If the database was empty, estimate total count from the API.
-            if total_in_db == 0:
-                total_in_db = 30 * total_pages
+            def fetch_sized(page: int, size: int, filters: Optional[Dict[str, str]]) -> Optional[FetchedPage]:
+                # A page that keeps failing is fetched again as two half-size pages.
+                url = url_for(page, size=size, filters=filters)
+                fetched = fetch_page(session, url, headers, controller, cache)
+                if fetched is not None or size // 2 < base_size:
+                    return fetched
+                logger.warning(f"Page {page} of size {size} failed, fetching it as two pages of {size // 2}")
+                parts = [fetch_sized(2 * page - 1, size // 2, filters), fetch_sized(2 * page, size // 2, filters)]
+                if None in parts:
+                    return None
+                return merge_pages(url, parts, cache)
 
-            # Process first page.
-            conn = sqlite3.connect(db_name)
-            try:
-                for prod in first_page_data["products"]:
-                    insert_or_update_product(conn, prod)
-                    processed_products += 1
-                    current_total = get_product_count(db_name)
-                    print_progress_bar(processed_products, current_total)
-            except Exception as e:
-                logger.error(f"Error processing first page: {e}")
-            finally:
-                conn.close()
-
-            # Process remaining pages.
-            for page in range(2, total_pages + 1):
-                page_data = make_api_request(session, f"{api_url}?page={page}&size=30&sortBy=Score&sortDirection=Ascending", headers)
-                if not page_data:
-                    failed_requests += 1
-                    logger.warning(f"Failed to fetch page {page}")
-                    continue
-                    
-                products_on_page = page_data.get("products", [])
-                conn = sqlite3.connect(db_name)
-                try:
-                    for prod in products_on_page:
-                        insert_or_update_product(conn, prod)
-                        processed_products += 1
-                        current_total = get_product_count(db_name)
-                        print_progress_bar(processed_products, current_total)
-                except Exception as e:
-                    logger.error(f"Error processing page {page}: {e}")
-                finally:
-                    conn.close()
+            def fetch(page: int) -> Optional[FetchedPage]:
+                if plan is not None:
+                    plan.record_fetch(page)
+                if page in prefetched:
+                    return prefetched.pop(page)
+                if plan is None:
+                    return fetch_sized(page, page_size, None)
+                shard, shard_page = plan.locate(page)
+                return fetch_sized(shard_page, page_size, {plan.field: shard.name})
+
+            resumable = get_resumable_run(conn) if resume else None
+            if resumable:
+                run_id, total_pages, page_size = resumable
+                mode = MODE_FULL
+                url_for = partial(build_page_url, base_url=base_url)
+                committed = get_committed_pages(conn, run_id)
+                pages = [page for page in range(1, total_pages + 1) if page not in committed]
+                plan = ShardPlan.load(conn, run_id)
+                if plan is not None:
+                    pages = plan.interleave(pages)
+                logger.info(
+                    f"Resuming crawl run {run_id}: {len(pages)} of {total_pages} pages missing "
+                    f"(page size: {page_size}, concurrency: {concurrency})"
+                )
+            else:
+                if resume:
+                    logger.info("No unfinished crawl run to resume, starting a new crawl")
+                mode = resolve_crawl_mode(conn, mode, config['full_crawl_interval_hours'])
+                sort_by, sort_direction = MODE_SORT[mode]
+                url_for = partial(build_page_url, base_url=base_url, sort_by=sort_by,
+                                  sort_direction=sort_direction)
+
+                # Get first page to determine total pages; full crawls also
+                # probe for the largest page size the API serves quickly.
+                if mode == MODE_FULL:
+                    page_size, first_page = probe_page_size(
+                        lambda size, attempts: fetch_page(session, url_for(1, size=size), headers,
+                                                          controller, cache, attempts),
+                        page_size_candidates(base_size, config['max_page_size']),
+                        config['latency_target'], cache,
+                    )
+                else:
+                    # Delta crawls stay on small pages so they can stop early.
+                    first_page = fetch_page(session, url_for(1, size=page_size), headers, controller, cache)
+                if not first_page:
+                    logger.error("Failed to fetch first page from API")
+                    return
+                first_page_data = page_data(first_page, cache)
+                catalogue_size = first_page_data['metadata'].get('docCount')
+
+                if sharded and mode == MODE_FULL:
+                    plan, shard_pages = plan_shards(
+                        config['shard_field'], config['shard_values'],
+                        lambda filters: fetch_page(session, url_for(1, filters=filters, size=page_size),
+                                                   headers, controller, cache),
+                        cache,
+                    )
+                    if plan is None:
+                        logger.error("Failed to fetch the first page of every shard")
+                        return
+                    shards_cover_catalogue = check_shard_coverage(plan, catalogue_size)
+                    total_pages = plan.total_pages
+                    prefetched.update(shard_pages)
+                else:
+                    if sharded:
+                        logger.info("Sharding only applies to full crawls, crawling unsharded")
+                    total_pages = first_page_data['metadata']['totalPages']
+                    prefetched[1] = first_page
+                logger.info(
+                    f"Total pages to process: {total_pages} ({mode} crawl, page size: {page_size}, "
+                    f"concurrency: {1 if mode == MODE_DELTA else concurrency})"
+                )
+                run_id = start_crawl_run(conn, total_pages, mode, page_size)
+                if plan is not None:
+                    plan.save(conn, run_id)
+                    pages = plan.interleave(list(range(1, total_pages + 1)))
+                else:
+                    pages = range(1, total_pages + 1)
+
+            tracker = ProgressTracker(len(pages), total_in_db, config['progress_interval_ms'])
+            archive = CrawlArchive(config['archive_dir'], run_id) if config['archive_dir'] else None
+            delta = mode == MODE_DELTA
+            ingest = PageIngest(db_name, snapshot, tracker, run_id, cache, archive,
+                                stop_after_unchanged=(stop_after or config['delta_stop_pages']) if delta else None,
+                                committed_pages=load_committed_pages(conn) if cache is not None else None)
+            # Delta crawls run every stage inline, one page at a time, so the
+            # early stop is seen before the next page is requested.
+            pipeline = IngestPipeline(
+                fetch, ingest.normalize, ingest.write,
+                workers=1 if delta else max_concurrency,
+                queue_size=config['pipeline_queue_size'],
+                batch_size=config['writer_batch_pages'],
+                on_start_writer=ingest.open,
+                on_stop_writer=ingest.close,
+            )
+            ingest.on_early_stop = pipeline.stop
+            if plan is not None:
+                ingest.on_page_written = plan.record_written
+            pipeline.run(pages)
+
+            summary = tracker.summary()
+            status = RUN_INCOMPLETE if summary['failed_pages'] else RUN_COMPLETE
+            finish_crawl_run(conn, run_id, status, controller.stats()['requests'])
+            products_seen = record_products_seen(conn, run_id)
+            # Only a complete full crawl known to cover the whole catalogue can
+            # tell that a product is gone; shard coverage is only verified when
+            # the sharded run starts.
+            delisted = None
+            if status == RUN_COMPLETE and mode == MODE_FULL and (plan is None or shards_cover_catalogue):
+                delisted = mark_delisted(conn, run_id)
+            if archive is not None:
+                archive_run_record(conn, archive, run_id)
 
     except Exception as e:
         logger.error(f"Critical error during API processing: {e}")
         return
+    finally:
+        conn.close()
+        if cache is not None:
+            cache_stats = cache.stats()
+            cache.close()
 
-    # Finish progress bar line.
+    # Finish progress line.
+    tracker.draw(force=True)
     print("\n\nProduct data fetched/updated in SQLite database.")
 
     # Print a summary of all changes.
@@ -556,11 +1697,185 @@ def fetch_products_from_api():
             print(change)
     else:
         print("No changes made.")
-        
-    if failed_requests > 0:
-        logger.warning(f"Failed to fetch {failed_requests} pages out of {total_pages}")
+
+    summary['run_id'] = run_id
+    summary['mode'] = mode
+    summary['products_seen'] = products_seen
+    summary['delisted'] = delisted
+    summary['page_size'] = page_size
+    summary['duplicates'] = ingest.duplicates
+    summary['shards'] = plan.report() if plan is not None else None
+    summary['shards_cover_catalogue'] = shards_cover_catalogue
+    summary['stopped_at_page'] = ingest.stopped_at_page
+    summary['classification'] = dict(snapshot.counts)
+    summary['invalid_products'] = ingest.invalid_products
+    summary['api'] = controller.stats()
+    summary['pipeline'] = pipeline.stats()
+    summary['unchanged_pages'] = ingest.unchanged_pages
+    summary['cache'] = cache_stats if cache is not None else None
+    if summary['failed_pages'] > 0 and mode == MODE_FULL:
+        logger.warning(
+            f"Failed to fetch {summary['failed_pages']} pages out of {tracker.total_pages}; "
+            f"continue with 'python cli.py update --resume'"
+        )
+    elif summary['failed_pages'] > 0:
+        logger.warning(f"Failed to fetch {summary['failed_pages']} pages; the next update will cover them")
+    if plan is not None:
+        for shard in summary['shards']:
+            elapsed = f"{shard['elapsed']:.1f}s" if shard['elapsed'] is not None else "n/a"
+            logger.info(
+                f"Shard {plan.field}={shard['shard']}: {shard['pages']}/{shard['total_pages']} pages, "
+                f"{shard['products']}/{shard['doc_count']} products in {elapsed}"
+            )
+            if shard['pages'] == shard['total_pages'] and shard['products'] != shard['doc_count']:
+                logger.warning(
+                    f"Shard {shard['shard']} returned {shard['products']} products but reported "
+                    f"{shard['doc_count']}; the catalogue changed during the crawl"
+                )
+        logger.info(f"{ingest.duplicates} duplicate products across shards were merged by productId")
+    if delisted is not None:
+        logger.info(f"Seen {products_seen} products in run {run_id}; {delisted} newly delisted")
+    if ingest.stopped_at_page is not None:
+        logger.info(f"Delta crawl stopped early at page {ingest.stopped_at_page} of {tracker.total_pages}")
     
-    logger.info(f"Processing completed. Processed {processed_products} products.")
+    logger.info(
+        f"Processing completed. Processed {summary['products_processed']} products "
+        f"in {summary['elapsed']:.1f}s ({summary['products_per_sec']:.1f} products/s, "
+        f"{summary['pages_per_sec']:.2f} pages/s)."
+    )
+    logger.info(
+        "Classification: " + ", ".join(f"{name}={count}" for name, count in snapshot.counts.items())
+    )
+    logger.info(
+        "API: " + ", ".join(f"{name}={value}" for name, value in summary['api'].items())
+    )
+    for name, stage in summary['pipeline']['stages'].items():
+        logger.info(
+            f"Stage {name}: {stage['items']} items, {stage['busy_time']:.2f}s busy "
+            f"({stage['utilization']:.0%} of {stage['workers']} worker(s)), "
+            f"output queue avg {stage['queue_avg']:.1f} / max {stage['queue_max']}"
+        )
+    logger.info(f"Pipeline bottleneck: {summary['pipeline']['bottleneck']}")
+    if summary['cache']:
+        logger.info(
+            f"Response cache: hit ratio {summary['cache']['hit_ratio']:.0%} "
+            f"({summary['cache']['not_modified']} not modified, {summary['cache']['identical']} identical, "
+            f"{summary['cache']['misses']} changed), {summary['cache']['bytes_saved'] / 1024:.0f} KiB not downloaded, "
+            f"{summary['cache']['bytes_unchanged'] / 1024:.0f} KiB not reprocessed, "
+            f"{summary['cache']['entries']} entries / {summary['cache']['size_bytes'] / 1024:.0f} KiB on disk"
+        )
+    return summary
+
+
+def reprocess_archive(run_ids: Optional[List[int]] = None, db_name: str = "products.db",
+                      rebuild: bool = False, archive_dir: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Replays archived crawl runs into the database without network access.
+
+    Each run's pages go through the same normalize and bulk upsert path as a
+    crawl, in page order, with changes recorded at the time the page was
+    fetched. Products are stamped as seen in the replayed run, and runs that
+    marked products as delisted do so again. Runs missing from the database
+    are recreated from the run record their archive ends with. With
+    rebuild=True the products and price_history tables are emptied first,
+    so replaying every archived run in order rebuilds them.
+
+    Args:
+        run_ids: Runs to replay in order (defaults to every archived run)
+        db_name: Database to update
+        rebuild: Empty products and price_history before replaying
+        archive_dir: Archive directory (defaults to get_config()['archive_dir'])
+
+    Returns:
+        Dict with runs, pages, products_processed, inserted, updated,
+        metadata_updated and elapsed, or None if there was nothing to replay
+    """
+    config = get_config()
+    archive_dir = archive_dir or config['archive_dir']
+    if not run_ids:
+        run_ids = list_archived_runs(archive_dir)
+    paths = {run_id: find_archive(archive_dir, run_id) for run_id in run_ids}
+    missing = [run_id for run_id, path in paths.items() if path is None]
+    if missing or not run_ids:
+        logger.error(f"No archive found for run(s) {missing or run_ids} in {archive_dir}")
+        return None
+
+    initialize_database(db_name)
+    conn = get_database_connection(db_name)
+    try:
+        with conn:
+            if rebuild:
+                conn.execute("DELETE FROM price_history")
+                conn.execute("DELETE FROM products")
+                db.bump_data_generation(conn)
+            # Replayed pages overwrite whatever the cached pages were committed as.
+            forget_committed_pages(conn)
+        if rebuild:
+            logger.info("Emptied products and price_history for rebuild")
+        snapshot = ProductSnapshot.load(conn)
+    finally:
+        conn.close()
+
+    started = time.perf_counter()
+    snapshot.reset_counts()
+    totals = {'runs': 0, 'pages': 0, 'products_processed': 0}
+    batch_pages = config['writer_batch_pages']
+    for run_id in run_ids:
+        pages = load_run_pages(paths[run_id])
+        tracker = ProgressTracker(len(pages), len(snapshot), config['progress_interval_ms'])
+        ingest = PageIngest(db_name, snapshot, tracker)
+        ingest.seen_run = run_id
+        ingest.open()
+        try:
+            ordered = sorted(pages.items())
+            # Pages written together share a timestamp; replay them together as well.
+            batches = []
+            for page, (fetched_at, data) in ordered:
+                if not batches or batches[-1][0] != fetched_at or len(batches[-1][1]) >= batch_pages:
+                    batches.append((fetched_at, []))
+                batches[-1][1].append((page, data))
+            for fetched_at, batch_data in batches:
+                ingest.timestamp = fetched_at
+                batch = [(page, ingest.normalize_data(page, data) + (None,)) for page, data in batch_data]
+                ingest.write(batch)
+                # Replays can touch every product; the per-change records are not kept.
+                changes_log.clear()
+        finally:
+            ingest.close()
+        conn = get_database_connection(db_name)
+        try:
+            row = conn.execute("SELECT delisted FROM crawl_runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                # A new database: recreate the run from the record its archive ends with.
+                run = load_run_info(paths[run_id])
+                if run is not None:
+                    restore_run_record(conn, run)
+                    row = (run.get('delisted'),)
+                else:
+                    logger.warning(f"Run {run_id} is not in {db_name} and its archive has no run record; "
+                                   f"products it delisted were not marked as delisted")
+            if row is not None:
+                record_products_seen(conn, run_id)
+                if row[0] is not None and pages:
+                    mark_delisted(conn, run_id, max(fetched_at for fetched_at, _ in pages.values()))
+            with conn:
+                db.bump_data_generation(conn)
+        finally:
+            conn.close()
+        summary = tracker.summary()
+        totals['runs'] += 1
+        totals['pages'] += summary['pages_done']
+        totals['products_processed'] += summary['products_processed']
+        if summary['failed_pages']:
+            logger.error(f"Failed to replay {summary['failed_pages']} pages of run {run_id}")
+        logger.info(f"Replayed run {run_id}: {summary['pages_done']} pages, "
+                    f"{summary['products_processed']} products")
+
+    totals['inserted'] = snapshot.counts[NEW]
+    totals['updated'] = snapshot.counts[PRICE_CHANGED]
+    totals['metadata_updated'] = snapshot.counts[METADATA_CHANGED]
+    totals['elapsed'] = time.perf_counter() - started
+    return totals
 
 
 if __name__ == "__main__":
@@ -0,0 +1,774 @@
+"""
+Versioned schema migrations keyed on `PRAGMA user_version`.
+
+Each migration has a version number and runs at most once per database. A
+database whose user_version equals the latest version needs no DDL at all, so
+initializing it costs one PRAGMA read. Plain migrations run in a single
+transaction together with the user_version bump. Batched migrations (backfills,
+rewrites of large tables) commit one batch at a time and record their position
+in `schema_migrations`, so an interrupted run continues where it stopped.
+"""
+import logging
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    """A schema change applied in one transaction."""
+    version: int
+    name: str
+    apply: Callable[[sqlite3.Connection], None]
+
+
+class BatchedMigration(NamedTuple):
+    """
+    A long-running change applied in resumable batches.
+
+    `step(conn, position, batch_size)` processes one batch after `position`
+    (None for the first batch) and returns the position to continue from, or
+    None once there is nothing left.
+    """
+    version: int
+    name: str
+    step: Callable[[sqlite3.Connection, Optional[str], int], Optional[str]]
+
+
+def column_names(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> bool:
+    """
+    Adds a column unless it already exists, which databases created before
+    versioned migrations may already have. Returns True if it was added.
+    """
+    if column in column_names(conn, table):
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return True
+
+
+def _new_database_settings(conn: sqlite3.Connection):
+    """
+    Part of migration 1 that has to run outside its transaction: a database
+    without tables yet is switched to auto_vacuum=INCREMENTAL, so compaction
+    never needs a full VACUUM for it. Once the file has a header (e.g. after
+    switching to WAL) the mode only changes with VACUUM, which costs nothing
+    while the database is empty.
+    """
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+def _base_schema(conn: sqlite3.Connection):
+    """
+    Creates the products, price_history and crawl checkpoint tables. Databases
+    created by older versions get the columns and indexes they are missing.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            productId TEXT PRIMARY KEY,
+
+            -- Basic product info
+            productNumber TEXT,
+            productNumberShort TEXT,
+            productNameBold TEXT,
+            productNameThin TEXT,
+            producerName TEXT,
+            supplierName TEXT,
+            categoryLevel1 TEXT,
+            categoryLevel2 TEXT,
+            categoryLevel3 TEXT,
+            country TEXT,
+            productLaunchDate TEXT,
+
+            -- Availability
+            isTemporaryOutOfStock BOOLEAN,
+            isCompletelyOutOfStock BOOLEAN,
+
+            -- Current price
+            price REAL,
+            lastUpdated TEXT,
+            price_change_percentage REAL,
+
+            -- Alcohol & Volume
+            volume REAL,
+            alcoholPercentage REAL,
+
+            -- APK (ml ethanol per krona)
+            apk REAL,
+
+            -- Baseline (first recorded) price for price_change_percentage
+            first_price REAL,
+            first_price_timestamp TEXT,
+
+            -- Catalogue presence
+            last_seen_run INTEGER,
+            delisted INTEGER NOT NULL DEFAULT 0,
+            delisted_at TEXT
+        )
+        """
+    )
+    add_column(conn, "products", "price_change_percentage", "REAL DEFAULT 0.0")
+    add_column(conn, "products", "first_price", "REAL")
+    add_column(conn, "products", "first_price_timestamp", "TEXT")
+    add_column(conn, "products", "last_seen_run", "INTEGER")
+    add_column(conn, "products", "delisted", "INTEGER NOT NULL DEFAULT 0")
+    add_column(conn, "products", "delisted_at", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_apk ON products(apk)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_price ON products(price)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_category ON products(categoryLevel1, categoryLevel2)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_country ON products(country)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_last_seen_run ON products(last_seen_run)")
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS price_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            productId TEXT,
+            price REAL,
+            timestamp TEXT,
+            FOREIGN KEY (productId) REFERENCES products(productId)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_price_history_product ON price_history(productId)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_price_history_timestamp ON price_history(timestamp)")
+
+    # Crawl checkpoint tables so an interrupted crawl can be resumed
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS crawl_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT,
+            finished_at TEXT,
+            total_pages INTEGER,
+            status TEXT,
+            mode TEXT DEFAULT 'full',
+            page_size INTEGER,
+            request_count INTEGER,
+            products_seen INTEGER,
+            delisted INTEGER
+        )
+        """
+    )
+    # Runs recorded before crawl modes existed were full crawls
+    add_column(conn, "crawl_runs", "mode", "TEXT DEFAULT 'full'")
+    add_column(conn, "crawl_runs", "page_size", "INTEGER")
+    add_column(conn, "crawl_runs", "request_count", "INTEGER")
+    add_column(conn, "crawl_runs", "products_seen", "INTEGER")
+    add_column(conn, "crawl_runs", "delisted", "INTEGER")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS crawl_shards (
+            run_id INTEGER,
+            field TEXT,
+            shard TEXT,
+            first_page INTEGER,
+            total_pages INTEGER,
+            doc_count INTEGER,
+            PRIMARY KEY (run_id, shard),
+            FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS crawl_pages (
+            run_id INTEGER,
+            page INTEGER,
+            product_count INTEGER,
+            committed_at TEXT,
+            PRIMARY KEY (run_id, page),
+            FOREIGN KEY (run_id) REFERENCES crawl_runs(run_id)
+        )
+        """
+    )
+
+
+def _backfill_first_price(conn: sqlite3.Connection, position: Optional[str], batch_size: int) -> Optional[str]:
+    """
+    Fills the first-price baseline of products that lack one from their
+    earliest price_history row, walking products in productId order.
+    """
+    ids = [row[0] for row in conn.execute(
+        """
+        SELECT productId FROM products
+        WHERE productId > ? AND first_price IS NULL
+        ORDER BY productId LIMIT ?
+        """,
+        (position or "", batch_size)
+    )]
+    if not ids:
+        return None
+    conn.executemany(
+        """
+        UPDATE products
+        SET
+            first_price = (
+                SELECT h.price FROM price_history h
+                WHERE h.productId = products.productId
+                ORDER BY h.timestamp ASC
+                LIMIT 1
+            ),
+            first_price_timestamp = (
+                SELECT MIN(h.timestamp) FROM price_history h
+                WHERE h.productId = products.productId
+            )
+        WHERE productId = ?
+        """,
+        [(product_id,) for product_id in ids]
+    )
+    return ids[-1]
+
+
+def _cluster_price_history(conn: sqlite3.Connection, position: Optional[str], batch_size: int) -> Optional[str]:
+    """
+    Copies price_history into a WITHOUT ROWID table clustered on
+    (productId, ts), with integer epoch seconds and integer öre prices, in
+    order of the old AUTOINCREMENT id. Rows of one product with the same
+    second collapse to the last one. The last batch logs how many rows were
+    merged that way or dropped for lacking a product or a valid timestamp,
+    and swaps the tables.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS price_history_clustered (
+            productId TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            price_ore INTEGER,
+            PRIMARY KEY (productId, ts),
+            FOREIGN KEY (productId) REFERENCES products(productId)
+        ) WITHOUT ROWID
+        """
+    )
+    last_id = int(position or 0)
+    row = conn.execute(
+        "SELECT MAX(id) FROM (SELECT id FROM price_history WHERE id > ? ORDER BY id LIMIT ?)",
+        (last_id, batch_size)
+    ).fetchone()
+    if row[0] is None:
+        total, invalid = conn.execute(
+            "SELECT COUNT(*), SUM(productId IS NULL OR strftime('%s', timestamp) IS NULL) FROM price_history"
+        ).fetchone()
+        copied = conn.execute("SELECT COUNT(*) FROM price_history_clustered").fetchone()[0]
+        invalid = invalid or 0
+        merged = total - invalid - copied
+        if merged or invalid:
+            logger.warning(
+                f"Clustered price_history: merged {merged} legacy rows into another row of the same "
+                f"product and second, dropped {invalid} rows without a product or valid timestamp"
+            )
+        conn.execute("DROP TABLE price_history")
+        conn.execute("ALTER TABLE price_history_clustered RENAME TO price_history")
+        return None
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO price_history_clustered (productId, ts, price_ore)
+        SELECT productId, CAST(strftime('%s', timestamp) AS INTEGER), CAST(ROUND(price * 100) AS INTEGER)
+        FROM price_history
+        WHERE id > ? AND id <= ? AND productId IS NOT NULL AND strftime('%s', timestamp) IS NOT NULL
+        ORDER BY id
+        """,
+        (last_id, row[0])
+    )
+    return str(row[0])
+
+
+def _read_indexes(conn: sqlite3.Connection):
+    """
+    Composite indexes for the read queries in utils.py and deploy.py. Each
+    leads with `delisted`, which every listing and statistics query filters
+    on; the trailing columns let the aggregates run from the index alone and
+    serve ORDER BY apk without a sort. They replace idx_apk and idx_category.
+    """
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_listed_apk ON products(delisted, apk)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_listed_category "
+        "ON products(delisted, categoryLevel1, apk, price)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_listed_price_change "
+        "ON products(delisted, price_change_percentage, price, apk)"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_apk")
+    conn.execute("DROP INDEX IF EXISTS idx_category")
+    conn.execute("ANALYZE products")
+
+
+# Product text columns indexed for search, in bm25 weight order.
+SEARCH_COLUMNS = ["productNameBold", "productNameThin", "producerName", "supplierName"]
+
+# Name columns indexed for typo-tolerant (trigram) search.
+TRIGRAM_COLUMNS = ["productNameBold", "productNameThin", "producerName"]
+
+# External-content FTS5 indexes over products, rebuilt by rebuild_search_index.
+SEARCH_INDEXES = ["products_fts", "products_trigram"]
+
+
+def _external_content_index(conn: sqlite3.Connection, table: str, columns: List[str], options: str) -> bool:
+    """
+    Creates an FTS5 index over products columns with triggers that keep it in
+    sync, and fills it. The update trigger only fires when an indexed column
+    changes value. Returns False (and logs) if this SQLite cannot create it.
+    """
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    try:
+        conn.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+                {names},
+                content='products', content_rowid='rowid',
+                {options}
+            )
+            """
+        )
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Cannot create {table} ({e}); search falls back to scanning products")
+        return False
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON products BEGIN
+            INSERT INTO {table} (rowid, {names}) VALUES (new.rowid, {new_values});
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON products BEGIN
+            INSERT INTO {table} ({table}, rowid, {names}) VALUES ('delete', old.rowid, {old_values});
+        END
+        """
+    )
+    _index_update_trigger(conn, table, columns)
+    conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+    return True
+
+
+def _index_update_trigger(conn: sqlite3.Connection, table: str, columns: List[str]):
+    """
+    Creates the trigger that re-indexes a product in `table` when one of its
+    indexed columns changes value; upserts that rewrite the same text leave
+    the index alone.
+    """
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    changed = " OR ".join(f"old.{column} IS NOT new.{column}" for column in columns)
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF {names} ON products
+        WHEN {changed} BEGIN
+            INSERT INTO {table} ({table}, rowid, {names}) VALUES ('delete', old.rowid, {old_values});
+            INSERT INTO {table} (rowid, {names}) VALUES (new.rowid, {new_values});
+        END
+        """
+    )
+
+
+def _search_index(conn: sqlite3.Connection):
+    """
+    Creates products_fts, a full-text index over the product text columns
+    that folds diacritics (å/ä/ö match a/a/o) and keeps prefix indexes for
+    short prefixes. SQLite builds without FTS5 skip it; search then falls
+    back to LIKE.
+    """
+    _external_content_index(
+        conn, "products_fts", SEARCH_COLUMNS,
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3'",
+    )
+
+
+def _trigram_index(conn: sqlite3.Connection):
+    """
+    Creates products_trigram, a trigram index over the product and producer
+    names used to find candidates for fuzzy search (SQLite 3.34+), and its
+    vocabulary table. Without them, fuzzy search uses plain search.
+    """
+    if _external_content_index(conn, "products_trigram", TRIGRAM_COLUMNS, "tokenize='trigram'"):
+        # Per-trigram document counts, so fuzzy search can skip common trigrams.
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_trigram_vocab USING fts5vocab(products_trigram, 'row')"
+        )
+
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    """Returns True if `table` exists in this database."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def has_search_index(conn: sqlite3.Connection, table: str = "products_fts") -> bool:
+    """Returns True if the FTS5 index `table` exists in this database."""
+    return table_exists(conn, table)
+
+
+def rebuild_search_index(conn: sqlite3.Connection):
+    """
+    Rebuilds the FTS5 indexes from the products table. Needed after a full
+    VACUUM, which may renumber the rowids the external-content indexes refer to.
+    """
+    for table in SEARCH_INDEXES:
+        if has_search_index(conn, table):
+            with conn:
+                conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+
+# Products columns the materialized statistics depend on.
+STATS_COLUMNS = ["price", "apk", "price_change_percentage", "categoryLevel1", "delisted"]
+
+
+def _stats_delta(row: str, sign: str) -> str:
+    """
+    Trigger statements that add (sign '+') or remove (sign '-') the
+    contribution of `row` ('new' or 'old') to product_stats and category_stats.
+    Listed products count towards the totals and their category; delisted
+    ones only towards the delisted counter.
+    """
+    listed = f"{row}.delisted = 0"
+    totals = f"""
+        UPDATE product_stats SET
+            listed = listed {sign} IIF({listed}, 1, 0),
+            delisted = delisted {sign} IIF({listed}, 0, 1),
+            price_count = price_count {sign} IIF({listed} AND {row}.price IS NOT NULL, 1, 0),
+            price_sum = price_sum {sign} IIF({listed}, COALESCE({row}.price, 0), 0),
+            apk_count = apk_count {sign} IIF({listed} AND {row}.apk IS NOT NULL, 1, 0),
+            apk_sum = apk_sum {sign} IIF({listed}, COALESCE({row}.apk, 0), 0),
+            increases = increases {sign} IIF({listed} AND {row}.price_change_percentage > 0, 1, 0),
+            decreases = decreases {sign} IIF({listed} AND {row}.price_change_percentage < 0, 1, 0),
+            stable = stable {sign} IIF({listed} AND {row}.price_change_percentage = 0, 1, 0)
+        WHERE id = 1;
+    """
+    if sign == "+":
+        category = f"""
+            INSERT INTO category_stats (category, products, price_count, price_sum, apk_count, apk_sum)
+            SELECT {row}.categoryLevel1, 1, {row}.price IS NOT NULL, COALESCE({row}.price, 0),
+                   {row}.apk IS NOT NULL, COALESCE({row}.apk, 0)
+            WHERE {listed} AND {row}.categoryLevel1 IS NOT NULL
+            ON CONFLICT(category) DO UPDATE SET
+                products = products + excluded.products,
+                price_count = price_count + excluded.price_count,
+                price_sum = price_sum + excluded.price_sum,
+                apk_count = apk_count + excluded.apk_count,
+                apk_sum = apk_sum + excluded.apk_sum;
+        """
+    else:
+        category = f"""
+            UPDATE category_stats SET
+                products = products - 1,
+                price_count = price_count - ({row}.price IS NOT NULL),
+                price_sum = price_sum - COALESCE({row}.price, 0),
+                apk_count = apk_count - ({row}.apk IS NOT NULL),
+                apk_sum = apk_sum - COALESCE({row}.apk, 0)
+            WHERE category = {row}.categoryLevel1 AND {listed};
+            DELETE FROM category_stats WHERE category = {row}.categoryLevel1 AND products = 0;
+        """
+    return totals + category
+
+
+def _fill_product_stats(conn: sqlite3.Connection):
+    """Refills product_stats and category_stats from a full pass over products."""
+    conn.execute("DELETE FROM product_stats")
+    conn.execute("DELETE FROM category_stats")
+    conn.execute(
+        """
+        INSERT INTO product_stats (
+            id, listed, delisted, price_count, price_sum, apk_count, apk_sum,
+            increases, decreases, stable
+        )
+        SELECT
+            1,
+            COUNT(CASE WHEN delisted = 0 THEN 1 END),
+            COUNT(CASE WHEN delisted != 0 THEN 1 END),
+            COUNT(CASE WHEN delisted = 0 THEN price END),
+            COALESCE(SUM(CASE WHEN delisted = 0 THEN price END), 0),
+            COUNT(CASE WHEN delisted = 0 THEN apk END),
+            COALESCE(SUM(CASE WHEN delisted = 0 THEN apk END), 0),
+            COUNT(CASE WHEN delisted = 0 AND price_change_percentage > 0 THEN 1 END),
+            COUNT(CASE WHEN delisted = 0 AND price_change_percentage < 0 THEN 1 END),
+            COUNT(CASE WHEN delisted = 0 AND price_change_percentage = 0 THEN 1 END)
+        FROM products
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO category_stats (category, products, price_count, price_sum, apk_count, apk_sum)
+        SELECT categoryLevel1, COUNT(*), COUNT(price), COALESCE(SUM(price), 0),
+               COUNT(apk), COALESCE(SUM(apk), 0)
+        FROM products
+        WHERE delisted = 0 AND categoryLevel1 IS NOT NULL
+        GROUP BY categoryLevel1
+        """
+    )
+
+
+def recompute_product_stats(conn: sqlite3.Connection):
+    """Rebuilds the materialized statistics in one transaction (see _product_stats)."""
+    with conn:
+        _fill_product_stats(conn)
+
+
+def _product_stats(conn: sqlite3.Connection):
+    """
+    Materialized statistics for `cli.py stats` and the site: product_stats
+    holds counters and sums for the whole catalogue, category_stats the same
+    per category. Triggers on products apply every insert, delete and change
+    of a statistics column as a delta, so every write path (crawls, batch
+    inserts, delisting, reprocess) keeps them current. The (delisted, price)
+    index answers the min and max price; the best-value list already comes
+    from idx_products_listed_apk.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS product_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            listed INTEGER NOT NULL DEFAULT 0,
+            delisted INTEGER NOT NULL DEFAULT 0,
+            price_count INTEGER NOT NULL DEFAULT 0,
+            price_sum REAL NOT NULL DEFAULT 0,
+            apk_count INTEGER NOT NULL DEFAULT 0,
+            apk_sum REAL NOT NULL DEFAULT 0,
+            increases INTEGER NOT NULL DEFAULT 0,
+            decreases INTEGER NOT NULL DEFAULT 0,
+            stable INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS category_stats (
+            category TEXT PRIMARY KEY,
+            products INTEGER NOT NULL DEFAULT 0,
+            price_count INTEGER NOT NULL DEFAULT 0,
+            price_sum REAL NOT NULL DEFAULT 0,
+            apk_count INTEGER NOT NULL DEFAULT 0,
+            apk_sum REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_listed_price ON products(delisted, price)"
+    )
+    changed = " OR ".join(f"old.{column} IS NOT new.{column}" for column in STATS_COLUMNS)
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS product_stats_insert AFTER INSERT ON products BEGIN
+            {_stats_delta("new", "+")}
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS product_stats_delete AFTER DELETE ON products BEGIN
+            {_stats_delta("old", "-")}
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS product_stats_update AFTER UPDATE OF {", ".join(STATS_COLUMNS)} ON products
+        WHEN {changed} BEGIN
+            {_stats_delta("old", "-")}
+            {_stats_delta("new", "+")}
+        END
+        """
+    )
+    _fill_product_stats(conn)
+
+
+def _data_generation(conn: sqlite3.Connection):
+    """
+    Key/value `meta` table holding the data generation counter that writers
+    bump when they commit (see db.data_generation).
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID")
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_generation', 0)")
+
+
+def _guarded_index_updates(conn: sqlite3.Connection):
+    """
+    Recreates the search index update triggers of migrations 5 and 6 with a
+    WHEN guard, so rewriting unchanged names no longer re-indexes products.
+    """
+    for table, columns in (("products_fts", SEARCH_COLUMNS), ("products_trigram", TRIGRAM_COLUMNS)):
+        if has_search_index(conn, table):
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_update")
+            _index_update_trigger(conn, table, columns)
+
+
+def _committed_pages(conn: sqlite3.Connection):
+    """
+    Page url -> body hash of the cached API responses whose products were
+    committed to this database. Unchanged pages are only skipped when their
+    marker matches, so a response cache never vouches for another database.
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS committed_pages (url TEXT PRIMARY KEY, body_hash TEXT NOT NULL) WITHOUT ROWID"
+    )
+
+
+# Append new migrations with the next version number; never renumber or edit
+# a migration that has been released.
+MIGRATIONS: List = [
+    Migration(1, "base schema", _base_schema),
+    BatchedMigration(2, "backfill first-price baseline", _backfill_first_price),
+    BatchedMigration(3, "cluster price_history on (productId, ts)", _cluster_price_history),
+    Migration(4, "composite indexes for read queries", _read_indexes),
+    Migration(5, "full-text search index", _search_index),
+    Migration(6, "trigram index for fuzzy search", _trigram_index),
+    Migration(7, "materialized product statistics", _product_stats),
+    Migration(8, "data generation counter", _data_generation),
+    Migration(9, "committed page markers", _committed_pages),
+    Migration(10, "skip search re-indexing of unchanged names", _guarded_index_updates),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _ensure_log(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            position TEXT,
+            batches INTEGER DEFAULT 0
+        )
+        """
+    )
+
+
+def _apply(conn: sqlite3.Connection, migration: Migration) -> bool:
+    """Runs a migration and the user_version bump in one transaction."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if schema_version(conn) >= migration.version:
+            # Another process applied it while we waited for the lock.
+            conn.execute("ROLLBACK")
+            return False
+        _ensure_log(conn)
+        migration.apply(conn)
+        now = _timestamp()
+        conn.execute(
+            "INSERT OR REPLACE INTO schema_migrations (version, name, started_at, finished_at) VALUES (?, ?, ?, ?)",
+            (migration.version, migration.name, now, now)
+        )
+        conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+        conn.execute("COMMIT")
+        return True
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _apply_batched(conn: sqlite3.Connection, migration: BatchedMigration, batch_size: int) -> bool:
+    """
+    Runs a batched migration one committed batch at a time. The position after
+    every batch is stored in schema_migrations, so a later call resumes from it.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _ensure_log(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_migrations (version, name, started_at) VALUES (?, ?, ?)",
+            (migration.version, migration.name, _timestamp())
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) >= migration.version:
+                conn.execute("ROLLBACK")
+                return False
+            position = conn.execute(
+                "SELECT position FROM schema_migrations WHERE version = ?", (migration.version,)
+            ).fetchone()[0]
+            position = migration.step(conn, position, batch_size)
+            if position is None:
+                conn.execute(
+                    "UPDATE schema_migrations SET finished_at = ?, position = NULL WHERE version = ?",
+                    (_timestamp(), migration.version)
+                )
+                conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+                conn.execute("COMMIT")
+                return True
+            conn.execute(
+                "UPDATE schema_migrations SET position = ?, batches = batches + 1 WHERE version = ?",
+                (position, migration.version)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def migrate(conn: sqlite3.Connection, target: Optional[int] = None,
+            batch_size: Optional[int] = None) -> int:
+    """
+    Applies every pending migration up to `target` (default: the latest).
+
+    Args:
+        conn: Read-write connection; its transaction handling is switched to
+            explicit BEGIN/COMMIT while migrating
+        target: Version to stop at
+        batch_size: Rows per batch for batched migrations
+            (default: get_config()['migration_batch_size'])
+
+    Returns:
+        Number of migrations applied
+    """
+    target = LATEST_VERSION if target is None else target
+    current = schema_version(conn)
+    if current >= target:
+        return 0
+    if batch_size is None:
+        batch_size = get_config()['migration_batch_size']
+
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    applied = 0
+    try:
+        if current == 0:
+            _new_database_settings(conn)
+        for migration in MIGRATIONS:
+            if migration.version <= current or migration.version > target:
+                continue
+            started = time.perf_counter()
+            if isinstance(migration, BatchedMigration):
+                done = _apply_batched(conn, migration, batch_size)
+            else:
+                done = _apply(conn, migration)
+            if done:
+                applied += 1
+                logger.info(f"Applied migration {migration.version} ({migration.name}) "
+                            f"in {time.perf_counter() - started:.2f}s")
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Systembolaget product search API.
+
+Serves synthetic or recorded products from the same `productsearch/search`
+shape the crawler expects, with configurable latency, error and throttle
+rates, so crawls can be benchmarked and tested without the network.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+SEARCH_PATH = "/sb-api-ecommerce/v1/productsearch/search"
+
+CATEGORIES = {
+    "Vin": ["Rött vin", "Vitt vin", "Rosévin", "Mousserande vin"],
+    "Öl": ["Ljus lager", "Ale", "Porter och stout", "Veteöl"],
+    "Sprit": ["Whisky", "Vodka och Brännvin", "Gin och Genever", "Rom", "Likör"],
+    "Cider & blanddrycker": ["Cider", "Blanddrycker"],
+    "Alkoholfritt": ["Alkoholfritt vin", "Alkoholfri öl"],
+}
+COUNTRIES = ["Sverige", "Frankrike", "Italien", "Spanien", "Tyskland", "Skottland", "USA", "Chile"]
+NAME_WORDS = ["Gamla", "Röda", "Klassisk", "Reserva", "Brygghus", "Slott", "Ekfat", "Norrland", "Blå", "Gröna"]
+VOLUMES = {"Vin": [750, 1500, 3000], "Öl": [330, 500], "Sprit": [350, 700, 1000],
+           "Cider & blanddrycker": [330, 500], "Alkoholfritt": [330, 750]}
+ABV_RANGES = {"Vin": (9.0, 15.0), "Öl": (3.5, 10.0), "Sprit": (30.0, 60.0),
+              "Cider & blanddrycker": (4.0, 7.0), "Alkoholfritt": (0.0, 0.5)}
+
+# Sort keys accepted in the sortBy parameter; Score keeps the catalogue order.
+SORT_FIELDS = {
+    "Score": None,
+    "Price": "price",
+    "Name": "productNameBold",
+    "ProductLaunchDate": "productLaunchDate",
+}
+
+# Product fields accepted as exact-match filter parameters.
+FILTER_FIELDS = ("categoryLevel1", "categoryLevel2", "country")
+
+
+def generate_products(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Generates `count` deterministic, realistic-looking API products.
+    """
+    rng = random.Random(seed)
+    categories = list(CATEGORIES)
+    start_date = date(2000, 1, 1)
+    products = []
+    for index in range(count):
+        category = rng.choice(categories)
+        volume = rng.choice(VOLUMES[category])
+        low, high = ABV_RANGES[category]
+        product_number = str(1000000 + index)
+        producer = f"{rng.choice(NAME_WORDS)} {rng.choice(['AB', 'Winery', 'Distillery', 'Bryggeri'])}"
+        launch = start_date + timedelta(days=rng.randrange(9000))
+        products.append({
+            "productId": str(20000000 + index),
+            "productNumber": product_number,
+            "productNumberShort": product_number[:5],
+            "productNameBold": f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)}",
+            "productNameThin": f"{rng.randrange(1990, 2025)}" if category == "Vin" else "",
+            "producerName": producer,
+            "supplierName": f"{rng.choice(NAME_WORDS)} Import AB",
+            "categoryLevel1": category,
+            "categoryLevel2": rng.choice(CATEGORIES[category]),
+            "categoryLevel3": None,
+            "country": rng.choice(COUNTRIES),
+            "productLaunchDate": f"{launch.isoformat()}T00:00:00",
+            "isTemporaryOutOfStock": rng.random() < 0.03,
+            "isCompletelyOutOfStock": rng.random() < 0.01,
+            "price": round(rng.uniform(15, 900), 2),
+            "volume": float(volume),
+            "alcoholPercentage": round(rng.uniform(low, high), 1),
+        })
+    return products
+
+
+def load_products(path: str) -> List[Dict[str, Any]]:
+    """
+    Loads recorded products from a JSON file holding either a list of
+    products, a single API response, or one API response per line.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        documents = [json.loads(text)]
+    except json.JSONDecodeError:
+        documents = [json.loads(line) for line in text.splitlines() if line.strip()]
+    products = []
+    for document in documents:
+        if isinstance(document, list):
+            products.extend(document)
+        else:
+            products.extend(document.get("products", []))
+    return products
+
+
+class MockApi:
+    """
+    Request handling for the mock product search endpoint.
+
+    Honours the `page`, `size`, `sortBy` and `sortDirection` parameters and
+    the FILTER_FIELDS filters, and reports `docCount`/`totalPages` in the
+    metadata like the real API.
+    Responses carry an ETag, and a matching If-None-Match is answered with
+    304 Not Modified.
+    """
+
+    def __init__(self, products: List[Dict[str, Any]], latency: float = 0.0,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 max_page_size: int = 1000, retry_after: float = 1.0, seed: int = 0):
+        self.products = products
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_page_size = max_page_size
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sorted: Dict[Tuple[str, str, Tuple[Tuple[str, str], ...]], List[Dict[str, Any]]] = {}
+        self.request_count = 0
+        self.error_count = 0
+        self.throttle_count = 0
+        self.not_modified_count = 0
+
+    def _ordered(self, sort_by: str, direction: str,
+                 filters: Tuple[Tuple[str, str], ...] = ()) -> List[Dict[str, Any]]:
+        key = (sort_by, direction, filters)
+        with self._lock:
+            if key not in self._sorted:
+                field = SORT_FIELDS.get(sort_by)
+                ordered = [p for p in self.products if all(p.get(name) == value for name, value in filters)]
+                if field is not None:
+                    ordered.sort(key=lambda p: (p.get(field) is None, p.get(field) or 0))
+                if direction == "Descending":
+                    ordered.reverse()
+                self._sorted[key] = ordered
+            return self._sorted[key]
+
+    def search(self, params: Dict[str, str],
+               request_headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Handles one search request.
+
+        Returns:
+            Tuple of (HTTP status, response headers, response body)
+        """
+        with self._lock:
+            self.request_count += 1
+            roll = self._rng.random()
+        if self.latency:
+            time.sleep(self.latency)
+        if roll < self.throttle_rate:
+            with self._lock:
+                self.throttle_count += 1
+            return 429, {"Retry-After": f"{self.retry_after:g}"}, b'{"message": "Rate limit exceeded"}'
+        if roll < self.throttle_rate + self.error_rate:
+            with self._lock:
+                self.error_count += 1
+            return 503, {}, b'{"message": "Service unavailable"}'
+
+        try:
+            page = max(1, int(params.get("page", 1)))
+            size = int(params.get("size", 30))
+        except ValueError:
+            return 400, {}, b'{"message": "Invalid page or size"}'
+        if size < 1 or size > self.max_page_size:
+            return 400, {}, b'{"message": "Invalid page size"}'
+        sort_by = params.get("sortBy", "Score")
+        if sort_by not in SORT_FIELDS:
+            return 400, {}, b'{"message": "Invalid sortBy"}'
+
+        filters = tuple((name, params[name]) for name in FILTER_FIELDS if name in params)
+        ordered = self._ordered(sort_by, params.get("sortDirection", "Ascending"), filters)
+        total_pages = math.ceil(len(ordered) / size)
+        start = (page - 1) * size
+        body = {
+            "metadata": {
+                "docCount": len(ordered),
+                "totalPages": total_pages,
+                "nextPage": page + 1 if page < total_pages else -1,
+            },
+            "products": ordered[start:start + size],
+        }
+        payload = json.dumps(body).encode("utf-8")
+        etag = f'"{hashlib.sha1(payload).hexdigest()}"'
+        if (request_headers or {}).get("If-None-Match") == etag:
+            with self._lock:
+                self.not_modified_count += 1
+            return 304, {"ETag": etag}, b""
+        return 200, {"Content-Type": "application/json; charset=utf-8", "ETag": etag}, payload
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.request_count,
+                "errors": self.error_count,
+                "throttled": self.throttle_count,
+                "not_modified": self.not_modified_count,
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path.rstrip("/") != SEARCH_PATH:
+            status, headers, body = 404, {}, b'{"message": "Not found"}'
+        else:
+            params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+            status, headers, body = self.server.api.search(params, dict(self.headers))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockApiServer:
+    """
+    Runs a MockApi on a local HTTP server in a background thread.
+
+    Usable as a context manager; `url` is the search endpoint to crawl.
+    """
+
+    def __init__(self, api: MockApi, host: str = "127.0.0.1", port: int = 0):
+        self.api = api
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.api = api
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{SEARCH_PATH}"
+
+    def start(self) -> "MockApiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "MockApiServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    """Runs the mock API in the foreground."""
+    parser = argparse.ArgumentParser(description="Local mock of the Systembolaget product search API")
+    parser.add_argument("--products", type=int, default=10000, help="Number of synthetic products")
+    parser.add_argument("--products-file", help="Serve recorded products from a JSON/NDJSON file instead")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of latency per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    products = load_products(args.products_file) if args.products_file else generate_products(args.products, args.seed)
+    api = MockApi(products, args.latency, args.error_rate, args.throttle_rate, seed=args.seed)
+    server = MockApiServer(api, args.host, args.port)
+    print(f"Serving {len(products)} products at {server.url}")
+    print(f"Crawl it with: SYSTEMET_API_URL={server.url} python cli.py update")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
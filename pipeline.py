@@ -0,0 +1,260 @@
+"""
+Staged producer/consumer pipeline for crawling and ingesting pages.
+
+Fetch workers, a normalize stage and a single writer thread are connected by
+bounded queues, so network waits, CPU work and SQLite writes overlap while
+backpressure keeps memory bounded. Pages reach the writer in task order.
+"""
+import heapq
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input.
+_DONE = object()
+
+
+class StageStats:
+    """Time spent and queue depth observed for one pipeline stage."""
+
+    def __init__(self, name: str, workers: int = 1):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_time = 0.0
+        self.queue_samples = 0
+        self.queue_total = 0
+        self.queue_max = 0
+        self._lock = threading.Lock()
+
+    def record(self, busy_time: float, queue_depth: int):
+        with self._lock:
+            self.items += 1
+            self.busy_time += busy_time
+            self.queue_samples += 1
+            self.queue_total += queue_depth
+            self.queue_max = max(self.queue_max, queue_depth)
+
+    def as_dict(self, elapsed: float) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'items': self.items,
+                'busy_time': self.busy_time,
+                'utilization': self.busy_time / (self.workers * elapsed) if elapsed > 0 else 0.0,
+                'queue_avg': self.queue_total / self.queue_samples if self.queue_samples else 0.0,
+                'queue_max': self.queue_max,
+            }
+
+
+class IngestPipeline:
+    """
+    Runs fetch -> normalize -> write over a sequence of tasks.
+
+    Args:
+        fetch: Called with a task on a fetch worker; returns the raw result
+        normalize: Called with (task, raw result); returns the value handed to the writer
+        write: Called on the writer thread with a list of (task, normalized) pairs,
+            consecutive in task order, to be committed together
+        workers: Number of fetch workers; 1 runs every stage inline on the caller's thread
+        queue_size: Capacity of each queue between stages
+        batch_size: Maximum number of tasks per write call
+        on_start_writer / on_stop_writer: Called on the writer thread before the
+            first and after the last write (e.g. to open and close its connection)
+    """
+
+    def __init__(self, fetch: Callable[[Any], Any], normalize: Callable[[Any, Any], Any],
+                 write: Callable[[List[Tuple[Any, Any]]], None], workers: int = 1,
+                 queue_size: int = 8, batch_size: int = 10,
+                 on_start_writer: Optional[Callable[[], None]] = None,
+                 on_stop_writer: Optional[Callable[[], None]] = None):
+        self.fetch = fetch
+        self.normalize = normalize
+        self.write = write
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.batch_size = max(1, batch_size)
+        self.on_start_writer = on_start_writer
+        self.on_stop_writer = on_stop_writer
+        self.stages = {
+            'fetch': StageStats('fetch', self.workers),
+            'normalize': StageStats('normalize'),
+            'write': StageStats('write'),
+        }
+        self._stop = threading.Event()
+        self._elapsed = 0.0
+        self._error: Optional[BaseException] = None
+
+    def stop(self):
+        """Stops handing out new tasks; work already fetched is still written."""
+        self._stop.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def run(self, tasks: Iterable[Any]):
+        """Processes every task and returns once the last write has finished."""
+        started = time.perf_counter()
+        try:
+            if self.workers == 1:
+                self._run_inline(tasks)
+            else:
+                self._run_threaded(tasks)
+        finally:
+            self._elapsed = time.perf_counter() - started
+        if self._error is not None:
+            raise self._error
+
+    def _run_inline(self, tasks: Iterable[Any]):
+        """Serial mode: every stage runs on the calling thread, one task at a time."""
+        if self.on_start_writer:
+            self.on_start_writer()
+        try:
+            for task in tasks:
+                if self._stop.is_set():
+                    break
+                t0 = time.perf_counter()
+                raw = self.fetch(task)
+                t1 = time.perf_counter()
+                self.stages['fetch'].record(t1 - t0, 0)
+                normalized = self.normalize(task, raw)
+                t2 = time.perf_counter()
+                self.stages['normalize'].record(t2 - t1, 0)
+                self.write([(task, normalized)])
+                self.stages['write'].record(time.perf_counter() - t2, 0)
+        finally:
+            if self.on_stop_writer:
+                self.on_stop_writer()
+
+    def _run_threaded(self, tasks: Iterable[Any]):
+        task_queue: queue.Queue = queue.Queue(maxsize=self.workers)
+        fetched: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        normalized: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+        fetchers = [
+            threading.Thread(target=self._fetch_worker, args=(task_queue, fetched), name=f"fetch-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        normalizer = threading.Thread(target=self._normalize_worker, args=(fetched, normalized),
+                                      name="normalize", daemon=True)
+        writer = threading.Thread(target=self._write_worker, args=(normalized,), name="writer", daemon=True)
+        for thread in fetchers + [normalizer, writer]:
+            thread.start()
+
+        # Hand out tasks in order; the bounded task queue keeps this thread
+        # from running ahead of the fetch workers.
+        for seq, task in enumerate(tasks):
+            if self._stop.is_set():
+                break
+            task_queue.put((seq, task))
+        for _ in fetchers:
+            task_queue.put(_DONE)
+
+        for thread in fetchers:
+            thread.join()
+        fetched.put(_DONE)
+        normalizer.join()
+        writer.join()
+
+    def _fail(self, stage: str, error: BaseException):
+        logger.error(f"Pipeline {stage} stage failed: {error}")
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _fetch_worker(self, task_queue: queue.Queue, fetched: queue.Queue):
+        while True:
+            item = task_queue.get()
+            if item is _DONE:
+                return
+            seq, task = item
+            if self._stop.is_set() and self._error is not None:
+                continue
+            started = time.perf_counter()
+            try:
+                raw = self.fetch(task)
+            except Exception as e:
+                logger.error(f"Error fetching {task}: {e}")
+                raw = None
+            busy = time.perf_counter() - started
+            fetched.put((seq, task, raw))
+            self.stages['fetch'].record(busy, fetched.qsize())
+
+    def _normalize_worker(self, fetched: queue.Queue, normalized: queue.Queue):
+        while True:
+            item = fetched.get()
+            if item is _DONE:
+                normalized.put(_DONE)
+                return
+            seq, task, raw = item
+            started = time.perf_counter()
+            try:
+                value = self.normalize(task, raw)
+            except Exception as e:
+                logger.error(f"Error normalizing {task}: {e}")
+                value = None
+            busy = time.perf_counter() - started
+            normalized.put((seq, task, value))
+            self.stages['normalize'].record(busy, normalized.qsize())
+
+    def _write_worker(self, normalized: queue.Queue):
+        # Reorder buffer: pages may finish fetching out of order, but are
+        # written strictly in task order.
+        pending: List[Tuple[int, Any, Any]] = []
+        next_seq = 0
+        finished = False
+        try:
+            if self.on_start_writer:
+                self.on_start_writer()
+            while not finished or pending:
+                if not finished:
+                    item = normalized.get()
+                    if item is _DONE:
+                        finished = True
+                    else:
+                        heapq.heappush(pending, item)
+                    # Take whatever else is ready so a write can cover several pages.
+                    while not finished:
+                        try:
+                            item = normalized.get_nowait()
+                        except queue.Empty:
+                            break
+                        if item is _DONE:
+                            finished = True
+                        else:
+                            heapq.heappush(pending, item)
+
+                batch = []
+                while pending and pending[0][0] == next_seq and len(batch) < self.batch_size:
+                    _, task, value = heapq.heappop(pending)
+                    batch.append((task, value))
+                    next_seq += 1
+                if batch:
+                    started = time.perf_counter()
+                    if self._error is None:
+                        self.write(batch)
+                    self.stages['write'].record(time.perf_counter() - started, normalized.qsize())
+                elif finished:
+                    # Tasks that were never fetched (after stop()) leave gaps.
+                    if pending:
+                        next_seq = pending[0][0]
+        except Exception as e:
+            self._fail('write', e)
+            # Keep draining so upstream stages are never blocked on a full queue.
+            while not finished:
+                if normalized.get() is _DONE:
+                    finished = True
+        finally:
+            if self.on_stop_writer:
+                self.on_stop_writer()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns per-stage items, busy time, utilization and queue depth."""
+        stages = {name: stage.as_dict(self._elapsed) for name, stage in self.stages.items()}
+        bottleneck = max(stages, key=lambda name: stages[name]['utilization']) if self._elapsed else None
+        return {'elapsed': self._elapsed, 'stages': stages, 'bottleneck': bottleneck}
@@ -0,0 +1,111 @@
+"""
+Query-plan regression checks for the read queries in utils.py and deploy.py.
+
+Every module-level `*_SQL` constant in the checked modules is run through
+`EXPLAIN QUERY PLAN` against the migrated schema. A plan step that scans a
+whole table (`SCAN`, other than a virtual-table lookup) or sorts into a
+temporary B-tree (`TEMP B-TREE`) is a regression unless that query and step
+are listed in ALLOWED_STEPS, which only holds steps the query cannot avoid.
+"""
+import logging
+import re
+import sqlite3
+from typing import Any, Dict, List, Optional
+
+import db
+import deploy
+import migrations
+import utils
+
+logger = logging.getLogger(__name__)
+
+CHECKED_MODULES = [utils, deploy]
+
+# Plan steps a query cannot avoid, with the reason. Only inherently full
+# work belongs here: every entry must show up in its query's plan.
+ALLOWED_STEPS = {
+    'utils.CATEGORY_STATS_SQL': {
+        'USE TEMP B-TREE FOR ORDER BY': 'recompute path: ranks the aggregate of every category by its count',
+    },
+    'utils.CATEGORY_STATS_TABLE_SQL': {
+        'SCAN category_stats': 'ranks every category, one materialized row each',
+        'USE TEMP B-TREE FOR ORDER BY': 'ranks every category by product count',
+    },
+    'utils.SEARCH_PRODUCTS_SQL': {
+        'SCAN products': "substring fallback: LIKE '%q%' cannot use an index",
+        'USE TEMP B-TREE FOR ORDER BY': 'orders the substring matches by APK',
+    },
+    'utils.SEARCH_PRODUCTS_FTS_SQL': {
+        'USE TEMP B-TREE FOR ORDER BY': 'bm25 is only known per match, so ranking sorts the matches',
+    },
+    'deploy.SEARCH_FTS_SQL': {
+        'USE TEMP B-TREE FOR ORDER BY': 'bm25 is only known per match, so ranking sorts the matches',
+    },
+}
+
+# Virtual-table steps that are lookups rather than table scans: an FTS5 MATCH
+# (idxStr "...:M..."), a term-equality lookup in an fts5vocab table (odd
+# idxNum) and json_each over a bound parameter. SCAN CONSTANT ROW is a SELECT
+# without FROM.
+PROBLEM_PATTERN = re.compile(
+    r"^SCAN (?!\S+ VIRTUAL TABLE INDEX \d+:M|\S+_vocab VIRTUAL TABLE INDEX \d*[13579]:"
+    r"|json_each VIRTUAL TABLE|CONSTANT ROW)|TEMP B-TREE"
+)
+
+
+def read_queries() -> Dict[str, str]:
+    """Returns {'module.NAME': sql} for every *_SQL constant in the checked modules."""
+    queries = {}
+    for module in CHECKED_MODULES:
+        for name in sorted(vars(module)):
+            value = getattr(module, name)
+            if name.endswith("_SQL") and isinstance(value, str):
+                queries[f"{module.__name__}.{name}"] = value
+    return queries
+
+
+def explain(conn: sqlite3.Connection, sql: str) -> List[str]:
+    """Returns the detail column of EXPLAIN QUERY PLAN, binding NULL to every parameter."""
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count("?")).fetchall()
+    return [row[3] for row in rows]
+
+
+def check_plans(db_name: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Explains every read query and flags full scans and temp B-tree sorts.
+
+    The queries run against an in-memory database, which is migrated to the
+    latest schema; the database being checked is never written.
+
+    Args:
+        db_name: Database whose contents and statistics the plans should
+            reflect; it is copied into memory first. Defaults to an empty
+            database, so the result depends only on the schema
+
+    Returns:
+        One dict per query with name, plan, problems (steps that are not
+        allowed) and allowed (allowed steps that were used)
+    """
+    conn = db.connect(":memory:")
+    try:
+        if db_name:
+            source = db.connect(db_name, read_only=True)
+            try:
+                source.backup(conn)
+            finally:
+                source.close()
+        migrations.migrate(conn)
+        results = []
+        for name, sql in read_queries().items():
+            plan = explain(conn, sql)
+            allowed = ALLOWED_STEPS.get(name, {})
+            flagged = [step for step in plan if PROBLEM_PATTERN.search(step)]
+            results.append({
+                'name': name,
+                'plan': plan,
+                'problems': [step for step in flagged if step not in allowed],
+                'allowed': [step for step in flagged if step in allowed],
+            })
+    finally:
+        conn.close()
+    return results
@@ -0,0 +1,254 @@
+"""
+Adaptive retry and rate control for requests against the Systembolaget API.
+"""
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def parse_retry_after(value: Optional[str], now: Optional[datetime] = None) -> Optional[float]:
+    """
+    Parses a Retry-After header given either as seconds or as an HTTP date.
+
+    Returns:
+        Delay in seconds, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float,
+                  retry_after: Optional[float] = None,
+                  rng: Callable[[], float] = random.random) -> float:
+    """
+    Returns the delay before retry number `attempt` (0-based).
+
+    Uses exponential backoff with full jitter; a server supplied Retry-After
+    is treated as a lower bound.
+    """
+    delay = rng() * min(max_delay, base_delay * (2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, max_delay))
+    return delay
+
+
+class RateController:
+    """
+    Shared retry, circuit-breaker and concurrency control for API requests.
+
+    Concurrency follows AIMD: after a full window of fast, successful
+    responses the limit grows by one, and throttling (429), server errors,
+    timeouts or responses slower than the latency target halve it. After
+    `failure_threshold` consecutive failures the circuit opens and requests
+    wait for `cooldown` seconds before a single probe is let through.
+
+    The clock and sleep functions can be replaced to drive it in tests.
+    """
+
+    def __init__(self, initial_concurrency: int = 1, min_concurrency: int = 1,
+                 max_concurrency: Optional[int] = None, base_delay: float = 2.0,
+                 max_delay: float = 60.0, latency_target: float = 2.0,
+                 failure_threshold: int = 5, cooldown: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep,
+                 rng: Callable[[], float] = random.random):
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency or initial_concurrency)
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_target = latency_target
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._window_successes = 0
+        self._consecutive_failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._not_before = 0.0
+
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.throttled = 0
+        self.circuit_opens = 0
+
+    @property
+    def concurrency(self) -> int:
+        """Current number of requests allowed in flight."""
+        return int(self.limit)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def acquire(self) -> bool:
+        """
+        Blocks until a request may be sent: a concurrency slot is free, any
+        Retry-After pause has passed and the circuit is not open.
+
+        Returns:
+            True if this request is the half-open probe; pass it to release()
+        """
+        probe = False
+        with self._cond:
+            while True:
+                now = self.clock()
+                wait = 0.0
+                if self._state == OPEN:
+                    remaining = self._opened_at + self.cooldown - now
+                    if remaining <= 0:
+                        self._state = HALF_OPEN
+                        logger.info("Circuit half-open, sending a probe request")
+                    else:
+                        wait = remaining
+                if not wait and now < self._not_before:
+                    wait = self._not_before - now
+                if not wait:
+                    if self._state == HALF_OPEN:
+                        if not self._probe_in_flight:
+                            self._probe_in_flight = True
+                            probe = True
+                            break
+                    elif self._in_flight < self.concurrency:
+                        break
+                if wait:
+                    # Sleep outside the lock so other threads can report results.
+                    self._cond.release()
+                    try:
+                        self.sleep(wait)
+                    finally:
+                        self._cond.acquire()
+                else:
+                    self._cond.wait(timeout=1.0)
+            self._in_flight += 1
+            self.requests += 1
+        return probe
+
+    def release(self, probe: bool = False):
+        """
+        Frees the slot taken by acquire(). Only the probe request clears the
+        probe flag, so requests that were already in flight when the circuit
+        opened cannot let a second probe through. A probe that ended without
+        a recorded outcome (no response at all) reopens the circuit.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if probe:
+                self._probe_in_flight = False
+                if self._state == HALF_OPEN:
+                    logger.warning("Probe request ended without a response, circuit reopened")
+                    self._state = OPEN
+                    self._opened_at = self.clock()
+            self._cond.notify_all()
+
+    def record_success(self, latency: float):
+        """Reports a successful response and its latency in seconds."""
+        with self._cond:
+            self.successes += 1
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                logger.info("Circuit closed after successful probe")
+                self._state = CLOSED
+            if latency > self.latency_target:
+                self._decrease(f"latency {latency:.2f}s above target")
+            else:
+                self._window_successes += 1
+                if self._window_successes >= self.concurrency:
+                    self._window_successes = 0
+                    if self.limit < self.max_concurrency:
+                        self.limit = min(self.max_concurrency, self.limit + 1)
+                        logger.debug(f"Concurrency increased to {self.concurrency}")
+            self._cond.notify_all()
+
+    def record_client_error(self, status: int):
+        """
+        Reports a non-retryable 4xx response. The request failed, but the API
+        answered, so it resets the failure streak and closes the circuit
+        after a probe without touching the concurrency limit.
+        """
+        with self._cond:
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                logger.info(f"Circuit closed after probe answered with status {status}")
+                self._state = CLOSED
+            self._cond.notify_all()
+
+    def record_failure(self, status: Optional[int] = None, retry_after: Optional[float] = None):
+        """
+        Reports a failed attempt. `status` is the HTTP status code, or None for
+        connection errors and timeouts.
+        """
+        with self._cond:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if status == 429:
+                self.throttled += 1
+            if retry_after is not None:
+                # Every worker honours the server's pause, not only this one.
+                self._not_before = max(self._not_before, self.clock() + min(retry_after, self.max_delay))
+            self._decrease(f"status {status}" if status else "request error")
+            if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.circuit_opens += 1
+                    logger.warning(
+                        f"Circuit opened after {self._consecutive_failures} consecutive failures, "
+                        f"pausing requests for {self.cooldown}s"
+                    )
+                self._state = OPEN
+                self._opened_at = self.clock()
+            self._cond.notify_all()
+
+    def _decrease(self, reason: str):
+        self._window_successes = 0
+        new_limit = max(float(self.min_concurrency), self.limit / 2)
+        if int(new_limit) < self.concurrency:
+            logger.info(f"Concurrency decreased to {int(new_limit)} ({reason})")
+        self.limit = new_limit
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Returns the delay before retry number `attempt` (0-based)."""
+        return backoff_delay(attempt, self.base_delay, self.max_delay, retry_after, self.rng)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns counters describing how the API behaved during the run."""
+        with self._cond:
+            return {
+                'requests': self.requests,
+                'successes': self.successes,
+                'failures': self.failures,
+                'throttled': self.throttled,
+                'circuit_opens': self.circuit_opens,
+                'circuit_state': self._state,
+                'concurrency': self.concurrency,
+            }
@@ -0,0 +1,140 @@
+"""
+Sharded crawl plans: the catalogue is split by an API filter (for example
+`categoryLevel1`) into shards that are paginated independently.
+
+Each shard's pages are mapped onto one run-wide page index, so the pipeline,
+crawl_pages checkpoints and the archive keep working on plain page numbers.
+"""
+import bisect
+import logging
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Shard(NamedTuple):
+    """One filtered slice of the catalogue and its place in the run-wide page index."""
+    name: str
+    first_page: int
+    total_pages: int
+    doc_count: int
+
+
+class ShardPlan:
+    """
+    Maps run-wide page numbers to (shard, shard page) and keeps per-shard
+    progress: pages, products received and wall time from the first fetch to
+    the last committed page.
+    """
+
+    def __init__(self, field: str, shards: List[Shard]):
+        self.field = field
+        self.shards = shards
+        self._starts = [shard.first_page for shard in shards]
+        self._lock = threading.Lock()
+        self._stats = {
+            shard.name: {'pages': 0, 'products': 0, 'started': None, 'finished': None}
+            for shard in shards
+        }
+
+    @classmethod
+    def build(cls, field: str, shard_counts: List[Tuple[str, int, int]]) -> "ShardPlan":
+        """
+        Creates a plan from (shard name, total pages, doc count) tuples, giving
+        each shard a consecutive range of run-wide pages starting at 1.
+        """
+        shards = []
+        first_page = 1
+        for name, total_pages, doc_count in shard_counts:
+            shards.append(Shard(name, first_page, total_pages, doc_count))
+            first_page += total_pages
+        return cls(field, shards)
+
+    @property
+    def total_pages(self) -> int:
+        return sum(shard.total_pages for shard in self.shards)
+
+    @property
+    def doc_count(self) -> int:
+        return sum(shard.doc_count for shard in self.shards)
+
+    def locate(self, page: int) -> Tuple[Shard, int]:
+        """Returns the shard of a run-wide page and the page number within it."""
+        shard = self.shards[bisect.bisect_right(self._starts, page) - 1]
+        return shard, page - shard.first_page + 1
+
+    def interleave(self, pages: List[int]) -> List[int]:
+        """
+        Orders run-wide pages round-robin across shards, so every shard is
+        crawled in parallel instead of one after another.
+        """
+        by_shard: Dict[str, List[int]] = {shard.name: [] for shard in self.shards}
+        for page in sorted(pages):
+            by_shard[self.locate(page)[0].name].append(page)
+        queues = [queue for queue in by_shard.values() if queue]
+        ordered = []
+        for index in range(max((len(queue) for queue in queues), default=0)):
+            ordered.extend(queue[index] for queue in queues if index < len(queue))
+        return ordered
+
+    def record_fetch(self, page: int):
+        """Notes that a page of a shard is being fetched."""
+        stats = self._stats[self.locate(page)[0].name]
+        with self._lock:
+            if stats['started'] is None:
+                stats['started'] = time.perf_counter()
+
+    def record_written(self, page: int, product_count: int):
+        """Notes that a page of a shard has been committed."""
+        stats = self._stats[self.locate(page)[0].name]
+        with self._lock:
+            stats['pages'] += 1
+            stats['products'] += product_count
+            stats['finished'] = time.perf_counter()
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Returns per-shard doc counts, pages, products received and elapsed time."""
+        report = []
+        with self._lock:
+            for shard in self.shards:
+                stats = self._stats[shard.name]
+                elapsed = None
+                if stats['started'] is not None and stats['finished'] is not None:
+                    elapsed = stats['finished'] - stats['started']
+                report.append({
+                    'shard': shard.name,
+                    'doc_count': shard.doc_count,
+                    'total_pages': shard.total_pages,
+                    'pages': stats['pages'],
+                    'products': stats['products'],
+                    'elapsed': elapsed,
+                })
+        return report
+
+    def save(self, conn, run_id: int):
+        """Stores the plan for a crawl run so it can be resumed."""
+        with conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO crawl_shards (run_id, field, shard, first_page, total_pages, doc_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(run_id, self.field, shard.name, shard.first_page, shard.total_pages, shard.doc_count)
+                 for shard in self.shards]
+            )
+
+    @classmethod
+    def load(cls, conn, run_id: int) -> Optional["ShardPlan"]:
+        """Returns the stored plan of a crawl run, or None if it was not sharded."""
+        rows = conn.execute(
+            """
+            SELECT field, shard, first_page, total_pages, doc_count FROM crawl_shards
+            WHERE run_id = ? ORDER BY first_page
+            """,
+            (run_id,)
+        ).fetchall()
+        if not rows:
+            return None
+        return cls(rows[0][0], [Shard(*row[1:]) for row in rows])
@@ -0,0 +1,149 @@
+"""
+In-memory snapshot of the products table used to diff API data during ingestion.
+"""
+from typing import Dict, Iterable, Optional, Tuple
+
+NEW = "new"
+PRICE_CHANGED = "price_changed"
+METADATA_CHANGED = "metadata_changed"
+UNCHANGED = "unchanged"
+
+CLASSIFICATIONS = (NEW, PRICE_CHANGED, METADATA_CHANGED, UNCHANGED)
+
+# Descriptive columns covered by the content hash.
+METADATA_COLUMNS = (
+    "productNumber",
+    "productNumberShort",
+    "productNameBold",
+    "productNameThin",
+    "producerName",
+    "supplierName",
+    "categoryLevel1",
+    "categoryLevel2",
+    "categoryLevel3",
+    "country",
+    "productLaunchDate",
+)
+
+# Snapshot entry layout: (price, isTemporaryOutOfStock, isCompletelyOutOfStock,
+# volume, alcoholPercentage, content_hash, first_price)
+Entry = Tuple[float, Optional[bool], Optional[bool], float, float, int, Optional[float]]
+
+PRICE_EPSILON = 1e-9
+
+# SQLite limits the number of bound parameters per statement; IN lists are
+# chunked well below the lowest default limit (999).
+IN_QUERY_CHUNK_SIZE = 500
+
+
+def _flag(value) -> Optional[bool]:
+    """Normalizes SQLite 0/1 and API booleans to the same representation."""
+    return None if value is None else bool(value)
+
+
+def content_hash(metadata: Iterable) -> int:
+    """
+    Returns a compact hash of the descriptive fields of a product.
+    The value is only compared within one process, so the built-in hash is enough.
+    """
+    return hash(tuple(metadata))
+
+
+def make_entry(price, temporary_out_of_stock, completely_out_of_stock, volume, alcohol_percentage,
+               metadata: Iterable, first_price: Optional[float] = None) -> Entry:
+    """Builds a snapshot entry from column values."""
+    return (
+        price or 0.0,
+        _flag(temporary_out_of_stock),
+        _flag(completely_out_of_stock),
+        volume or 0.0,
+        alcohol_percentage or 0.0,
+        content_hash(metadata),
+        first_price,
+    )
+
+
+class ProductSnapshot:
+    """
+    Compact productId -> entry map of the products table.
+
+    Loaded once at the start of a run, it lets ingestion classify every API
+    product as new, price-changed, metadata-changed or unchanged without
+    querying the database, so only the rows that changed are written.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Entry] = {}
+        self.counts: Dict[str, int] = {name: 0 for name in CLASSIFICATIONS}
+
+    @classmethod
+    def load(cls, conn, product_ids: Optional[list] = None) -> "ProductSnapshot":
+        """
+        Loads the snapshot from the products table.
+
+        Args:
+            conn: Open database connection
+            product_ids: Restrict the snapshot to these products (None loads all)
+        """
+        snapshot = cls()
+        columns = ", ".join(METADATA_COLUMNS)
+        sql = f"""
+            SELECT
+                productId, price, isTemporaryOutOfStock, isCompletelyOutOfStock,
+                volume, alcoholPercentage, first_price, {columns}
+            FROM products
+        """
+        cursor = conn.cursor()
+        if product_ids is None:
+            cursor.execute(sql)
+            snapshot._load_rows(cursor.fetchall())
+        else:
+            for start in range(0, len(product_ids), IN_QUERY_CHUNK_SIZE):
+                chunk = product_ids[start:start + IN_QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"{sql} WHERE productId IN ({placeholders})", chunk)
+                snapshot._load_rows(cursor.fetchall())
+        return snapshot
+
+    def _load_rows(self, rows):
+        for row in rows:
+            self._entries[row[0]] = make_entry(row[1], row[2], row[3], row[4], row[5], row[7:], row[6])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self._entries
+
+    def get(self, product_id: str) -> Optional[Entry]:
+        return self._entries.get(product_id)
+
+    def classify(self, product_id: str, entry: Entry) -> str:
+        """
+        Classifies an incoming product against the snapshot and counts the result.
+        A product whose price changed is reported as price-changed even if its
+        metadata changed as well.
+        """
+        current = self._entries.get(product_id)
+        if current is None:
+            result = NEW
+        elif abs(entry[0] - current[0]) >= PRICE_EPSILON:
+            result = PRICE_CHANGED
+        elif entry[1:6] != current[1:6]:
+            result = METADATA_CHANGED
+        else:
+            result = UNCHANGED
+        self.counts[result] += 1
+        return result
+
+    def metadata_changed(self, product_id: str, entry: Entry) -> bool:
+        """Returns True if anything besides the price differs from the snapshot."""
+        current = self._entries.get(product_id)
+        return current is None or entry[1:6] != current[1:6]
+
+    def update(self, product_id: str, entry: Entry):
+        """Stores the entry for a product after it has been written."""
+        self._entries[product_id] = entry
+
+    def reset_counts(self):
+        self.counts = {name: 0 for name in CLASSIFICATIONS}
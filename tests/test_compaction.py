@@ -0,0 +1,79 @@
+import sqlite3
+
+import compaction
+import main
+import migrations
+
+
+def repeated_prices(products, points):
+    """History rows that all repeat the same price; compaction keeps the first of each product."""
+    return [
+        (str(product), 11.0, f"2024-01-01 00:{point // 60:02d}:{point % 60:02d}")
+        for product in range(products) for point in range(points)
+    ]
+
+
+def test_new_databases_use_incremental_auto_vacuum(tmp_path):
+    path = str(tmp_path / "products.db")
+    main.initialize_database(path)
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert not compaction.needs_full_vacuum(conn)
+    conn.close()
+
+
+def test_freed_pages_are_returned(tmp_path):
+    path = str(tmp_path / "products.db")
+    main.initialize_database(path)
+    conn = main.get_database_connection(path)
+    with conn:
+        conn.executemany("INSERT INTO products (productId, price) VALUES (?, 11.0)",
+                         [(str(product),) for product in range(200)])
+        main.insert_price_history(conn.cursor(), repeated_prices(200, 120))
+    conn.close()
+
+    result = compaction.compact_price_history(path)
+
+    conn = sqlite3.connect(path)
+    assert result['rows_after'] == 200
+    assert not result['full_vacuum']
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert result['bytes_reclaimed'] > 100 * conn.execute("PRAGMA page_size").fetchone()[0]
+    conn.close()
+
+
+def test_reclaim_space_empties_the_freelist(tmp_path):
+    path = str(tmp_path / "products.db")
+    main.initialize_database(path)
+    conn = main.get_database_connection(path)
+    with conn:
+        conn.executemany("INSERT INTO products (productId, price) VALUES (?, 11.0)",
+                         [(str(product),) for product in range(200)])
+        main.insert_price_history(conn.cursor(), repeated_prices(200, 60))
+    with conn:
+        conn.execute("DELETE FROM price_history")
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 1
+
+    assert not compaction.reclaim_space(conn)
+
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    conn.close()
+
+
+def test_older_database_needs_explicit_full_vacuum(tmp_path):
+    path = str(tmp_path / "products.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE legacy (x)")
+    migrations.migrate(conn)
+    conn.execute("INSERT INTO products (productId, productNameBold) VALUES ('1', 'Gamla')")
+    conn.commit()
+    conn.close()
+
+    result = compaction.compact_price_history(path)
+    assert not result['full_vacuum'] and result['full_vacuum_needed']
+
+    result = compaction.compact_price_history(path, full_vacuum=True)
+    assert result['full_vacuum'] and not result['full_vacuum_needed']
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT rowid FROM products_fts WHERE products_fts MATCH 'gamla'").fetchall() == [(1,)]
+    conn.close()
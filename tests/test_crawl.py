@@ -0,0 +1,60 @@
+import contextlib
+import io
+
+import pytest
+
+import main
+from mock_api import MockApi, MockApiServer, generate_products
+
+
+@pytest.fixture
+def crawl_env(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SYSTEMET_HTTP_CACHE", "")
+    monkeypatch.setenv("SYSTEMET_ARCHIVE_DIR", "")
+    monkeypatch.setenv("SYSTEMET_RETRY_DELAY", "0")
+    monkeypatch.setenv("SYSTEMET_CONCURRENCY", "4")
+    monkeypatch.setenv("SYSTEMET_PAGE_SIZE", "30")
+    yield
+    main.changes_log.clear()
+
+
+def crawl(url, **kwargs):
+    main.changes_log.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return main.fetch_products_from_api(db_name="products.db", api_base_url=url, **kwargs)
+
+
+def test_delta_crawl_makes_no_requests_past_the_stop(crawl_env):
+    api = MockApi(generate_products(900))
+    with MockApiServer(api) as server:
+        crawl(server.url)
+        before = api.stats()['requests']
+
+        summary = crawl(server.url, mode=main.MODE_DELTA, stop_after=2)
+
+    requests = api.stats()['requests'] - before
+    assert summary['stopped_at_page'] == 2
+    assert summary['pages_done'] == 2
+    assert requests == 2
+
+
+def test_reprocess_into_new_database_replays_delisting(crawl_env, monkeypatch):
+    monkeypatch.setenv("SYSTEMET_ARCHIVE_DIR", "archive")
+    products = generate_products(90)
+    with MockApiServer(MockApi(products)) as server:
+        crawl(server.url)
+    with MockApiServer(MockApi(products[:60])) as server:
+        crawl(server.url)
+
+    def delisted(db_name):
+        conn = main.get_database_connection(db_name)
+        try:
+            return conn.execute("SELECT productId FROM products WHERE delisted = 1 ORDER BY 1").fetchall()
+        finally:
+            conn.close()
+
+    assert len(delisted("products.db")) == 30
+    result = main.reprocess_archive(db_name="replayed.db", archive_dir="archive")
+    assert result['runs'] == 2
+    assert delisted("replayed.db") == delisted("products.db")
@@ -0,0 +1,117 @@
+import logging
+import sqlite3
+
+import pytest
+
+import main
+import migrations
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    yield conn
+    conn.close()
+
+
+def test_migrates_fresh_database_to_latest(conn):
+    assert migrations.migrate(conn) == len(migrations.MIGRATIONS)
+    assert migrations.schema_version(conn) == migrations.LATEST_VERSION
+    assert migrations.migrate(conn) == 0
+
+
+def test_migrates_one_version_at_a_time(conn):
+    for version in range(1, migrations.LATEST_VERSION + 1):
+        assert migrations.migrate(conn, target=version) == 1
+        assert migrations.schema_version(conn) == version
+    versions = [row[0] for row in conn.execute("SELECT version FROM schema_migrations ORDER BY version")]
+    assert versions == list(range(1, migrations.LATEST_VERSION + 1))
+
+
+def test_legacy_history_is_clustered_in_batches(conn, caplog):
+    migrations.migrate(conn, target=2)
+    conn.execute("INSERT INTO products (productId, price) VALUES ('1', 10)")
+    conn.executemany(
+        "INSERT INTO price_history (productId, price, timestamp) VALUES (?, ?, ?)",
+        [
+            ('1', 10.0, '2024-01-01 00:00:00'),
+            ('1', 11.0, '2024-01-01 00:00:00'),
+            ('1', 12.5, '2024-01-01 00:00:01'),
+            (None, 1.0, '2024-01-01 00:00:00'),
+            ('1', 1.0, 'not a timestamp'),
+        ]
+    )
+    conn.commit()
+
+    with caplog.at_level(logging.WARNING, logger="migrations"):
+        migrations.migrate(conn, batch_size=2)
+
+    rows = conn.execute("SELECT productId, ts, price_ore FROM price_history ORDER BY ts").fetchall()
+    # The later of two rows in the same second wins.
+    assert rows == [('1', 1704067200, 1100), ('1', 1704067201, 1250)]
+    assert "merged 1 legacy rows" in caplog.text
+    assert "dropped 2 rows" in caplog.text
+
+
+def test_same_second_price_replaces_the_point(conn, caplog):
+    migrations.migrate(conn)
+    conn.execute("INSERT INTO products (productId, price) VALUES ('1', 10)")
+    cursor = conn.cursor()
+
+    assert main.insert_price_history(cursor, [('1', 10.0, '2024-01-01 00:00:00')]) == 0
+    # Repeating the same price in the same second is not a replacement.
+    assert main.insert_price_history(cursor, [('1', 10.0, '2024-01-01 00:00:00')]) == 0
+    with caplog.at_level(logging.WARNING, logger="main"):
+        assert main.insert_price_history(cursor, [('1', 12.0, '2024-01-01 00:00:00')]) == 1
+
+    assert conn.execute("SELECT ts, price_ore FROM price_history").fetchall() == [(1704067200, 1200)]
+    assert "Replaced 1 price_history points" in caplog.text
+
+
+def test_product_stats_follow_products(conn):
+    migrations.migrate(conn)
+    conn.executemany(
+        "INSERT INTO products (productId, price, apk, price_change_percentage, delisted) VALUES (?, ?, ?, ?, ?)",
+        [('1', 100.0, 1.0, 0.0, 0), ('2', 300.0, 2.0, 5.0, 0), ('3', 50.0, 0.5, -1.0, 1)]
+    )
+    conn.execute("UPDATE products SET delisted = 1 WHERE productId = '2'")
+
+    listed, delisted, price_sum, increases = conn.execute(
+        "SELECT listed, delisted, price_sum, increases FROM product_stats"
+    ).fetchone()
+    assert (listed, delisted, price_sum, increases) == (1, 2, 100.0, 0)
+
+    conn.execute("DELETE FROM products WHERE productId = '3'")
+    assert conn.execute("SELECT listed, delisted FROM product_stats").fetchone() == (1, 1)
+
+
+def test_stats_match_a_recompute(conn):
+    migrations.migrate(conn)
+    conn.executemany(
+        "INSERT INTO products (productId, price, apk, categoryLevel1, delisted) VALUES (?, ?, ?, ?, ?)",
+        # Quarter steps add up exactly, so the sums can be compared as they are.
+        [(str(i), 10.0 * i, i * 0.25, f"cat{i % 3}", i % 4 == 0) for i in range(1, 40)]
+    )
+    conn.execute("UPDATE products SET price = price + 1, categoryLevel1 = 'cat9' WHERE productId IN ('5', '6')")
+    maintained = conn.execute("SELECT * FROM category_stats ORDER BY category").fetchall()
+    totals = conn.execute("SELECT * FROM product_stats").fetchall()
+
+    migrations.recompute_product_stats(conn)
+
+    assert conn.execute("SELECT * FROM category_stats ORDER BY category").fetchall() == maintained
+    assert conn.execute("SELECT * FROM product_stats").fetchall() == totals
+
+
+def test_search_index_skips_unchanged_names(conn):
+    migrations.migrate(conn)
+    conn.execute("INSERT INTO products (productId, productNameBold) VALUES ('1', 'Gamla')")
+    # Point the index at other text, so re-indexing the product would show.
+    conn.execute("INSERT INTO products_fts (products_fts, rowid, productNameBold) VALUES ('delete', 1, 'Gamla')")
+    conn.execute("INSERT INTO products_fts (rowid, productNameBold) VALUES (1, 'Stale')")
+    search = "SELECT rowid FROM products_fts WHERE products_fts MATCH ?"
+
+    conn.execute("UPDATE products SET productNameBold = 'Gamla', price = 10 WHERE productId = '1'")
+    assert conn.execute(search, ("gamla",)).fetchall() == []
+
+    conn.execute("UPDATE products SET productNameBold = 'Nya' WHERE productId = '1'")
+    assert conn.execute(search, ("nya",)).fetchall() == [(1,)]
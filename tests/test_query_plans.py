@@ -0,0 +1,33 @@
+import sqlite3
+
+import migrations
+import query_plans
+
+
+def test_read_queries_use_indexes():
+    failing = {result['name']: result['problems'] for result in query_plans.check_plans() if result['problems']}
+    assert failing == {}
+
+
+def test_every_allowed_step_is_used():
+    plans = {result['name']: result['plan'] for result in query_plans.check_plans()}
+    for name, steps in query_plans.ALLOWED_STEPS.items():
+        assert name in plans, f"{name} is not a checked query"
+        for step in steps:
+            assert step in plans[name], f"{name} no longer needs '{step}'"
+
+
+def test_checked_database_is_not_migrated(tmp_path):
+    path = tmp_path / "products.db"
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn, target=1)
+    conn.close()
+    before = path.read_bytes()
+
+    results = query_plans.check_plans(str(path))
+
+    assert results
+    assert path.read_bytes() == before
+    conn = sqlite3.connect(path)
+    assert migrations.schema_version(conn) == 1
+    conn.close()
@@ -0,0 +1,171 @@
+import threading
+from datetime import datetime, timezone
+
+import pytest
+from requests import Session
+
+import main
+from mock_api import MockApi, MockApiServer, generate_products
+from ratecontrol import CLOSED, HALF_OPEN, OPEN, RateController, backoff_delay, parse_retry_after
+
+
+class FakeClock:
+    """Monotonic clock that only moves when the controller sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def controller(clock, **kwargs):
+    return RateController(clock=clock, sleep=clock.sleep, rng=lambda: 1.0, **kwargs)
+
+
+def open_circuit(rate, clock):
+    for _ in range(rate.failure_threshold):
+        rate.release(rate.acquire())
+        rate.record_failure(503)
+    assert rate.state == OPEN
+    clock.now += rate.cooldown
+
+
+def test_backoff_is_full_jitter_capped_at_max_delay():
+    assert backoff_delay(3, 2.0, 60.0, rng=lambda: 1.0) == 16.0
+    assert backoff_delay(3, 2.0, 60.0, rng=lambda: 0.25) == 4.0
+    assert backoff_delay(10, 2.0, 60.0, rng=lambda: 1.0) == 60.0
+
+
+def test_retry_after_takes_precedence_over_backoff():
+    assert backoff_delay(0, 2.0, 60.0, retry_after=10.0, rng=lambda: 0.0) == 10.0
+    assert backoff_delay(0, 2.0, 60.0, retry_after=600.0, rng=lambda: 0.0) == 60.0
+    assert parse_retry_after("7") == 7.0
+    now = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    assert parse_retry_after("Mon, 01 Jan 2024 12:00:30 GMT", now=now) == 30.0
+    assert parse_retry_after("soon") is None
+
+    clock = FakeClock()
+    rate = controller(clock)
+    rate.release(rate.acquire())
+    rate.record_failure(429, retry_after=5.0)
+    # Every worker waits out the server's pause before its next request.
+    rate.release(rate.acquire())
+    assert clock.sleeps == [5.0]
+    assert rate.stats()['throttled'] == 1
+
+
+def test_concurrency_is_aimd():
+    clock = FakeClock()
+    rate = controller(clock, initial_concurrency=2, max_concurrency=8, latency_target=1.0)
+    for _ in range(2):
+        rate.record_success(0.1)
+    assert rate.concurrency == 3
+    rate.record_failure(429)
+    assert rate.concurrency == 1
+    rate.record_success(0.1)
+    rate.record_success(5.0)
+    assert rate.concurrency == 1
+
+
+def test_breaker_opens_and_lets_one_probe_through():
+    clock = FakeClock()
+    rate = controller(clock, failure_threshold=3, cooldown=30.0)
+    for _ in range(3):
+        rate.release(rate.acquire())
+        rate.record_failure(503)
+    assert rate.state == OPEN and rate.stats()['circuit_opens'] == 1
+
+    assert rate.acquire() is True
+    assert clock.sleeps == [30.0]
+    assert rate.state == HALF_OPEN
+
+    second = threading.Thread(target=rate.acquire, daemon=True)
+    second.start()
+    second.join(0.2)
+    assert second.is_alive(), "a second request got past the half-open circuit"
+
+    rate.record_success(0.1)
+    rate.release(True)
+    second.join(2.0)
+    assert not second.is_alive()
+    assert rate.state == CLOSED
+
+
+def test_only_the_probe_clears_the_probe_flag():
+    clock = FakeClock()
+    rate = controller(clock, initial_concurrency=2, min_concurrency=2, failure_threshold=2)
+    earlier = rate.acquire()
+    open_circuit(rate, clock)
+    assert rate.acquire() is True
+
+    # A request from before the circuit opened finishing is not the probe.
+    rate.release(earlier)
+    blocked = threading.Thread(target=rate.acquire, daemon=True)
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+
+    rate.record_client_error(404)
+    rate.release(True)
+    blocked.join(2.0)
+    assert not blocked.is_alive()
+
+
+def test_probe_answered_with_client_error_closes_the_circuit():
+    clock = FakeClock()
+    rate = controller(clock, failure_threshold=2)
+    open_circuit(rate, clock)
+    probe = rate.acquire()
+    rate.record_client_error(404)
+    rate.release(probe)
+    assert rate.state == CLOSED
+
+
+def test_probe_without_response_reopens_the_circuit():
+    clock = FakeClock()
+    rate = controller(clock, failure_threshold=2)
+    open_circuit(rate, clock)
+    rate.release(rate.acquire())
+    assert rate.state == OPEN
+
+
+@pytest.fixture
+def products():
+    return generate_products(60)
+
+
+def test_throttled_requests_are_retried(products):
+    api = MockApi(products, throttle_rate=0.5, retry_after=3)
+    clock = FakeClock()
+    rate = controller(clock, max_delay=10.0)
+    with MockApiServer(api) as server, Session() as session:
+        responses = [main.send_api_request(session, f"{server.url}?page=1", {}, rate, retries=20)
+                     for _ in range(10)]
+
+    assert all(response is not None and response.status_code == 200 for response in responses)
+    throttled = api.stats()['throttled']
+    assert throttled > 0
+    assert rate.stats()['throttled'] == throttled
+    # The server's Retry-After was honoured before every retry.
+    assert len(clock.sleeps) == throttled and min(clock.sleeps) >= 3.0
+
+
+def test_failing_server_opens_the_circuit(products):
+    api = MockApi(products, error_rate=1.0)
+    clock = FakeClock()
+    rate = controller(clock, failure_threshold=3, cooldown=30.0, base_delay=0.0)
+    with MockApiServer(api) as server, Session() as session:
+        assert main.send_api_request(session, server.url, {}, rate, retries=4) is None
+
+    # Three failures open the circuit; the fourth attempt is the half-open
+    # probe, and its failure opens the circuit again.
+    assert api.stats()['errors'] == 4
+    assert rate.stats()['circuit_opens'] == 2
+    assert rate.state == OPEN
+    assert 30.0 in clock.sleeps
@@ -1,124 +1,421 @@
 """
 Utility functions for the Systemet price tracker.
 """
+import json
+import math
+import os
+import re
 import sqlite3
-from typing import Dict, List, Tuple, Optional, Any
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Set, Tuple, Optional, Any
 from datetime import datetime, timedelta
 import logging
 
+import db
+import migrations
+from config import get_config
+
 logger = logging.getLogger(__name__)
 
+# Read queries. check-plans (query_plans.py) verifies that every *_SQL
+# constant in this module is answered from an index.
+PRICE_TOTALS_SQL = """
+    SELECT
+        COUNT(*) as total_products,
+        AVG(price) as avg_price,
+        MIN(price) as min_price,
+        MAX(price) as max_price,
+        AVG(apk) as avg_apk,
+        COUNT(CASE WHEN price_change_percentage > 0 THEN 1 END) as price_increases,
+        COUNT(CASE WHEN price_change_percentage < 0 THEN 1 END) as price_decreases,
+        COUNT(CASE WHEN price_change_percentage = 0 THEN 1 END) as price_stable
+    FROM products
+    WHERE delisted = 0
+"""
+
+DELISTED_COUNT_SQL = "SELECT COUNT(*) FROM products WHERE delisted = 1"
+
+CATEGORY_STATS_SQL = """
+    SELECT
+        categoryLevel1,
+        COUNT(*) as count,
+        AVG(price) as avg_price,
+        AVG(apk) as avg_apk
+    FROM products
+    WHERE delisted = 0 AND categoryLevel1 IS NOT NULL
+    GROUP BY categoryLevel1
+    ORDER BY count DESC
+    LIMIT 10
+"""
+
+# Materialized statistics (migration 7), kept current by triggers on products.
+PRODUCT_STATS_SQL = """
+    SELECT
+        listed, delisted,
+        price_sum / NULLIF(price_count, 0),
+        apk_sum / NULLIF(apk_count, 0),
+        increases, decreases, stable
+    FROM product_stats
+    WHERE id = 1
+"""
+
+PRICE_RANGE_SQL = """
+    SELECT
+        (SELECT MIN(price) FROM products WHERE delisted = 0),
+        (SELECT MAX(price) FROM products WHERE delisted = 0)
+"""
+
+CATEGORY_STATS_TABLE_SQL = """
+    SELECT
+        category, products,
+        price_sum / NULLIF(price_count, 0),
+        apk_sum / NULLIF(apk_count, 0)
+    FROM category_stats
+    ORDER BY products DESC
+    LIMIT 10
+"""
+
+BEST_VALUE_SQL = """
+    SELECT
+        productNameBold,
+        productNameThin,
+        price,
+        apk,
+        volume,
+        alcoholPercentage
+    FROM products
+    WHERE delisted = 0 AND apk > 0
+    ORDER BY apk DESC
+    LIMIT 10
+"""
+
+# History is clustered on (productId, ts), so this is one range scan; prices
+# are stored in öre and timestamps as epoch seconds.
+PRICE_HISTORY_SQL = """
+    SELECT price_ore / 100.0, datetime(ts, 'unixepoch')
+    FROM price_history
+    WHERE productId = ? AND ts >= CAST(strftime('%s', ?) AS INTEGER)
+    ORDER BY ts ASC
+"""
+
+PRODUCT_BY_ID_SQL = "SELECT * FROM products WHERE productId = ?"
+
+# Search relevance: bm25 over products_fts with one weight per
+# migrations.SEARCH_COLUMNS (names count most). bm25 is negative, so ordering
+# by it ascending puts the best match first; APK scales it further.
+SEARCH_BM25 = "bm25(products_fts, 4.0, 2.0, 1.0, 1.0)"
+SEARCH_RANK = f"{SEARCH_BM25} * (1 + 0.5 * COALESCE(p.apk, 0))"
+
+SEARCH_PRODUCTS_FTS_SQL = f"""
+    SELECT
+        p.productId, p.productNameBold, p.productNameThin,
+        p.producerName, p.price, p.apk, p.volume, p.alcoholPercentage
+    FROM products_fts
+    JOIN products p ON p.rowid = products_fts.rowid
+    WHERE products_fts MATCH ?
+    ORDER BY {SEARCH_RANK}
+    LIMIT ?
+"""
+
+FUZZY_COLUMNS = """
+    p.productId, p.productNameBold, p.productNameThin,
+    p.producerName, p.price, p.apk, p.volume, p.alcoholPercentage
+"""
+
+# Candidates for fuzzy search: products sharing the most (and rarest) trigrams
+# with the query, best first by the index's bm25 rank.
+FUZZY_CANDIDATES_SQL = f"""
+    SELECT {FUZZY_COLUMNS}
+    FROM products_trigram
+    JOIN products p ON p.rowid = products_trigram.rowid
+    WHERE products_trigram MATCH ?
+    ORDER BY rank
+    LIMIT ?
+"""
+
+# Number of products containing each of the given trigrams (a JSON array).
+TRIGRAM_DOCS_SQL = """
+    SELECT term, doc FROM products_trigram_vocab
+    WHERE term IN (SELECT value FROM json_each(?))
+"""
+
+# Candidates taken from the trigram index before re-ranking by similarity.
+FUZZY_CANDIDATES = 200
+# Fewest query trigrams used to look up candidates.
+FUZZY_MIN_TRIGRAMS = 3
+
+# LIKE fallback for databases without the search index and for substrings
+# that are not word prefixes.
+SEARCH_PRODUCTS_SQL = """
+    SELECT
+        productId, productNameBold, productNameThin,
+        producerName, price, apk, volume, alcoholPercentage
+    FROM products
+    WHERE
+        productNameBold LIKE ? OR
+        productNameThin LIKE ? OR
+        producerName LIKE ?
+    ORDER BY apk DESC
+    LIMIT ?
+"""
+
 def get_database_connection(db_name="products.db"):
-    """Get a configured database connection."""
-    try:
-        conn = sqlite3.connect(db_name)
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
-    except sqlite3.Error as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+    """Get a configured database connection owned by the caller."""
+    return db.connect(db_name)
+
+class LookupCache:
+    """
+    Bounded in-process LRU cache for per-product reads.
+    
+    Entries belong to one database and data generation (db.data_generation).
+    Every lookup reads the generation through the caller's connection, a
+    single primary-key read; once a crawl page batch or another write has
+    bumped it, that database's entries are dropped. A cached value is
+    therefore never older than the last committed batch.
+    """
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+    
+    def lookup(self, conn: sqlite3.Connection, db_name: str, key: tuple, load: Callable[[], Any]) -> Any:
+        """Returns the cached value for key, or calls load() and caches its result."""
+        generation = db.data_generation(conn)
+        if not self.max_entries or generation is None:
+            return load()
+        path = os.path.abspath(db_name)
+        entry_key = (path,) + key
+        with self._lock:
+            if self._generations.get(path) != generation:
+                if path in self._generations:
+                    self.invalidations += 1
+                for stale in [k for k in self._entries if k[0] == path]:
+                    del self._entries[stale]
+                self._generations[path] = generation
+            if entry_key in self._entries:
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return self._entries[entry_key]
+            self.misses += 1
+        # Loaded after the generation was read, so the value is at least that new.
+        value = load()
+        with self._lock:
+            if self._generations.get(path) == generation:
+                self._entries[entry_key] = value
+                self._entries.move_to_end(entry_key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+    
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit and miss counters and the number of cached entries."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'lookups': lookups,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+_lookup_cache: Optional[LookupCache] = None
+
+def get_lookup_cache() -> LookupCache:
+    """Returns the process-wide lookup cache, sized by get_config()['lookup_cache_size']."""
+    global _lookup_cache
+    if _lookup_cache is None:
+        _lookup_cache = LookupCache(get_config()['lookup_cache_size'])
+    return _lookup_cache
+
+def lookup_cache_stats() -> Dict[str, Any]:
+    """Hit and miss counters of the lookup cache (see LookupCache.stats)."""
+    return get_lookup_cache().stats()
+
+def _aggregate_statistics(cursor: sqlite3.Cursor) -> Dict[str, Any]:
+    """Totals and category statistics from full aggregate queries over products."""
+    stats = {}
+    
+    # Basic statistics
+    cursor.execute(PRICE_TOTALS_SQL)
+    
+    row = cursor.fetchone()
+    if row:
+        stats.update({
+            'total_products': row[0],
+            'avg_price': row[1] or 0,
+            'min_price': row[2] or 0,
+            'max_price': row[3] or 0,
+            'avg_apk': row[4] or 0,
+            'price_increases': row[5],
+            'price_decreases': row[6],
+            'price_stable': row[7]
+        })
+    
+    # Products no longer returned by the API
+    cursor.execute(DELISTED_COUNT_SQL)
+    stats['delisted_products'] = cursor.fetchone()[0]
+    
+    # Category statistics
+    cursor.execute(CATEGORY_STATS_SQL)
+    stats['top_categories'] = _category_rows(cursor.fetchall())
+    return stats
+
+def _materialized_statistics(cursor: sqlite3.Cursor) -> Dict[str, Any]:
+    """Totals and category statistics from product_stats and category_stats."""
+    cursor.execute(PRODUCT_STATS_SQL)
+    row = cursor.fetchone() or (0, 0, None, None, 0, 0, 0)
+    cursor.execute(PRICE_RANGE_SQL)
+    min_price, max_price = cursor.fetchone()
+    stats = {
+        'total_products': row[0],
+        'avg_price': row[2] or 0,
+        'min_price': min_price or 0,
+        'max_price': max_price or 0,
+        'avg_apk': row[3] or 0,
+        'price_increases': row[4],
+        'price_decreases': row[5],
+        'price_stable': row[6],
+        'delisted_products': row[1],
+    }
+    cursor.execute(CATEGORY_STATS_TABLE_SQL)
+    stats['top_categories'] = _category_rows(cursor.fetchall())
+    return stats
+
+def _category_rows(rows: List[tuple]) -> List[Dict[str, Any]]:
+    return [
+        {
+            'category': row[0],
+            'count': row[1],
+            'avg_price': row[2] or 0,
+            'avg_apk': row[3] or 0
+        }
+        for row in rows
+    ]
+
+def _best_value(cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    """Best value products (highest APK), read in order from idx_products_listed_apk."""
+    cursor.execute(BEST_VALUE_SQL)
+    return [
+        {
+            'name': f"{row[0]} {row[1]}".strip(),
+            'price': row[2],
+            'apk': row[3],
+            'volume': row[4],
+            'alcohol': row[5]
+        }
+        for row in cursor.fetchall()
+    ]
 
-def get_price_statistics(db_name="products.db") -> Dict[str, Any]:
+def get_price_statistics(db_name="products.db", recompute: bool = False) -> Dict[str, Any]:
     """
     Get comprehensive price statistics from the database.
     
+    Totals and category figures come from the materialized product_stats and
+    category_stats tables, so the cost does not grow with the catalogue.
+    
+    Args:
+        db_name: Database name
+        recompute: Compute everything with aggregate queries over products
+            instead (also used when the tables do not exist yet)
+    
     Returns:
         Dictionary with price statistics
     """
     try:
-        conn = get_database_connection(db_name)
+        conn = db.get_connection(db_name, read_only=True)
         cursor = conn.cursor()
         
-        stats = {}
-        
-        # Basic statistics
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_products,
-                AVG(price) as avg_price,
-                MIN(price) as min_price,
-                MAX(price) as max_price,
-                AVG(apk) as avg_apk,
-                COUNT(CASE WHEN price_change_percentage > 0 THEN 1 END) as price_increases,
-                COUNT(CASE WHEN price_change_percentage < 0 THEN 1 END) as price_decreases,
-                COUNT(CASE WHEN price_change_percentage = 0 THEN 1 END) as price_stable
-            FROM products
-        """)
-        
-        row = cursor.fetchone()
-        if row:
-            stats.update({
-                'total_products': row[0],
-                'avg_price': row[1] or 0,
-                'min_price': row[2] or 0,
-                'max_price': row[3] or 0,
-                'avg_apk': row[4] or 0,
-                'price_increases': row[5],
-                'price_decreases': row[6],
-                'price_stable': row[7]
-            })
-        
-        # Category statistics
-        cursor.execute("""
-            SELECT 
-                categoryLevel1,
-                COUNT(*) as count,
-                AVG(price) as avg_price,
-                AVG(apk) as avg_apk
-            FROM products 
-            WHERE categoryLevel1 IS NOT NULL
-            GROUP BY categoryLevel1
-            ORDER BY count DESC
-            LIMIT 10
-        """)
-        
-        stats['top_categories'] = [
-            {
-                'category': row[0],
-                'count': row[1],
-                'avg_price': row[2] or 0,
-                'avg_apk': row[3] or 0
-            }
-            for row in cursor.fetchall()
-        ]
-        
-        # Best value products (highest APK)
-        cursor.execute("""
-            SELECT 
-                productNameBold,
-                productNameThin,
-                price,
-                apk,
-                volume,
-                alcoholPercentage
-            FROM products 
-            WHERE apk IS NOT NULL AND apk > 0
-            ORDER BY apk DESC
-            LIMIT 10
-        """)
-        
-        stats['best_value'] = [
-            {
-                'name': f"{row[0]} {row[1]}".strip(),
-                'price': row[2],
-                'apk': row[3],
-                'volume': row[4],
-                'alcohol': row[5]
-            }
-            for row in cursor.fetchall()
-        ]
+        if recompute or not migrations.table_exists(conn, "product_stats"):
+            stats = _aggregate_statistics(cursor)
+        else:
+            stats = _materialized_statistics(cursor)
+        stats['best_value'] = _best_value(cursor)
         
-        conn.close()
         return stats
         
     except sqlite3.Error as e:
         logger.error(f"Error getting price statistics: {e}")
         return {}
 
+def _statistics_mismatches(materialized: Dict[str, Any], recomputed: Dict[str, Any]) -> List[str]:
+    """Describes every total or category figure that differs between the two."""
+    def differs(a, b) -> bool:
+        if isinstance(a, float) or isinstance(b, float):
+            return not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+        return a != b
+    
+    mismatches = [
+        f"{key}: {materialized.get(key)} != {recomputed[key]}"
+        for key in ('total_products', 'delisted_products', 'avg_price', 'avg_apk',
+                    'price_increases', 'price_decreases', 'price_stable')
+        if differs(materialized.get(key), recomputed[key])
+    ]
+    categories = {c['category']: c for c in materialized.get('top_categories', [])}
+    for expected in recomputed['top_categories']:
+        actual = categories.get(expected['category'])
+        if actual is None:
+            mismatches.append(f"category {expected['category']}: missing")
+            continue
+        for key in ('count', 'avg_price', 'avg_apk'):
+            if differs(actual[key], expected[key]):
+                mismatches.append(f"category {expected['category']} {key}: {actual[key]} != {expected[key]}")
+    return mismatches
+
+def recompute_price_statistics(db_name="products.db") -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Recomputes the statistics from products, compares them with the
+    materialized tables and rewrites those tables from the full pass.
+    
+    Returns:
+        The recomputed statistics and a description of every materialized
+        value that differed (empty when they matched)
+    """
+    conn = db.connect(db_name)
+    try:
+        migrations.migrate(conn)
+        cursor = conn.cursor()
+        # Both reads see the same snapshot.
+        cursor.execute("BEGIN")
+        try:
+            materialized = _materialized_statistics(cursor)
+            stats = _aggregate_statistics(cursor)
+        finally:
+            conn.rollback()
+        stats['best_value'] = _best_value(cursor)
+        mismatches = _statistics_mismatches(materialized, stats)
+        migrations.recompute_product_stats(conn)
+    finally:
+        conn.close()
+    if mismatches:
+        logger.warning(f"Materialized statistics differed from a full recompute: {'; '.join(mismatches)}")
+    return stats, mismatches
+
 def get_price_history(product_id: str, days: int = 30, db_name="products.db") -> List[Dict]:
     """
     Get price history for a specific product.
     
+    Served from the lookup cache while the data generation is unchanged.
+    Cached rows are filtered by the current cutoff again, so entries that
+    have aged out of the window are not returned.
+    
     Args:
         product_id: Product ID to get history for
         days: Number of days to look back
@@ -128,27 +425,24 @@ def get_price_history(product_id: str, days: int = 30, db_name="products.db") ->
         List of price history entries
     """
     try:
-        conn = get_database_connection(db_name)
-        cursor = conn.cursor()
+        conn = db.get_connection(db_name, read_only=True)
         
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
         
-        cursor.execute("""
-            SELECT price, timestamp
-            FROM price_history
-            WHERE productId = ? AND timestamp >= ?
-            ORDER BY timestamp ASC
-        """, (product_id, cutoff_date.strftime("%Y-%m-%d %H:%M:%S")))
+        rows = get_lookup_cache().lookup(
+            conn, db_name, ('history', product_id, days),
+            lambda: conn.execute(PRICE_HISTORY_SQL, (product_id, cutoff)).fetchall()
+        )
         
         history = [
             {
                 'price': row[0],
                 'timestamp': row[1]
             }
-            for row in cursor.fetchall()
+            for row in rows
+            if row[1] >= cutoff
         ]
         
-        conn.close()
         return history
         
     except sqlite3.Error as e:
@@ -236,7 +530,8 @@ def format_percentage(amount: float) -> str:
 
 def get_product_by_id(product_id: str, db_name="products.db") -> Optional[Dict]:
     """
-    Get a single product by ID.
+    Get a single product by ID, from the lookup cache while the data
+    generation is unchanged.
     
     Args:
         product_id: Product ID to find
@@ -245,30 +540,43 @@ def get_product_by_id(product_id: str, db_name="products.db") -> Optional[Dict]:
     Returns:
         Product data dictionary or None if not found
     """
-    try:
-        conn = get_database_connection(db_name)
+    def load() -> Optional[Dict]:
         cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM products WHERE productId = ?", (product_id,))
+        cursor.execute(PRODUCT_BY_ID_SQL, (product_id,))
         row = cursor.fetchone()
-        
-        if row:
-            # Convert row to dictionary
-            columns = [description[0] for description in cursor.description]
-            product = dict(zip(columns, row))
-            conn.close()
-            return product
-        
-        conn.close()
-        return None
+        if row is None:
+            return None
+        # Convert row to dictionary
+        columns = [description[0] for description in cursor.description]
+        return dict(zip(columns, row))
+    
+    try:
+        conn = db.get_connection(db_name, read_only=True)
+        product = get_lookup_cache().lookup(conn, db_name, ('product', product_id), load)
+        return dict(product) if product is not None else None
         
     except sqlite3.Error as e:
         logger.error(f"Error getting product by ID: {e}")
         return None
 
+def fts_query(text: str) -> Optional[str]:
+    """
+    Turns free text into an FTS5 query in which every word must match as a
+    prefix, e.g. 'gamla röd' -> '"gamla"* "röd"*'. Returns None if the text
+    has no words.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
 def search_products(query: str, limit: int = 50, db_name="products.db") -> List[Dict]:
     """
-    Search products by name or producer.
+    Search products by name, producer or supplier.
+    
+    Uses the products_fts index: every word matches as a prefix, å/ä/ö match
+    a/a/o, and results are ranked by bm25 and APK. Falls back to a LIKE
+    substring search when the index is missing or finds nothing.
     
     Args:
         query: Search query
@@ -279,33 +587,141 @@ def search_products(query: str, limit: int = 50, db_name="products.db") -> List[
         List of matching products
     """
     try:
-        conn = get_database_connection(db_name)
+        conn = db.get_connection(db_name, read_only=True)
         cursor = conn.cursor()
         
-        search_pattern = f"%{query}%"
-        
-        cursor.execute("""
-            SELECT 
-                productId, productNameBold, productNameThin, 
-                producerName, price, apk, volume, alcoholPercentage
-            FROM products
-            WHERE 
-                productNameBold LIKE ? OR 
-                productNameThin LIKE ? OR 
-                producerName LIKE ?
-            ORDER BY apk DESC
-            LIMIT ?
-        """, (search_pattern, search_pattern, search_pattern, limit))
+        rows = []
+        match = fts_query(query)
+        if match is not None and migrations.has_search_index(conn):
+            cursor.execute(SEARCH_PRODUCTS_FTS_SQL, (match, limit))
+            rows = cursor.fetchall()
+        if not rows:
+            search_pattern = f"%{query}%"
+            cursor.execute(SEARCH_PRODUCTS_SQL, (search_pattern, search_pattern, search_pattern, limit))
+            rows = cursor.fetchall()
         
         columns = [description[0] for description in cursor.description]
         products = [
             dict(zip(columns, row))
-            for row in cursor.fetchall()
+            for row in rows
         ]
         
-        conn.close()
         return products
         
     except sqlite3.Error as e:
         logger.error(f"Error searching products: {e}")
-        return [] 
\ No newline at end of file
+        return []
+
+def fold_text(text: str) -> str:
+    """Lowercases text and strips diacritics, so 'Jägermeister' -> 'jagermeister'."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+def trigrams(text: str) -> Set[str]:
+    """
+    Returns the trigrams of the folded words of text. Each word is padded
+    with two leading spaces and one trailing space, so short words and word
+    starts count too ('ab' -> {'  a', ' ab', 'ab '}).
+    """
+    grams = set()
+    for word in re.findall(r"\w+", fold_text(text)):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def name_similarity(query: str, text: Optional[str]) -> float:
+    """
+    Trigram (Jaccard) similarity between the query and the best matching run
+    of as many consecutive words of text as the query has, from 0 to 1.
+    'absolt' scores 0.5 against 'Absolut Vodka'.
+    """
+    query_grams = trigrams(query)
+    words = re.findall(r"\w+", text or "")
+    if not query_grams or not words:
+        return 0.0
+    width = len(re.findall(r"\w+", query))
+    best = 0.0
+    for start in range(max(1, len(words) - width + 1)):
+        grams = trigrams(" ".join(words[start:start + width]))
+        best = max(best, len(query_grams & grams) / len(query_grams | grams))
+    return best
+
+def index_trigrams(text: str) -> Set[str]:
+    """
+    Returns the trigrams products_trigram can look up for the words of text,
+    as typed and with diacritics folded. Words shorter than three characters
+    have none.
+    """
+    grams = set()
+    for word in re.findall(r"\w+", text.lower()) + re.findall(r"\w+", fold_text(text)):
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+def _candidate_query(cursor: sqlite3.Cursor, grams: Set[str]) -> Optional[str]:
+    """
+    Builds the products_trigram query for the rarer half (at least
+    FUZZY_MIN_TRIGRAMS) of the trigrams that occur in the index. Common
+    trigrams match much of the catalogue and would only slow down ranking.
+    """
+    cursor.execute(TRIGRAM_DOCS_SQL, (json.dumps(sorted(grams)),))
+    present = [term for term, _ in sorted(cursor.fetchall(), key=lambda row: (row[1], row[0]))]
+    if not present:
+        return None
+    keep = present[:max(FUZZY_MIN_TRIGRAMS, (len(present) + 1) // 2)]
+    return " OR ".join(f'"{gram}"' for gram in keep)
+
+def fuzzy_search_products(query: str, limit: int = 50, db_name="products.db",
+                          min_similarity: Optional[float] = None) -> List[Dict]:
+    """
+    Typo-tolerant search on product and producer names.
+    
+    The products_trigram index supplies the FUZZY_CANDIDATES products that
+    best match the query's rarer trigrams; they are re-ranked by
+    name_similarity against the product name and the producer name,
+    whichever is higher. Queries without a three-letter word, and databases
+    without the trigram index, use search_products instead.
+    
+    Args:
+        query: Search query, possibly misspelled
+        limit: Maximum number of results
+        db_name: Database name
+        min_similarity: Drop results below this similarity
+            (default: get_config()['fuzzy_min_similarity'])
+        
+    Returns:
+        Matching products, most similar first, each with a 'similarity' key
+    """
+    if min_similarity is None:
+        min_similarity = get_config()['fuzzy_min_similarity']
+    try:
+        conn = db.get_connection(db_name, read_only=True)
+        cursor = conn.cursor()
+        
+        grams = index_trigrams(query)
+        if not grams or not migrations.has_search_index(conn, "products_trigram"):
+            # Too short to be meaningfully misspelled, or no index to find
+            # candidates without scoring every product.
+            return search_products(query, limit, db_name)
+        match = _candidate_query(cursor, grams)
+        if match is None:
+            return []
+        cursor.execute(FUZZY_CANDIDATES_SQL, (match, FUZZY_CANDIDATES))
+        
+        columns = [description[0] for description in cursor.description]
+        products = []
+        for row in cursor.fetchall():
+            product = dict(zip(columns, row))
+            name = f"{product['productNameBold'] or ''} {product['productNameThin'] or ''}"
+            product['similarity'] = max(
+                name_similarity(query, name),
+                name_similarity(query, product['producerName']),
+            )
+            if product['similarity'] >= min_similarity:
+                products.append(product)
+        
+        products.sort(key=lambda product: (-product['similarity'], -(product['apk'] or 0)))
+        return products[:limit]
+        
+    except sqlite3.Error as e:
+        logger.error(f"Error in fuzzy search: {e}")
+        return []